@@ -8,4 +8,6 @@ class TipoAdmin(admin.ModelAdmin):
     list_filter = ('titulo', 'duracao')
 
 
-admin.site.register(Usuario)
+@admin.register(Usuario)
+class UsuarioAdmin(admin.ModelAdmin):
+    list_select_related = ['user']
@@ -0,0 +1,153 @@
+import math
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import date, timedelta
+from io import BytesIO
+from statistics import median
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from cidade_ajuda.base.geo import calcular_celula
+from cidade_ajuda.base.models import Comentario, DensidadeOcorrencias, ImagemOcorrencia, Interacao, Ocorrencia, \
+    ReferenciaArquivo, SequenciaAlteracoes, Tipo, Usuario
+from cidade_ajuda.base.storage import armazenamento_imagens
+
+# São Paulo, Rio de Janeiro, São Carlos e Brasília
+CENTROS = [(-23.5505, -46.6333), (-22.9068, -43.1729), (-22.0087, -47.8909), (-15.7939, -47.8828)]
+
+
+def criar_usuario_e_tipo(apelido='benchmark'):
+    usuario = Usuario.objects.create('Benchmark', 'Benchmark', apelido, date(1990, 1, 1),
+                                     email='{}@mail.com'.format(apelido), password='password')
+    tipo = Tipo.objects.create(titulo='Benchmark', sugestao_descricao='Benchmark', duracao=timedelta(hours=6))
+    return usuario, tipo
+
+
+def gerar_ocorrencias(quantidade, usuarios, tipos, centros=CENTROS, dispersao=0.15, fracao_espalhada=0.2,
+                      tamanho_lote=5000, semente=None):
+    """Insere ocorrências agrupadas em torno dos centros, com uma fração espalhada pelo globo."""
+    aleatorio = random.Random(semente)
+    agora = timezone.now()
+
+    def nova_ocorrencia():
+        if aleatorio.random() < fracao_espalhada:
+            latitude, longitude = aleatorio.uniform(-90, 90), aleatorio.uniform(-180, 180)
+        else:
+            centro_latitude, centro_longitude = aleatorio.choice(centros)
+            latitude = min(max(aleatorio.gauss(centro_latitude, dispersao), -90), 90)
+            longitude = min(max(aleatorio.gauss(centro_longitude, dispersao), -180), 180)
+        tipo = aleatorio.choice(tipos)
+        return Ocorrencia(usuario=aleatorio.choice(usuarios), tipo=tipo, latitude=latitude, longitude=longitude,
+                          celula=calcular_celula(latitude, longitude), prazo_termino=agora + tipo.duracao,
+                          transitavel_veiculo=aleatorio.random() < 0.5, transitavel_a_pe=aleatorio.random() < 0.5,
+                          descricao='Ocorrência sintética')
+
+    while quantidade > 0:
+        lote = [nova_ocorrencia() for _ in range(min(quantidade, tamanho_lote))]
+        # Como em ``bulk_create_validated``: a sequência avança na transação que grava o lote.
+        with transaction.atomic():
+            sequencia = SequenciaAlteracoes.objects.proxima()
+            for ocorrencia in lote:
+                ocorrencia.sequencia = ocorrencia.sequencia_criacao = sequencia
+            Ocorrencia.objects.bulk_create(lote)
+            DensidadeOcorrencias.objects.somar(Counter((ocorrencia.celula, ocorrencia.tipo_id) for ocorrencia in lote))
+        quantidade -= len(lote)
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE {}'.format(connection.ops.quote_name(Ocorrencia._meta.db_table)))
+
+
+def _em_lotes(valores, tamanho=500):
+    valores = list(valores)
+    for inicio in range(0, len(valores), tamanho):
+        yield valores[inicio:inicio + tamanho]
+
+
+def gerar_usuarios(quantidade):
+    """Insere usuários, com os seus tokens, e os devolve; todos têm a senha ``password``."""
+    senha = make_password('password')
+    # Um prefixo por chamada: contar os usuários existentes repetiria nomes depois de remoções.
+    prefixo = uuid.uuid4().hex[:12]
+    apelidos = ['sintetico-{}-{}'.format(prefixo, i) for i in range(quantidade)]
+    User.objects.bulk_create([User(username=apelido, first_name='Usuário', last_name='Sintético', password=senha,
+                                   email='{}@mail.com'.format(apelido)) for apelido in apelidos])
+
+    users = [user for lote in _em_lotes(apelidos) for user in User.objects.filter(username__in=lote)]
+    tokens = [Token(user=user) for user in users]
+    for token in tokens:
+        token.key = token.generate_key()
+    Token.objects.bulk_create(tokens)
+    Usuario.objects.bulk_create([Usuario(user=user, data_nascimento=date(1990, 1, 1)) for user in users])
+    return [usuario for lote in _em_lotes(users) for usuario in Usuario.objects.filter(user__in=lote)]
+
+
+def gerar_interacoes(quantidade, usuarios, ocorrencia_ids, semente=None):
+    """Insere respostas únicas por usuário e ocorrência e atualiza os contadores que elas alimentam."""
+    aleatorio = random.Random(semente)
+    quantidade = min(quantidade, len(usuarios) * len(ocorrencia_ids))
+    respostas = ['EX'] * 6 + ['IN'] * 2 + ['FI'] * 2
+
+    pares = set()
+    while len(pares) < quantidade:
+        pares.add((aleatorio.choice(usuarios).id, aleatorio.choice(ocorrencia_ids)))
+    interacoes = [Interacao(usuario_id=usuario_id, ocorrencia_id=ocorrencia_id, resposta=aleatorio.choice(respostas))
+                  for usuario_id, ocorrencia_id in sorted(pares)]
+    Interacao.objects.bulk_create(interacoes)
+
+    contadores = Counter((interacao.ocorrencia_id, interacao.resposta) for interacao in interacoes)
+    ocorrencias = [ocorrencia for lote in _em_lotes({ocorrencia_id for ocorrencia_id, _ in contadores})
+                   for ocorrencia in Ocorrencia.objects.filter(id__in=lote).only(
+                       'id', *Interacao.objects.CONTADORES.values())]
+    for ocorrencia in ocorrencias:
+        for resposta, campo in Interacao.objects.CONTADORES.items():
+            setattr(ocorrencia, campo, getattr(ocorrencia, campo) + contadores[ocorrencia.id, resposta])
+    Ocorrencia.objects.bulk_update(ocorrencias, list(Interacao.objects.CONTADORES.values()))
+
+    for usuario_id, respostas_usuario in Counter(interacao.usuario_id for interacao in interacoes).items():
+        Usuario.objects.filter(id=usuario_id).update(quantidade_respostas=F('quantidade_respostas') +
+                                                     respostas_usuario)
+
+
+def gerar_comentarios(quantidade, usuarios, ocorrencia_ids, semente=None):
+    aleatorio = random.Random(semente)
+    Comentario.objects.bulk_create([Comentario(usuario=aleatorio.choice(usuarios),
+                                               ocorrencia_id=aleatorio.choice(ocorrencia_ids),
+                                               texto='Comentário sintético') for _ in range(quantidade)])
+
+
+def gerar_imagens(quantidade, ocorrencia_ids, semente=None):
+    """Insere imagens que apontam todas para um mesmo arquivo, como as fotos repetidas de produção."""
+    aleatorio = random.Random(semente)
+    conteudo = BytesIO()
+    Image.new('RGB', (640, 480), (90, 120, 150)).save(conteudo, 'JPEG')
+    nome = armazenamento_imagens.save('ocorrencias/sintetica.jpg', ContentFile(conteudo.getvalue()))
+
+    ImagemOcorrencia.objects.bulk_create([ImagemOcorrencia(ocorrencia_id=aleatorio.choice(ocorrencia_ids),
+                                                           imagem=nome) for _ in range(quantidade)])
+    referencia, _ = ReferenciaArquivo.objects.get_or_create(nome=nome)
+    ReferenciaArquivo.objects.filter(id=referencia.id).update(referencias=F('referencias') + quantidade)
+
+
+def percentil(valores, fracao):
+    """Percentil pelo método do posto mais próximo; ``fracao`` vai de 0 a 1."""
+    ordenados = sorted(valores)
+    return ordenados[max(int(math.ceil(fracao * len(ordenados))) - 1, 0)]
+
+
+def medir(funcao, repeticoes=5, relogio=time.perf_counter):
+    """Mediana, em segundos, do tempo de execução de ``funcao`` medido por ``relogio``."""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = relogio()
+        funcao()
+        tempos.append(relogio() - inicio)
+    return median(tempos)
@@ -0,0 +1,57 @@
+import hashlib
+import threading
+import uuid
+
+from django.core.cache import cache
+
+CHAVE_VERSAO_TIPOS = 'cidade_ajuda:tipos:versao'
+
+_trava = threading.Lock()
+_versao = None
+_tipos = {}
+
+
+def _versao_tipos():
+    versao = cache.get(CHAVE_VERSAO_TIPOS)
+    if versao is None:
+        cache.add(CHAVE_VERSAO_TIPOS, uuid.uuid4().hex, None)
+        versao = cache.get(CHAVE_VERSAO_TIPOS)
+    return versao
+
+
+def obter_tipos():
+    """Todos os tipos por id, lidos do banco só quando a versão compartilhada muda.
+
+    A versão fica no cache do Django, então um tipo salvo ou removido em qualquer worker invalida a cópia dos outros.
+    """
+    global _versao, _tipos
+    from cidade_ajuda.base.models import Tipo
+
+    versao = _versao_tipos()
+    with _trava:
+        if versao is None or versao != _versao:
+            _tipos = {tipo.id: tipo for tipo in Tipo.objects.order_by('id')}
+            _versao = versao
+        return _tipos
+
+
+def obter_tipo(tipo_id):
+    return obter_tipos().get(tipo_id)
+
+
+def invalidar_tipos():
+    global _versao
+    cache.set(CHAVE_VERSAO_TIPOS, uuid.uuid4().hex, None)
+    with _trava:
+        _versao = None
+
+
+def chave_token(key):
+    # O token não vai em claro para o cache.
+    return 'cidade_ajuda:token:{}'.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+def invalidar_tokens(keys):
+    keys = list(keys)
+    if keys:
+        cache.delete_many([chave_token(key) for key in keys])
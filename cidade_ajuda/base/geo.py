@@ -0,0 +1,193 @@
+from math import asin, atan, cos, degrees, floor, pi, radians, sin, sinh
+
+import numpy as np
+
+TAMANHO_CELULA = 0.05
+LINHAS = int(round(180 / TAMANHO_CELULA))
+COLUNAS = int(round(360 / TAMANHO_CELULA))
+
+# Acima disso a área é coberta por uma única faixa de linhas inteiras.
+MAXIMO_FAIXAS = 32
+
+# Limite de elementos das matrizes pontos x arestas do teste de contenção.
+ELEMENTOS_POR_BLOCO = 1 << 20
+
+
+# Quantidade de clusters por lado de um tile de mapa.
+CLUSTERS_POR_TILE = 8
+
+# Máximo de clusters no maior lado da área pedida; zooms mais próximos que isso são reduzidos.
+CLUSTERS_POR_AREA = 64
+
+# Raio médio da Terra, em metros.
+RAIO_TERRA = 6371008.8
+
+
+def tamanho_cluster(zoom):
+    return 360 / (2 ** zoom) / CLUSTERS_POR_TILE
+
+
+def zoom_na_area(zoom, sul, oeste, norte, leste):
+    """O maior zoom, até ``zoom``, cuja grade de clusters cobre a área com até ``CLUSTERS_POR_AREA`` por lado."""
+    lado = max(norte - sul, sum(fim - inicio for inicio, fim in intervalos_longitude(oeste, leste)))
+    while zoom > 0 and lado / tamanho_cluster(zoom) > CLUSTERS_POR_AREA:
+        zoom -= 1
+    return zoom
+
+
+def limites_tile(zoom, x, y):
+    """Limites (sul, oeste, norte, leste) do tile z/x/y do padrão de tiles do OpenStreetMap."""
+    n = 2 ** zoom
+    oeste = x / n * 360 - 180
+    leste = (x + 1) / n * 360 - 180
+    norte = degrees(atan(sinh(pi * (1 - 2 * y / n))))
+    sul = degrees(atan(sinh(pi * (1 - 2 * (y + 1) / n))))
+    return sul, oeste, norte, leste
+
+
+def _linha(latitude):
+    return min(max(int(floor((latitude + 90) / TAMANHO_CELULA)), 0), LINHAS - 1)
+
+
+def _coluna(longitude):
+    return min(max(int(floor((longitude + 180) / TAMANHO_CELULA)), 0), COLUNAS - 1)
+
+
+def calcular_celula(latitude, longitude):
+    return _linha(latitude) * COLUNAS + _coluna(longitude)
+
+
+def centro_celula(celula):
+    """Latitude e longitude do centro da célula."""
+    linha, coluna = divmod(celula, COLUNAS)
+    return (linha + 0.5) * TAMANHO_CELULA - 90, (coluna + 0.5) * TAMANHO_CELULA - 180
+
+
+def area_do_raio(latitude, longitude, raio):
+    """Menor área (sul, oeste, norte, leste) que contém o círculo de ``raio`` metros em torno do ponto."""
+    angulo = min(raio / RAIO_TERRA, pi)
+    sul, norte = latitude - degrees(angulo), latitude + degrees(angulo)
+    if sul <= -90 or norte >= 90:
+        # O círculo contém um polo: todas as longitudes.
+        return max(sul, -90), -180, min(norte, 90), 180
+
+    abertura = sin(angulo) / cos(radians(latitude))
+    if abertura >= 1:
+        return sul, -180, norte, 180
+    delta = degrees(asin(abertura))
+    oeste, leste = longitude - delta, longitude + delta
+    return sul, oeste + 360 if oeste < -180 else oeste, norte, leste - 360 if leste > 180 else leste
+
+
+def distancias(latitude, longitude, latitudes, longitudes):
+    """Distâncias, em metros, do ponto a cada um dos pontos dos arrays, pela fórmula de haversine."""
+    fi, lambda_ = radians(latitude), radians(longitude)
+    fis, lambdas = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((fis - fi) / 2) ** 2 + cos(fi) * np.cos(fis) * np.sin((lambdas - lambda_) / 2) ** 2
+    return 2 * RAIO_TERRA * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def intervalos_longitude(oeste, leste):
+    if oeste <= leste:
+        return [(oeste, leste)]
+    # A área cruza o antimeridiano.
+    return [(oeste, 180), (-180, leste)]
+
+
+def faixas_colunas(oeste, leste):
+    """Intervalos de colunas (inclusivos) que cobrem as longitudes de oeste a leste."""
+    return [(_coluna(inicio), _coluna(fim)) for inicio, fim in intervalos_longitude(oeste, leste)]
+
+
+def faixas_celulas(sul, oeste, norte, leste):
+    """Intervalos contíguos de células (inclusivos) que cobrem a área."""
+    if sul > norte:
+        return []
+
+    linha_inicial, linha_final = _linha(sul), _linha(norte)
+    colunas = faixas_colunas(oeste, leste)
+
+    if (linha_final - linha_inicial + 1) * len(colunas) > MAXIMO_FAIXAS:
+        return [(linha_inicial * COLUNAS, linha_final * COLUNAS + COLUNAS - 1)]
+
+    faixas = sorted((linha * COLUNAS + inicio, linha * COLUNAS + fim)
+                    for linha in range(linha_inicial, linha_final + 1)
+                    for inicio, fim in colunas)
+
+    unidas = [faixas[0]]
+    for inicio, fim in faixas[1:]:
+        if inicio <= unidas[-1][1] + 1:
+            unidas[-1] = (unidas[-1][0], max(fim, unidas[-1][1]))
+        else:
+            unidas.append((inicio, fim))
+    return unidas
+
+
+def _dentro_do_anel(anel, longitudes, latitudes):
+    xa, ya, xb, yb = anel[:-1, 0], anel[:-1, 1], anel[1:, 0], anel[1:, 1]
+    x, y = longitudes[:, None], latitudes[:, None]
+    cruzamentos = np.zeros(len(longitudes), dtype=np.int64)
+
+    bloco = max(1, ELEMENTOS_POR_BLOCO // max(len(longitudes), 1))
+    for inicio in range(0, len(xa), bloco):
+        fim = inicio + bloco
+        cruza = (ya[inicio:fim] > y) != (yb[inicio:fim] > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intersecao = xa[inicio:fim] + (y - ya[inicio:fim]) * (xb[inicio:fim] - xa[inicio:fim]) / (
+                yb[inicio:fim] - ya[inicio:fim])
+        cruzamentos += np.count_nonzero(cruza & (x < intersecao), axis=1)
+
+    return cruzamentos % 2 == 1
+
+
+class Regiao:
+    """Polygon ou MultiPolygon GeoJSON preparado para testes de contenção vetorizados."""
+
+    def __init__(self, geometria):
+        if geometria.get('type') == 'Polygon':
+            poligonos = [geometria['coordinates']]
+        elif geometria.get('type') == 'MultiPolygon':
+            poligonos = geometria['coordinates']
+        else:
+            raise ValueError('Geometria precisa ser Polygon ou MultiPolygon')
+
+        self.poligonos = []
+        for poligono in poligonos:
+            aneis = []
+            for anel in poligono:
+                anel = np.asarray(anel, dtype=float)
+                if anel.ndim != 2 or anel.shape[1] < 2 or len(anel) < 3:
+                    raise ValueError('Anel precisa ter ao menos 3 pontos')
+                anel = anel[:, :2]
+                if not np.array_equal(anel[0], anel[-1]):
+                    anel = np.vstack([anel, anel[:1]])
+                aneis.append(anel)
+            self.poligonos.append(aneis)
+
+        if not self.poligonos:
+            raise ValueError('Geometria vazia')
+
+        pontos = np.concatenate([anel for aneis in self.poligonos for anel in aneis])
+        self.oeste, self.sul = (float(valor) for valor in pontos.min(axis=0))
+        self.leste, self.norte = (float(valor) for valor in pontos.max(axis=0))
+
+    def contem(self, longitudes, latitudes):
+        longitudes = np.asarray(longitudes, dtype=float)
+        latitudes = np.asarray(latitudes, dtype=float)
+
+        dentro = np.zeros(len(longitudes), dtype=bool)
+        for aneis in self.poligonos:
+            # Regra par-ímpar: pontos nos buracos cruzam o contorno externo e o do buraco.
+            paridade = np.zeros(len(longitudes), dtype=bool)
+            for anel in aneis:
+                paridade ^= _dentro_do_anel(anel, longitudes, latitudes)
+            dentro |= paridade
+        return dentro
+
+    def filtrar(self, linhas):
+        """Recebe tuplas (id, latitude, longitude) e devolve os ids contidos na região."""
+        if not linhas:
+            return []
+        dados = np.asarray(linhas, dtype=float)
+        ids = np.asarray([linha[0] for linha in linhas])
+        return ids[self.contem(dados[:, 2], dados[:, 1])].tolist()
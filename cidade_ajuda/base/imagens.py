@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Maior lado, em pixels, de cada variante gerada a partir da imagem original.
+VARIANTES = {
+    'miniatura': 256,
+    'reduzida': 1280,
+}
+FORMATO = 'WEBP'
+EXTENSAO = 'webp'
+QUALIDADE = 80
+# O original é recodificado, para perder os metadados da foto, no formato em que foi enviado quando este é um
+# dos abaixo; os demais viram WEBP. O maior lado é limitado porque o WEBP não passa de 16383 pixels.
+FORMATOS_ORIGINAL = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+}
+TAMANHO_ORIGINAL = 4096
+QUALIDADE_ORIGINAL = 90
+
+_trava = threading.Lock()
+_executor = None
+
+
+def caminho_variante(instance, filename):
+    return os.path.join(instance.imagem.field.upload_to, 'variantes', filename)
+
+
+def _codificar(imagem, tamanho, qualidade=QUALIDADE, formato=FORMATO):
+    variante = imagem.copy()
+    variante.thumbnail((tamanho, tamanho), Image.LANCZOS)
+    if formato == 'JPEG' and variante.mode != 'RGB':
+        variante = variante.convert('RGB')
+    conteudo = BytesIO()
+    # Sem ``exif=``, o Pillow não copia os metadados (incluindo a localização) da foto original.
+    opcoes = {'method': 4} if formato == 'WEBP' else {}
+    variante.save(conteudo, formato, quality=qualidade, **opcoes)
+    return ContentFile(conteudo.getvalue())
+
+
+def gerar_variantes(instance):
+    """Gera as variantes da ``imagem`` de uma ImagemOcorrencia ou ImagemComentario e grava os seus caminhos.
+
+    A própria ``imagem`` é trocada por uma cópia sem metadados; o arquivo enviado deixa de ser referenciado.
+    """
+    instance.imagem.open('rb')
+    try:
+        with Image.open(instance.imagem) as original:
+            formato = original.format if original.format in FORMATOS_ORIGINAL else FORMATO
+            imagem = ImageOps.exif_transpose(original)
+            if imagem.mode not in ('RGB', 'RGBA'):
+                imagem = imagem.convert('RGBA' if 'A' in imagem.getbands() else 'RGB')
+    finally:
+        instance.imagem.close()
+
+    nome = os.path.splitext(os.path.basename(instance.imagem.name))[0]
+    variantes = {campo: _codificar(imagem, tamanho) for campo, tamanho in VARIANTES.items()}
+    original = _codificar(imagem, TAMANHO_ORIGINAL, QUALIDADE_ORIGINAL, formato)
+    # Os arquivos são reservados e contados na mesma transação; veja ``ArmazenamentoPorConteudo``.
+    with transaction.atomic():
+        for campo, conteudo in variantes.items():
+            getattr(instance, campo).save('{}_{}.{}'.format(nome, campo, EXTENSAO), conteudo, save=False)
+        instance.imagem.save('{}.{}'.format(nome, FORMATOS_ORIGINAL[formato]), original, save=False)
+        instance.processamento_falhou = False
+        instance.save(update_fields=list(VARIANTES) + ['imagem', 'processamento_falhou'])
+
+
+def marcar_falha(instance):
+    """Registra que as variantes não puderam ser geradas; ``processar_imagens`` tenta de novo."""
+    type(instance).objects.filter(id=instance.id).update(processamento_falhou=True)
+
+
+def _processar(modelo, imagem_id):
+    instance = None
+    try:
+        instance = modelo.objects.filter(id=imagem_id).first()
+        if instance is not None:
+            gerar_variantes(instance)
+    except Exception:
+        logger.exception('Falha ao processar a imagem %s %s', modelo.__name__, imagem_id)
+        if instance is not None:
+            marcar_falha(instance)
+    finally:
+        connections.close_all()
+
+
+def _obter_executor():
+    global _executor
+    with _trava:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGENS_PROCESSADORES,
+                                           thread_name_prefix='imagens')
+        return _executor
+
+
+def agendar_processamento(instance):
+    """Processa a imagem no pool de workers, fora da thread da requisição."""
+    return _obter_executor().submit(_processar, type(instance), instance.id)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cidade_ajuda.base.benchmark import criar_usuario_e_tipo, gerar_ocorrencias, medir
+from cidade_ajuda.base.models import Ocorrencia
+
+# Região central de São Paulo, do tamanho de uma tela de mapa
+SUL, OESTE, NORTE, LESTE = -23.60, -46.70, -23.50, -46.58
+
+
+def consulta_sem_grade():
+    return Ocorrencia.objects.filter(latitude__gte=SUL, longitude__gte=OESTE, latitude__lte=NORTE,
+                                     longitude__lte=LESTE)
+
+
+def consulta_com_grade():
+    return Ocorrencia.objects.na_area(SUL, OESTE, NORTE, LESTE)
+
+
+class Command(BaseCommand):
+    help = 'Compara a latência da consulta por área antes e depois da grade espacial. Nada é gravado no banco.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quantidades', nargs='+', type=int, default=[10000, 100000, 1000000])
+        parser.add_argument('--repeticoes', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            usuario, tipo = criar_usuario_e_tipo()
+            existentes = 0
+
+            for quantidade in sorted(options['quantidades']):
+                gerar_ocorrencias(quantidade - existentes, [usuario], [tipo], semente=quantidade)
+                existentes = quantidade
+
+                antes = medir(lambda: list(consulta_sem_grade().values_list('id', flat=True)), options['repeticoes'])
+                depois = medir(lambda: list(consulta_com_grade().values_list('id', flat=True)), options['repeticoes'])
+                self.stdout.write('{:>9} ocorrências ({} na área): antes {:8.2f} ms, depois {:8.2f} ms ({:.1f}x)'.format(
+                    quantidade, consulta_com_grade().count(), antes * 1000, depois * 1000, antes / depois))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cidade_ajuda.base.models import Ocorrencia
+
+
+class Command(BaseCommand):
+    help = 'Desativa as ocorrências cujo prazo de término já passou.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500, help='Ocorrências desativadas por transação.')
+        parser.add_argument('--continuo', action='store_true', help='Repete a varredura até ser interrompido.')
+        parser.add_argument('--intervalo', type=float, default=60, help='Segundos entre varreduras contínuas.')
+
+    def varrer(self, tamanho_lote):
+        total, inicio = 0, time.monotonic()
+        for quantidade, duracao in Ocorrencia.objects.expirar(tamanho_lote=tamanho_lote):
+            total += quantidade
+            self.stdout.write('Lote: {} ocorrências desativadas em {:.1f} ms'.format(quantidade, duracao * 1000))
+        self.stdout.write('Total: {} ocorrências desativadas em {:.1f} ms'.format(
+            total, (time.monotonic() - inicio) * 1000))
+
+    def handle(self, *args, **options):
+        if not options['continuo']:
+            self.varrer(options['lote'])
+            return
+
+        try:
+            while True:
+                close_old_connections()
+                self.varrer(options['lote'])
+                time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            pass
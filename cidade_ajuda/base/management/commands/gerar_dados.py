@@ -0,0 +1,59 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cidade_ajuda.base.benchmark import gerar_comentarios, gerar_imagens, gerar_interacoes, gerar_ocorrencias, \
+    gerar_usuarios
+from cidade_ajuda.base.models import Ocorrencia, Tipo
+
+TIPOS = [
+    ('Alagamento', 'Tamanho, correnteza e risco para quem passa.', timedelta(hours=6)),
+    ('Buraco', 'Tamanho e em qual faixa da via ele está.', timedelta(days=7)),
+    ('Acidente', 'Veículos envolvidos e faixas bloqueadas.', timedelta(hours=2)),
+    ('Árvore caída', 'Se bloqueia a via ou a calçada.', timedelta(days=1)),
+    ('Semáforo quebrado', 'Cruzamento e se há agente de trânsito no local.', timedelta(hours=12)),
+]
+
+
+class Command(BaseCommand):
+    help = 'Gera dados sintéticos em volumes de produção: usuários, ocorrências agrupadas em torno de centros ' \
+           'urbanos, respostas, comentários e imagens.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=1000)
+        parser.add_argument('--ocorrencias', type=int, default=100000)
+        parser.add_argument('--interacoes', type=int, default=200000)
+        parser.add_argument('--comentarios', type=int, default=50000)
+        parser.add_argument('--imagens', type=int, default=20000)
+        parser.add_argument('--semente', type=int, default=0)
+
+    def etapa(self, nome, funcao):
+        inicio = time.monotonic()
+        resultado = funcao()
+        self.stdout.write('{:<12} {:8.1f} s'.format(nome, time.monotonic() - inicio))
+        return resultado
+
+    def handle(self, *args, **options):
+        semente = options['semente']
+
+        with transaction.atomic():
+            tipos = list(Tipo.objects.all())
+            if not tipos:
+                tipos = [Tipo.objects.create(titulo=titulo, sugestao_descricao=sugestao, duracao=duracao)
+                         for titulo, sugestao, duracao in TIPOS]
+
+            usuarios = self.etapa('usuários', lambda: gerar_usuarios(max(options['usuarios'], 1)))
+            ultimo_id = Ocorrencia.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            self.etapa('ocorrências', lambda: gerar_ocorrencias(options['ocorrencias'], usuarios, tipos,
+                                                                 semente=semente))
+            ocorrencia_ids = list(Ocorrencia.objects.filter(id__gt=ultimo_id).values_list('id', flat=True))
+            if not ocorrencia_ids:
+                return
+
+            self.etapa('interações', lambda: gerar_interacoes(options['interacoes'], usuarios, ocorrencia_ids,
+                                                               semente=semente))
+            self.etapa('comentários', lambda: gerar_comentarios(options['comentarios'], usuarios, ocorrencia_ids,
+                                                                 semente=semente))
+            self.etapa('imagens', lambda: gerar_imagens(options['imagens'], ocorrencia_ids, semente=semente))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from cidade_ajuda.base.imagens import gerar_variantes, marcar_falha
+from cidade_ajuda.base.models import ImagemComentario, ImagemOcorrencia
+
+
+class Command(BaseCommand):
+    help = 'Gera as variantes das imagens que ainda não foram processadas, por exemplo depois de um restart ' \
+           'que interrompeu o pool de processamento ou de uma falha ao processá-las.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todas', action='store_true', help='Gera de novo as variantes de todas as imagens.')
+
+    def handle(self, *args, **options):
+        for modelo in [ImagemOcorrencia, ImagemComentario]:
+            imagens = modelo.objects.order_by('id')
+            if not options['todas']:
+                imagens = imagens.filter(miniatura='')
+
+            total, erros = 0, 0
+            for imagem in imagens.iterator():
+                try:
+                    gerar_variantes(imagem)
+                    total += 1
+                except (OSError, ValueError) as erro:
+                    erros += 1
+                    marcar_falha(imagem)
+                    self.stderr.write('{} {}: {}'.format(modelo.__name__, imagem.id, erro))
+            self.stdout.write('{}: {} imagens processadas, {} com erro'.format(modelo.__name__, total, erros))
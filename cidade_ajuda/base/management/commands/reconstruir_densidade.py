@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from cidade_ajuda.base.models import DensidadeOcorrencias
+
+
+class Command(BaseCommand):
+    help = 'Recalcula do zero a densidade de ocorrências ativas por célula e Tipo usada pelo heatmap.'
+
+    def handle(self, *args, **options):
+        celulas = DensidadeOcorrencias.objects.reconstruir()
+        self.stdout.write('{} células com ocorrências ativas'.format(celulas))
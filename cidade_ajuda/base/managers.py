@@ -1,10 +1,28 @@
-from datetime import date
+import time
+from collections import Counter
+from datetime import date, timedelta
+from math import floor
+from functools import reduce
+from itertools import islice
+from operator import or_
 
+import numpy as np
+
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Case, Count, DurationField, ExpressionWrapper, F, IntegerField, Max, Q, Subquery, Sum, \
+    Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Floor, Mod
 from django.utils import timezone
 
+from cidade_ajuda.base.cache import obter_tipo
+from cidade_ajuda.base.geo import COLUNAS, TAMANHO_CELULA, area_do_raio, calcular_celula, centro_celula, distancias, \
+    faixas_celulas, faixas_colunas, intervalos_longitude, tamanho_cluster
+
 
 class UsuarioManager(models.Manager):
     use_in_migrations = True
@@ -41,11 +59,335 @@ class UsuarioManager(models.Manager):
         return usuario
 
 
-class OcorrenciaManager(models.Manager):
-    def create(self, usuario=None, tipo=None, transitavel_veiculo=True, transitavel_a_pe=True,
-               descricao=None, latitude=None, longitude=None):
+class ReferenciaArquivoManager(models.Manager):
+    def reservar(self, nome):
+        """Trava a referência do arquivo, criando-a se preciso, até o fim da transação em andamento.
+
+        Chamada pelo armazenamento antes de reaproveitar ou gravar o arquivo: a remoção do arquivo trava a mesma
+        linha, então ou ela termina antes (e o arquivo é gravado de novo) ou espera o upload ser contado.
+        """
+        with transaction.atomic(using=self._db, savepoint=False):
+            self.select_for_update().get_or_create(nome=nome)
+
+    def adicionar(self, nomes):
+        for nome in nomes:
+            with transaction.atomic(using=self._db):
+                referencia, _ = self.select_for_update().get_or_create(nome=nome)
+                self.filter(pk=referencia.pk).update(referencias=F('referencias') + 1)
+
+    def remover(self, nomes, storage):
+        """Decrementa as referências e apaga, depois do commit, os arquivos que ficaram sem nenhuma."""
+        for nome in nomes:
+            with transaction.atomic(using=self._db):
+                referencia = self.select_for_update().filter(nome=nome).first()
+                if referencia is None:
+                    continue
+                if referencia.referencias > 1:
+                    self.filter(pk=referencia.pk).update(referencias=F('referencias') - 1)
+                else:
+                    referencia.delete()
+                    transaction.on_commit(lambda nome=nome: self._apagar_arquivo(nome, storage), using=self._db)
+
+    def _apagar_arquivo(self, nome, storage):
+        # Um upload do mesmo conteúdo pode ter voltado a referenciar o arquivo desde o commit. A linha é travada (ou
+        # criada, o que bloqueia a criação pelo ``reservar`` de outra transação) enquanto o arquivo é apagado.
+        with transaction.atomic(using=self._db):
+            referencia, _ = self.select_for_update().get_or_create(nome=nome)
+            if referencia.referencias == 0:
+                storage.delete(nome)
+                referencia.delete()
+
+
+class SequenciaAlteracoesManager(models.Manager):
+    """Valores que ordenam as alterações das ocorrências.
+
+    No PostgreSQL eles vêm de uma sequence, que não trava nada e por isso não enfileira as escritas; em troca, os
+    valores podem ser confirmados fora de ordem (veja ``confirmada``). Nos outros bancos vêm do contador de uma
+    linha, cujo ``UPDATE`` a trava até o commit.
+    """
+    SEQUENCE = 'base_sequenciaalteracoes_seq'
+
+    def _usa_sequence(self, using):
+        return connections[using].vendor == 'postgresql'
+
+    def proxima(self, using=None):
+        """Avança a sequência e devolve o novo valor. Precisa ser chamada dentro da transação que grava a alteração."""
+        using = using or self.db
+        if self._usa_sequence(using):
+            with connections[using].cursor() as cursor:
+                cursor.execute('SELECT nextval(%s)', [self.SEQUENCE])
+                return cursor.fetchone()[0]
+
+        contador = self.db_manager(using)
+        if not contador.filter(id=1).update(valor=F('valor') + 1):
+            contador.create(id=1, valor=1)
+        return contador.filter(id=1).values_list('valor', flat=True).get()
+
+    def proxima_em_update(self, update, using=None):
+        """Chama ``update(sequencia)``, um update em massa, e devolve quantas linhas ele alterou.
+
+        ``sequencia`` é uma expressão com o próximo valor, avaliada pelo próprio ``UPDATE``: a sequência só avança
+        se alguma linha mudar.
+        """
+        using = using or self.db
+        if self._usa_sequence(using):
+            # Subconsulta sem correlação: o PostgreSQL a avalia uma só vez, quando a primeira linha é alterada.
+            return update(RawSQL('(SELECT nextval(%s))', [self.SEQUENCE]))
+
+        valor = Subquery(self.db_manager(using).filter(id=1).values('valor'))
+        with transaction.atomic(using=using):
+            quantidade = update(Coalesce(valor, 0, output_field=models.BigIntegerField()) + 1)
+            if quantidade:
+                self.proxima(using=using)
+        return quantidade
+
+    def atual(self, using=None):
+        """Último valor entregue pela sequência."""
+        using = using or self.db
+        if self._usa_sequence(using):
+            with connections[using].cursor() as cursor:
+                cursor.execute('SELECT CASE WHEN is_called THEN last_value ELSE last_value - 1 END FROM {}'.format(
+                    connections[using].ops.quote_name(self.SEQUENCE)))
+                return cursor.fetchone()[0]
+        return self.db_manager(using).filter(id=1).values_list('valor', flat=True).first() or 0
+
+    def confirmada(self, using=None):
+        """Valor até o qual todas as alterações já foram confirmadas e estão visíveis para a leitura.
+
+        Com o contador, é o atual: ele só avança no commit da alteração que o usou. Com a sequence, uma alteração
+        com valor menor pode ainda não ter sido confirmada; o limite é então a última alteração gravada há mais que
+        ``ALTERACOES_JANELA`` segundos, prazo em que se supõe que toda transação que escreve ocorrências termina.
+        """
+        using = using or self.db
+        if not self._usa_sequence(using):
+            return self.atual(using)
+
+        limite = timezone.now() - timedelta(seconds=settings.ALTERACOES_JANELA)
+        return apps.get_model('base', 'Ocorrencia').objects.using(using).filter(atualizado_em__lte=limite).order_by(
+            '-sequencia').values_list('sequencia', flat=True).first() or 0
+
+    def bloquear_alteracoes(self, using=None):
+        """Espera as escritas de ocorrências em andamento e bloqueia novas até o fim da transação."""
+        using = using or self.db
+        if not self._usa_sequence(using):
+            # Toda escrita passa pelo contador, então travá-lo basta.
+            self.proxima(using=using)
+            return
+
+        tabela = apps.get_model('base', 'Ocorrencia')._meta.db_table
+        with connections[using].cursor() as cursor:
+            cursor.execute('LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE'.format(
+                connections[using].ops.quote_name(tabela)))
+
+
+class OcorrenciaQuerySet(models.QuerySet):
+    # Raios, em frações do raio pedido, dos anéis da busca das mais próximas.
+    FRACOES_RAIO = (1 / 16, 1 / 4, 1)
+
+    def na_area(self, sul, oeste, norte, leste):
+        faixas = faixas_celulas(sul, oeste, norte, leste)
+        if not faixas:
+            return self.none()
+
+        celulas = reduce(or_, (Q(celula__range=faixa) for faixa in faixas))
+        longitudes = reduce(or_, (Q(longitude__gte=inicio, longitude__lte=fim)
+                                  for inicio, fim in intervalos_longitude(oeste, leste)))
+        return self.filter(celulas).filter(longitudes, latitude__gte=sul, latitude__lte=norte)
+
+    def update(self, **kwargs):
+        # ``auto_now`` e a sequência de ``save()`` não valem aqui; updates em massa também marcam a alteração.
+        kwargs.setdefault('atualizado_em', timezone.now())
+        if 'sequencia' in kwargs:
+            return super().update(**kwargs)
+        return apps.get_model('base', 'SequenciaAlteracoes').objects.proxima_em_update(
+            lambda sequencia: super(OcorrenciaQuerySet, self).update(sequencia=sequencia, **kwargs), using=self.db)
+
+    def alteradas_desde(self, sequencia, ocorrencia_id=None, ate=None):
+        """Ocorrências alteradas depois da posição ``(sequencia, ocorrencia_id)``, na ordem da sequência."""
+        alteradas = Q(sequencia__gt=sequencia)
+        if ocorrencia_id is not None:
+            alteradas |= Q(sequencia=sequencia, id__gt=ocorrencia_id)
+        queryset = self.filter(alteradas)
+        if ate is not None:
+            queryset = queryset.filter(sequencia__lte=ate)
+        return queryset.order_by('sequencia', 'id')
+
+    def assinatura(self):
+        """Quantidade, maior id e última alteração das ocorrências: muda sempre que alguma delas muda."""
+        return self.order_by().aggregate(quantidade=Count('id'), ultimo_id=Max('id'),
+                                         atualizado_em=Max('atualizado_em'))
+
+    def expiradas(self, agora=None):
+        return self.filter(esta_ativa=True, prazo_termino__lte=agora or timezone.now())
+
+    def desativar(self, encerramento=None, tamanho_lote=500):
+        """Desativa as ocorrências ativas do queryset, descontando-as da densidade. Devolve quantas desativou.
+
+        ``encerramento`` (um datetime ou uma expressão, agora por padrão) é gravado em ``data_hora_encerramento``.
+        As linhas são travadas antes da leitura, então uma ocorrência desativada ao mesmo tempo por outra
+        transação (duas expirações simultâneas, por exemplo) é descontada uma única vez.
+        """
+        encerramento = encerramento if encerramento is not None else timezone.now()
+        with transaction.atomic(using=self.db, savepoint=False):
+            linhas = list(self.filter(esta_ativa=True).select_for_update().values_list('id', 'celula', 'tipo'))
+            quantidade = 0
+            for inicio in range(0, len(linhas), tamanho_lote):
+                ids = [linha[0] for linha in linhas[inicio:inicio + tamanho_lote]]
+                quantidade += self.model.objects.using(self.db).filter(id__in=ids).update(
+                    esta_ativa=False, data_hora_encerramento=encerramento)
+
+            variacoes = Counter()
+            for _, celula, tipo_id in linhas:
+                variacoes[celula, tipo_id] -= 1
+            apps.get_model('base', 'DensidadeOcorrencias').objects.db_manager(self.db).somar(variacoes)
+        return quantidade
+
+    def agrupar(self, zoom):
+        """Agrupa as ocorrências em uma grade proporcional ao zoom, com a contagem por Tipo de cada grupo."""
+        tamanho = tamanho_cluster(zoom)
+        grupos = self.order_by().annotate(
+            grupo_x=Floor((F('longitude') + 180) / tamanho),
+            grupo_y=Floor((F('latitude') + 90) / tamanho),
+        ).values('grupo_x', 'grupo_y', 'tipo').annotate(
+            quantidade=Count('id'), soma_latitude=Sum('latitude'), soma_longitude=Sum('longitude'))
+
+        clusters = {}
+        for grupo in grupos:
+            cluster = clusters.setdefault((grupo['grupo_x'], grupo['grupo_y']), {
+                'soma_latitude': 0, 'soma_longitude': 0, 'quantidade': 0, 'tipos': {}})
+            cluster['soma_latitude'] += grupo['soma_latitude']
+            cluster['soma_longitude'] += grupo['soma_longitude']
+            cluster['quantidade'] += grupo['quantidade']
+            cluster['tipos'][grupo['tipo']] = grupo['quantidade']
+
+        return [{'latitude': cluster['soma_latitude'] / cluster['quantidade'],
+                 'longitude': cluster['soma_longitude'] / cluster['quantidade'],
+                 'quantidade': cluster['quantidade'],
+                 'tipos': cluster['tipos']}
+                for _, cluster in sorted(clusters.items())]
+
+    def ids_na_regiao(self, regiao, tamanho_lote=2000):
+        """Gera, lote a lote, os ids das ocorrências contidas em uma ``geo.Regiao``."""
+        candidatas = self.na_area(regiao.sul, regiao.oeste, regiao.norte, regiao.leste).order_by('id')
+
+        ultimo_id = 0
+        while True:
+            lote = list(candidatas.filter(id__gt=ultimo_id).values_list('id', 'latitude', 'longitude')[:tamanho_lote])
+            if not lote:
+                break
+            ids = regiao.filtrar(lote)
+            if ids:
+                yield ids
+            ultimo_id = lote[-1][0]
+
+    def resumo(self, lotes_ids, agora=None, tamanho_lote=500):
+        """Totais por Tipo das ocorrências com os ids gerados, lote a lote, por ``lotes_ids``.
+
+        Cada lote é somado por uma consulta agrupada, sem instanciar as ocorrências. ``ativas`` são as ocorrências
+        ativas e no prazo; as demais, encerradas ou já vencidas, contam como ``expiradas``. O tempo médio até o
+        encerramento é dado em segundos.
+        """
+        agora = agora or timezone.now()
+        ativa = Q(esta_ativa=True, prazo_termino__gt=agora)
+        encerrada = Q(data_hora_encerramento__isnull=False)
+        somas = {
+            'quantidade': Count('id'),
+            'ativas': Count('id', filter=ativa),
+            'encerradas': Count('id', filter=encerrada),
+            'tempo_encerramento': Sum(ExpressionWrapper(F('data_hora_encerramento') - F('data_hora_criacao'),
+                                                        output_field=DurationField()), filter=encerrada),
+            'quantidade_existente': Sum('quantidade_existente'),
+            'quantidade_inexistente': Sum('quantidade_inexistente'),
+            'quantidade_caso_encerrado': Sum('quantidade_caso_encerrado'),
+        }
+
+        por_tipo = {}
+        for ids in lotes_ids:
+            for inicio in range(0, len(ids), tamanho_lote):
+                grupos = self.filter(id__in=ids[inicio:inicio + tamanho_lote]).order_by().values('tipo').annotate(
+                    **somas)
+                for grupo in grupos:
+                    total = por_tipo.setdefault(grupo['tipo'], dict.fromkeys(somas, 0))
+                    for campo in somas:
+                        valor = grupo[campo] or 0
+                        total[campo] += valor.total_seconds() if isinstance(valor, timedelta) else valor
+
+        def finalizar(total):
+            tempo = total.pop('tempo_encerramento')
+            encerradas = total.pop('encerradas')
+            total['expiradas'] = total['quantidade'] - total['ativas']
+            total['tempo_medio_encerramento'] = tempo / encerradas if encerradas else None
+            return total
+
+        geral = dict.fromkeys(somas, 0)
+        for total in por_tipo.values():
+            for campo in somas:
+                geral[campo] += total[campo]
+        resumo = finalizar(geral)
+        resumo['por_tipo'] = [dict(tipo=tipo, **finalizar(total)) for tipo, total in sorted(por_tipo.items())]
+        return resumo
+
+    def proximas(self, latitude, longitude, raio, k, tamanho_lote=2000):
+        """Ids e distâncias, em metros, das ``k`` ocorrências mais próximas do ponto a até ``raio`` metros dele.
+
+        A busca vai de dentro para fora, em anéis de ``FRACOES_RAIO`` do raio: a área de cada anel contém o seu
+        círculo, então, quando já há ``k`` ocorrências dentro dele, as que estão fora são mais distantes e a busca
+        para. Reler a área do anel anterior custa pouco, porque cada anel tem 16 vezes a área do anterior.
+        """
+        for fracao in self.FRACOES_RAIO:
+            ids, distancias_ids = self._mais_proximas(latitude, longitude, raio * fracao, k, tamanho_lote)
+            if len(ids) == k:
+                break
+
+        # Empates são desfeitos pelo id, para que a resposta não dependa da ordem de leitura.
+        ordem = np.lexsort((ids, distancias_ids))
+        return [(int(ids[i]), float(distancias_ids[i])) for i in ordem]
+
+    def _mais_proximas(self, latitude, longitude, raio, k, tamanho_lote):
+        # As candidatas vêm da área que contém o círculo, pelo índice da célula, e as distâncias são calculadas lote
+        # a lote; só as ``k`` melhores ficam entre os lotes, então a memória não depende da densidade da área.
+        candidatas = self.na_area(*area_do_raio(latitude, longitude, raio)).order_by().values_list(
+            'id', 'latitude', 'longitude').iterator(chunk_size=tamanho_lote)
+        ids, distancias_ids = np.empty(0, dtype=np.int64), np.empty(0)
+        while True:
+            lote = list(islice(candidatas, tamanho_lote))
+            if not lote:
+                break
+            pontos = np.array(lote, dtype=float)
+            distancias_lote = distancias(latitude, longitude, pontos[:, 1], pontos[:, 2])
+            dentro = distancias_lote <= raio
+            ids = np.concatenate([ids, pontos[dentro, 0].astype(np.int64)])
+            distancias_ids = np.concatenate([distancias_ids, distancias_lote[dentro]])
+            if len(ids) > k:
+                melhores = np.argpartition(distancias_ids, k - 1)[:k]
+                ids, distancias_ids = ids[melhores], distancias_ids[melhores]
+        return ids, distancias_ids
+
+    def valores_na_regiao(self, regiao, campos, tamanho_lote=2000):
+        """Gera as linhas ``.values(*campos)`` das ocorrências contidas em uma ``geo.Regiao``.
+
+        As candidatas são lidas por um único cursor (no servidor, no PostgreSQL), ``tamanho_lote`` linhas por vez,
+        então a memória usada não depende do tamanho da região. ``campos`` precisa incluir latitude e longitude.
+        """
+        linhas = self.na_area(regiao.sul, regiao.oeste, regiao.norte, regiao.leste).order_by('id').values(
+            *campos).iterator(chunk_size=tamanho_lote)
+        while True:
+            lote = list(islice(linhas, tamanho_lote))
+            if not lote:
+                return
+            contidas = regiao.contem([linha['longitude'] for linha in lote], [linha['latitude'] for linha in lote])
+            for linha, contida in zip(lote, contidas):
+                if contida:
+                    yield linha
+
+
+class OcorrenciaManager(models.Manager.from_queryset(OcorrenciaQuerySet)):
+    def _nova_ocorrencia(self, usuario=None, tipo=None, transitavel_veiculo=True, transitavel_a_pe=True,
+                         descricao=None, latitude=None, longitude=None, data_hora_criacao=None):
         if not usuario:
             raise ValueError('Ocorrencia precisa ter um Usuario')
+        if isinstance(tipo, int):
+            tipo = obter_tipo(tipo)
         if not tipo or tipo.__class__.__name__ != 'Tipo':
             raise ValueError('Ocorrencia precisa ter um Tipo')
         if not latitude:
@@ -61,18 +403,167 @@ class OcorrenciaManager(models.Manager):
         quantidade_existente = 1
         quantidade_inexistente = 0
         quantidade_caso_encerrado = 0
-        data_hora_criacao = timezone.now()
+        data_hora_criacao = data_hora_criacao or timezone.now()
         prazo_termino = data_hora_criacao + tipo.duracao
 
-        ocorrencia = self.model(usuario=usuario, tipo=tipo, esta_ativa=esta_ativa, data_hora_criacao=data_hora_criacao,
-                                transitavel_veiculo=transitavel_veiculo,
-                                transitavel_a_pe=transitavel_a_pe, descricao=descricao,
-                                quantidade_existente=quantidade_existente,
-                                quantidade_inexistente=quantidade_inexistente,
-                                quantidade_caso_encerrado=quantidade_caso_encerrado, latitude=latitude,
-                                longitude=longitude, prazo_termino=prazo_termino)
+        return self.model(usuario=usuario, tipo=tipo, esta_ativa=esta_ativa, data_hora_criacao=data_hora_criacao,
+                          transitavel_veiculo=transitavel_veiculo,
+                          transitavel_a_pe=transitavel_a_pe, descricao=descricao,
+                          quantidade_existente=quantidade_existente,
+                          quantidade_inexistente=quantidade_inexistente,
+                          quantidade_caso_encerrado=quantidade_caso_encerrado, latitude=latitude,
+                          longitude=longitude, prazo_termino=prazo_termino,
+                          celula=calcular_celula(latitude, longitude))
+
+    def create(self, usuario=None, tipo=None, transitavel_veiculo=True, transitavel_a_pe=True,
+               descricao=None, latitude=None, longitude=None):
+        ocorrencia = self._nova_ocorrencia(usuario=usuario, tipo=tipo, transitavel_veiculo=transitavel_veiculo,
+                                           transitavel_a_pe=transitavel_a_pe, descricao=descricao,
+                                           latitude=latitude, longitude=longitude)
         ocorrencia.save()
         return ocorrencia
 
+    def bulk_create_validated(self, usuario, ocorrencias, tamanho_lote=1000):
+        """Valida e insere uma lista de dicionários de ocorrências com ``bulk_create``.
+
+        ``tipo`` pode ser um ``Tipo`` ou o seu id, que é resolvido pelo cache de tipos sem consultar o banco.
+        Devolve as ocorrências criadas e um dicionário ``índice -> mensagem de erro`` com as rejeitadas.
+        """
+        data_hora_criacao = timezone.now()
+        validas, erros = [], {}
+        for indice, dados in enumerate(ocorrencias):
+            try:
+                validas.append(self._nova_ocorrencia(
+                    usuario=usuario, tipo=dados.get('tipo'),
+                    transitavel_veiculo=dados.get('transitavel_veiculo', True),
+                    transitavel_a_pe=dados.get('transitavel_a_pe', True), descricao=dados.get('descricao'),
+                    latitude=dados.get('latitude'), longitude=dados.get('longitude'),
+                    data_hora_criacao=data_hora_criacao))
+            except ValueError as erro:
+                erros[indice] = str(erro)
+
+        criadas = []
+        with transaction.atomic(using=self._db):
+            sequencia = apps.get_model('base', 'SequenciaAlteracoes').objects.proxima(using=self._db)
+            for ocorrencia in validas:
+                ocorrencia.sequencia = ocorrencia.sequencia_criacao = sequencia
+            for inicio in range(0, len(validas), tamanho_lote):
+                criadas.extend(self.bulk_create(validas[inicio:inicio + tamanho_lote]))
+            # O bulk_create não envia post_save, então a densidade é somada aqui.
+            apps.get_model('base', 'DensidadeOcorrencias').objects.db_manager(self._db).somar(
+                Counter((ocorrencia.celula, ocorrencia.tipo_id) for ocorrencia in criadas))
+        return criadas, erros
+
     def all(self):
         return super().all().order_by('id')
+
+    def expirar(self, agora=None, tamanho_lote=500):
+        """Desativa, em lotes, as ocorrências ativas com prazo vencido. Gera a quantidade e a duração de cada lote."""
+        agora = agora or timezone.now()
+        while True:
+            inicio = time.monotonic()
+            with transaction.atomic(using=self._db):
+                ids = list(self.expiradas(agora).order_by('prazo_termino').values_list('id', flat=True)[:tamanho_lote])
+                if not ids:
+                    return
+                # A ocorrência expirada terminou no prazo, não no momento em que a expiração rodou.
+                quantidade = self.expiradas(agora).filter(id__in=ids).desativar(encerramento=F('prazo_termino'))
+            yield quantidade, time.monotonic() - inicio
+
+
+class InteracaoManager(models.Manager):
+    CONTADORES = {
+        'EX': 'quantidade_existente',
+        'IN': 'quantidade_inexistente',
+        'FI': 'quantidade_caso_encerrado',
+    }
+
+    def create(self, usuario=None, ocorrencia=None, resposta=None):
+        if not usuario:
+            raise ValueError('Interacao precisa ter um Usuario')
+        if not ocorrencia:
+            raise ValueError('Interacao precisa ter uma Ocorrencia')
+        if resposta not in self.CONTADORES:
+            raise ValueError('Resposta invalida')
+
+        contador = self.CONTADORES[resposta]
+        with transaction.atomic(using=self._db):
+            interacao = self.model(usuario=usuario, ocorrencia=ocorrencia, resposta=resposta)
+            interacao.save(using=self._db)
+
+            type(ocorrencia).objects.filter(pk=ocorrencia.pk).update(**{contador: F(contador) + 1})
+            type(usuario).objects.filter(pk=usuario.pk).update(quantidade_respostas=F('quantidade_respostas') + 1)
+        return interacao
+
+
+class DensidadeOcorrenciasQuerySet(models.QuerySet):
+    def na_area(self, sul, oeste, norte, leste):
+        faixas = faixas_celulas(sul, oeste, norte, leste)
+        if not faixas:
+            return self.none()
+
+        celulas = reduce(or_, (Q(celula__range=faixa) for faixa in faixas))
+        # Em áreas grandes as faixas são linhas inteiras da grade; a coluna descarta o que está fora das longitudes.
+        colunas = reduce(or_, (Q(coluna__range=faixa) for faixa in faixas_colunas(oeste, leste)))
+        coluna = Mod('celula', Value(COLUNAS, output_field=IntegerField()))
+        return self.filter(celulas).annotate(coluna=coluna).filter(colunas)
+
+    def agrupar(self, zoom):
+        """Soma as células em uma grade proporcional ao zoom, no formato de ``OcorrenciaQuerySet.agrupar``.
+
+        A posição de cada grupo é a média dos centros das suas células, ponderada pelas quantidades.
+        """
+        tamanho = max(tamanho_cluster(zoom), TAMANHO_CELULA)
+
+        grupos = {}
+        for celula, tipo_id, quantidade in self.filter(quantidade__gt=0).values_list('celula', 'tipo', 'quantidade'):
+            latitude, longitude = centro_celula(celula)
+            grupo = grupos.setdefault((floor((longitude + 180) / tamanho), floor((latitude + 90) / tamanho)), {
+                'soma_latitude': 0, 'soma_longitude': 0, 'quantidade': 0, 'tipos': {}})
+            grupo['soma_latitude'] += latitude * quantidade
+            grupo['soma_longitude'] += longitude * quantidade
+            grupo['quantidade'] += quantidade
+            grupo['tipos'][tipo_id] = grupo['tipos'].get(tipo_id, 0) + quantidade
+
+        return [{'latitude': grupo['soma_latitude'] / grupo['quantidade'],
+                 'longitude': grupo['soma_longitude'] / grupo['quantidade'],
+                 'quantidade': grupo['quantidade'],
+                 'tipos': grupo['tipos']}
+                for _, grupo in sorted(grupos.items())]
+
+
+class DensidadeOcorrenciasManager(models.Manager.from_queryset(DensidadeOcorrenciasQuerySet)):
+    TAMANHO_LOTE = 100
+
+    def somar(self, variacoes):
+        """Soma ``{(celula, tipo_id): variação}`` às quantidades, criando as células que ainda não existem."""
+        variacoes = sorted((chave, valor) for chave, valor in variacoes.items() if valor)
+        if not variacoes:
+            return
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            novas = [self.model(celula=celula, tipo_id=tipo_id) for (celula, tipo_id), valor in variacoes if valor > 0]
+            if novas:
+                self.bulk_create(novas, ignore_conflicts=True)
+
+            for inicio in range(0, len(variacoes), self.TAMANHO_LOTE):
+                lote = variacoes[inicio:inicio + self.TAMANHO_LOTE]
+                self.filter(reduce(or_, (Q(celula=celula, tipo_id=tipo_id) for (celula, tipo_id), _ in lote))).update(
+                    quantidade=F('quantidade') + Case(
+                        *[When(celula=celula, tipo_id=tipo_id, then=Value(valor)) for (celula, tipo_id), valor in lote],
+                        default=Value(0), output_field=IntegerField()))
+
+    def reconstruir(self):
+        """Recalcula as quantidades a partir das ocorrências ativas. Devolve quantas células ficaram.
+
+        As escritas de ocorrências ficam bloqueadas até o commit, então nenhuma muda entre a contagem e a gravação.
+        """
+        with transaction.atomic(using=self.db):
+            apps.get_model('base', 'SequenciaAlteracoes').objects.bloquear_alteracoes(using=self.db)
+            contagens = apps.get_model('base', 'Ocorrencia').objects.using(self.db).filter(
+                esta_ativa=True).order_by().values_list('celula', 'tipo').annotate(quantidade=Count('id'))
+            celulas = [self.model(celula=celula, tipo_id=tipo_id, quantidade=quantidade)
+                       for celula, tipo_id, quantidade in contagens]
+            self.all().delete()
+            self.bulk_create(celulas)
+        return len(celulas)
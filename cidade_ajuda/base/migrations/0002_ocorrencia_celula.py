@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+from cidade_ajuda.base.geo import calcular_celula
+
+TAMANHO_LOTE = 2000
+
+
+def preencher_celulas(apps, schema_editor):
+    Ocorrencia = apps.get_model('base', 'Ocorrencia')
+    pendentes = Ocorrencia.objects.filter(celula__isnull=True).only('id', 'latitude', 'longitude').order_by('id')
+
+    ultimo_id = 0
+    while True:
+        lote = list(pendentes.filter(id__gt=ultimo_id)[:TAMANHO_LOTE])
+        if not lote:
+            break
+        for ocorrencia in lote:
+            ocorrencia.celula = calcular_celula(ocorrencia.latitude, ocorrencia.longitude)
+        Ocorrencia.objects.bulk_update(lote, ['celula'])
+        ultimo_id = lote[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ocorrencia',
+            name='celula',
+            field=models.IntegerField(editable=False, null=True, verbose_name='célula'),
+        ),
+        migrations.RunPython(preencher_celulas, migrations.RunPython.noop),
+    ]
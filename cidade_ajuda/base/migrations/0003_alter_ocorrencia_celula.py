@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0002_ocorrencia_celula'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ocorrencia',
+            name='celula',
+            field=models.IntegerField(db_index=True, editable=False, help_text='Célula da grade espacial que contém a ocorrência', verbose_name='célula'),
+        ),
+    ]
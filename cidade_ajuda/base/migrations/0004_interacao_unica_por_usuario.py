@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_alter_ocorrencia_celula'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='interacao',
+            constraint=models.UniqueConstraint(fields=('usuario', 'ocorrencia'), name='interacao_unica_por_usuario'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0004_interacao_unica_por_usuario'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ocorrencia',
+            index=models.Index(fields=['esta_ativa', 'prazo_termino'], name='ocorrencia_ativa_prazo_idx'),
+        ),
+    ]
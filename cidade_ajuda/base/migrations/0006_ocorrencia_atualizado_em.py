@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:00
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def preencher_atualizado_em(apps, schema_editor):
+    Ocorrencia = apps.get_model('base', 'Ocorrencia')
+    Ocorrencia.objects.update(atualizado_em=F('data_hora_criacao'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_ocorrencia_ativa_prazo_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ocorrencia',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now,
+                                       help_text='Momento da última alteração da ocorrência',
+                                       verbose_name='atualizado em'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(preencher_atualizado_em, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+def iniciar_sequencia(apps, schema_editor):
+    # As ocorrências existentes entram todas na primeira posição da sequência.
+    Ocorrencia = apps.get_model('base', 'Ocorrencia')
+    SequenciaAlteracoes = apps.get_model('base', 'SequenciaAlteracoes')
+    Ocorrencia.objects.update(sequencia=1, sequencia_criacao=1)
+    SequenciaAlteracoes.objects.create(id=1, valor=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_ocorrencia_atualizado_em'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenciaAlteracoes',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valor', models.BigIntegerField(default=0, verbose_name='valor')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ocorrencia',
+            name='sequencia',
+            field=models.BigIntegerField(default=0, editable=False, help_text='Posição da última alteração da ocorrência na sequência de alterações', verbose_name='sequência'),
+        ),
+        migrations.AddField(
+            model_name='ocorrencia',
+            name='sequencia_criacao',
+            field=models.BigIntegerField(default=0, editable=False, help_text='Posição da criação da ocorrência na sequência de alterações', verbose_name='sequência de criação'),
+        ),
+        migrations.AddIndex(
+            model_name='ocorrencia',
+            index=models.Index(fields=['sequencia', 'id'], name='ocorrencia_sequencia_idx'),
+        ),
+        migrations.RunPython(iniciar_sequencia, migrations.RunPython.noop),
+    ]
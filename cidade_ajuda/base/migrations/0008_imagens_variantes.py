@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:26
+
+import cidade_ajuda.base.imagens
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_sequencia_alteracoes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagemcomentario',
+            name='miniatura',
+            field=models.ImageField(blank=True, editable=False, upload_to=cidade_ajuda.base.imagens.caminho_variante, verbose_name='Miniatura'),
+        ),
+        migrations.AddField(
+            model_name='imagemcomentario',
+            name='reduzida',
+            field=models.ImageField(blank=True, editable=False, upload_to=cidade_ajuda.base.imagens.caminho_variante, verbose_name='Imagem reduzida'),
+        ),
+        migrations.AddField(
+            model_name='imagemocorrencia',
+            name='miniatura',
+            field=models.ImageField(blank=True, editable=False, upload_to=cidade_ajuda.base.imagens.caminho_variante, verbose_name='Miniatura'),
+        ),
+        migrations.AddField(
+            model_name='imagemocorrencia',
+            name='reduzida',
+            field=models.ImageField(blank=True, editable=False, upload_to=cidade_ajuda.base.imagens.caminho_variante, verbose_name='Imagem reduzida'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:29
+
+from collections import Counter
+
+import cidade_ajuda.base.imagens
+import cidade_ajuda.base.storage
+from django.db import migrations, models
+
+
+def contar_referencias(apps, schema_editor):
+    ReferenciaArquivo = apps.get_model('base', 'ReferenciaArquivo')
+    contagem = Counter()
+    for modelo in ['ImagemOcorrencia', 'ImagemComentario']:
+        imagens = apps.get_model('base', modelo).objects.values_list('imagem', 'miniatura', 'reduzida')
+        for nomes in imagens.iterator():
+            contagem.update(nome for nome in nomes if nome)
+    ReferenciaArquivo.objects.bulk_create([ReferenciaArquivo(nome=nome, referencias=referencias)
+                                           for nome, referencias in contagem.items()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_imagens_variantes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferenciaArquivo',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=255, unique=True, verbose_name='nome')),
+                ('referencias', models.PositiveIntegerField(default=0, verbose_name='referências')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='imagemcomentario',
+            name='imagem',
+            field=models.ImageField(storage=cidade_ajuda.base.storage.ArmazenamentoPorConteudo(), upload_to='comentarios', verbose_name='Imagem'),
+        ),
+        migrations.AlterField(
+            model_name='imagemcomentario',
+            name='miniatura',
+            field=models.ImageField(blank=True, editable=False, storage=cidade_ajuda.base.storage.ArmazenamentoPorConteudo(), upload_to=cidade_ajuda.base.imagens.caminho_variante, verbose_name='Miniatura'),
+        ),
+        migrations.AlterField(
+            model_name='imagemcomentario',
+            name='reduzida',
+            field=models.ImageField(blank=True, editable=False, storage=cidade_ajuda.base.storage.ArmazenamentoPorConteudo(), upload_to=cidade_ajuda.base.imagens.caminho_variante, verbose_name='Imagem reduzida'),
+        ),
+        migrations.AlterField(
+            model_name='imagemocorrencia',
+            name='imagem',
+            field=models.ImageField(storage=cidade_ajuda.base.storage.ArmazenamentoPorConteudo(), upload_to='ocorrencias', verbose_name='Imagem'),
+        ),
+        migrations.AlterField(
+            model_name='imagemocorrencia',
+            name='miniatura',
+            field=models.ImageField(blank=True, editable=False, storage=cidade_ajuda.base.storage.ArmazenamentoPorConteudo(), upload_to=cidade_ajuda.base.imagens.caminho_variante, verbose_name='Miniatura'),
+        ),
+        migrations.AlterField(
+            model_name='imagemocorrencia',
+            name='reduzida',
+            field=models.ImageField(blank=True, editable=False, storage=cidade_ajuda.base.storage.ArmazenamentoPorConteudo(), upload_to=cidade_ajuda.base.imagens.caminho_variante, verbose_name='Imagem reduzida'),
+        ),
+        migrations.RunPython(contar_referencias, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:48
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def contar_ocorrencias(apps, schema_editor):
+    DensidadeOcorrencias = apps.get_model('base', 'DensidadeOcorrencias')
+    contagens = apps.get_model('base', 'Ocorrencia').objects.filter(esta_ativa=True).order_by().values_list(
+        'celula', 'tipo').annotate(quantidade=Count('id'))
+    DensidadeOcorrencias.objects.bulk_create([
+        DensidadeOcorrencias(celula=celula, tipo_id=tipo_id, quantidade=quantidade)
+        for celula, tipo_id, quantidade in contagens])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_armazenamento_por_conteudo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DensidadeOcorrencias',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('celula', models.IntegerField(verbose_name='célula')),
+                ('quantidade', models.IntegerField(default=0, verbose_name='quantidade')),
+                ('tipo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.Tipo', verbose_name='Tipo')),
+            ],
+            options={
+                'unique_together': {('celula', 'tipo')},
+            },
+        ),
+        migrations.RunPython(contar_ocorrencias, migrations.RunPython.noop),
+    ]
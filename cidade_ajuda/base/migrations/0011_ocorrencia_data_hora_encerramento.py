@@ -0,0 +1,27 @@
+from django.db import migrations, models
+from django.db.models.functions import Least
+
+
+def preencher_encerramento(apps, schema_editor):
+    # Antes só a expiração desativava ocorrências; a última alteração limita as desativadas antes do prazo.
+    Ocorrencia = apps.get_model('base', 'Ocorrencia')
+    Ocorrencia.objects.filter(esta_ativa=False).update(
+        data_hora_encerramento=Least('prazo_termino', 'atualizado_em'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_densidade_ocorrencias'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ocorrencia',
+            name='data_hora_encerramento',
+            field=models.DateTimeField(blank=True, editable=False,
+                                       help_text='Momento em que a ocorrência deixou de estar ativa', null=True,
+                                       verbose_name='data e hora de encerramento'),
+        ),
+        migrations.RunPython(preencher_encerramento, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_ocorrencia_data_hora_encerramento'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comentario',
+            index=models.Index(fields=['ocorrencia', 'data_hora'], name='comentario_ocorrencia_idx'),
+        ),
+    ]
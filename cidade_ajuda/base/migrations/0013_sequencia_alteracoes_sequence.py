@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 21:10
+
+from django.db import migrations
+
+
+def criar_sequence(apps, schema_editor):
+    # Só o PostgreSQL usa a sequence; ela continua de onde o contador parou.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE SEQUENCE base_sequenciaalteracoes_seq')
+    schema_editor.execute("SELECT setval('base_sequenciaalteracoes_seq', "
+                          "(SELECT GREATEST(MAX(valor), 1) FROM base_sequenciaalteracoes))")
+
+
+def remover_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("UPDATE base_sequenciaalteracoes SET valor = (SELECT last_value "
+                          "FROM base_sequenciaalteracoes_seq) WHERE id = 1")
+    schema_editor.execute('DROP SEQUENCE base_sequenciaalteracoes_seq')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0012_comentario_ocorrencia_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_sequence, remover_sequence),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0013_sequencia_alteracoes_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagemcomentario',
+            name='processamento_falhou',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Falha ao gerar as variantes'),
+        ),
+        migrations.AddField(
+            model_name='imagemocorrencia',
+            name='processamento_falhou',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Falha ao gerar as variantes'),
+        ),
+    ]
@@ -1,14 +1,20 @@
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, router, transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.dispatch import receiver
 
 from rest_framework.authtoken.models import Token
 
 from cidade_ajuda import settings
+from cidade_ajuda.base.cache import invalidar_tipos, invalidar_tokens, obter_tipo
+from cidade_ajuda.base.geo import calcular_celula
+from cidade_ajuda.base.imagens import agendar_processamento, caminho_variante
 from cidade_ajuda.base.validators import MinAgeValidator
-from .managers import OcorrenciaManager, UsuarioManager
+from cidade_ajuda.base.storage import armazenamento_imagens
+from .managers import DensidadeOcorrenciasManager, InteracaoManager, OcorrenciaManager, ReferenciaArquivoManager, \
+    SequenciaAlteracoesManager, UsuarioManager
 
 class Usuario(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -35,6 +41,16 @@ class Tipo(models.Model):
         return '{} - {}'.format(self.titulo, self.duracao)
 
 
+class SequenciaAlteracoes(models.Model):
+    """Contador global, de uma única linha, que ordena as alterações das ocorrências para a sincronização.
+
+    No PostgreSQL a linha só guarda o valor de partida; os valores vêm de uma sequence (veja o manager).
+    """
+    valor = models.BigIntegerField(verbose_name=_('valor'), default=0)
+
+    objects = SequenciaAlteracoesManager()
+
+
 class Ocorrencia(models.Model):
     usuario = models.ForeignKey(
         Usuario, on_delete=models.PROTECT, verbose_name=_('Usuário'), related_name='ocorrencias')
@@ -46,12 +62,17 @@ class Ocorrencia(models.Model):
     longitude = models.FloatField(
         verbose_name=_('longitude'),
         validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    celula = models.IntegerField(verbose_name=_('célula'), db_index=True, editable=False,
+                                 help_text=_('Célula da grade espacial que contém a ocorrência'))
     esta_ativa = models.BooleanField(verbose_name=_('ativa'), default=True)
     data_hora_criacao = models.DateTimeField(
         verbose_name=_('data e hora de criação'), auto_now_add=True,
         help_text=_('Momento em que a ocorrência foi registrada'))
     prazo_termino = models.DateTimeField(verbose_name=_(
         'prazo'), help_text=_('prazo para término da ocorrência'))
+    data_hora_encerramento = models.DateTimeField(
+        verbose_name=_('data e hora de encerramento'), null=True, blank=True, editable=False,
+        help_text=_('Momento em que a ocorrência deixou de estar ativa'))
     transitavel_veiculo = models.BooleanField(
         verbose_name=_('transitável por veículo'))
     transitavel_a_pe = models.BooleanField(verbose_name=_('transitável a pé'))
@@ -62,11 +83,50 @@ class Ocorrencia(models.Model):
         default=0, verbose_name=_('inexistentes'), validators=[MinValueValidator(0)])
     quantidade_caso_encerrado = models.IntegerField(
         default=0, verbose_name=_('caso encerrado'), validators=[MinValueValidator(0)])
+    atualizado_em = models.DateTimeField(
+        verbose_name=_('atualizado em'), auto_now=True, help_text=_('Momento da última alteração da ocorrência'))
+    sequencia = models.BigIntegerField(
+        verbose_name=_('sequência'), default=0, editable=False,
+        help_text=_('Posição da última alteração da ocorrência na sequência de alterações'))
+    sequencia_criacao = models.BigIntegerField(
+        verbose_name=_('sequência de criação'), default=0, editable=False,
+        help_text=_('Posição da criação da ocorrência na sequência de alterações'))
 
     objects = OcorrenciaManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['esta_ativa', 'prazo_termino'], name='ocorrencia_ativa_prazo_idx'),
+            models.Index(fields=['sequencia', 'id'], name='ocorrencia_sequencia_idx'),
+        ]
+
     def __str__(self):
-        return '{} - ({}, {})'.format(self.tipo.titulo, self.latitude, self.longitude)
+        tipo = obter_tipo(self.tipo_id) or self.tipo
+        return '{} - ({}, {})'.format(tipo.titulo, self.latitude, self.longitude)
+
+    def save(self, *args, **kwargs):
+        self.celula = calcular_celula(self.latitude, self.longitude)
+
+        if self.esta_ativa:
+            self.data_hora_encerramento = None
+        elif self.data_hora_encerramento is None:
+            self.data_hora_encerramento = timezone.now()
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields) | {'atualizado_em', 'sequencia'}
+            if {'latitude', 'longitude'} & update_fields:
+                update_fields.add('celula')
+            if 'esta_ativa' in update_fields:
+                update_fields.add('data_hora_encerramento')
+            kwargs['update_fields'] = update_fields
+
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            self.sequencia = SequenciaAlteracoes.objects.proxima(using=using)
+            if self._state.adding:
+                self.sequencia_criacao = self.sequencia
+            super().save(*args, **kwargs)
 
 
 class Interacao(models.Model):
@@ -85,6 +145,13 @@ class Interacao(models.Model):
     ocorrencia = models.ForeignKey(
         Ocorrencia, on_delete=models.PROTECT, verbose_name=_('Ocorrência'))
 
+    objects = InteracaoManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'ocorrencia'], name='interacao_unica_por_usuario'),
+        ]
+
 
 class Comentario(models.Model):
     texto = models.TextField(verbose_name=_('Comentário'), blank=True)
@@ -95,22 +162,191 @@ class Comentario(models.Model):
     ocorrencia = models.ForeignKey(
         Ocorrencia, on_delete=models.PROTECT, verbose_name=_('Ocorrência'))
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['ocorrencia', 'data_hora'], name='comentario_ocorrencia_idx'),
+        ]
+
+
+class ImagemContada(models.Model):
+    """Salva na mesma transação a reserva do arquivo pelo armazenamento e a contagem da referência no post_save."""
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
 
-class ImagemOcorrencia(models.Model):
+
+class ImagemOcorrencia(ImagemContada):
     ocorrencia = models.ForeignKey(
         Ocorrencia, on_delete=models.PROTECT, verbose_name=_('Ocorrência'), related_name='imagens')
     imagem = models.ImageField(verbose_name=_(
-        'Imagem'), upload_to='ocorrencias')
+        'Imagem'), upload_to='ocorrencias', storage=armazenamento_imagens)
+    miniatura = models.ImageField(
+        verbose_name=_('Miniatura'), upload_to=caminho_variante, storage=armazenamento_imagens, blank=True,
+        editable=False)
+    reduzida = models.ImageField(
+        verbose_name=_('Imagem reduzida'), upload_to=caminho_variante, storage=armazenamento_imagens, blank=True,
+        editable=False)
+    processamento_falhou = models.BooleanField(
+        verbose_name=_('Falha ao gerar as variantes'), default=False, editable=False)
 
 
-class ImagemComentario(models.Model):
+class ImagemComentario(ImagemContada):
     comentario = models.ForeignKey(
         Comentario, on_delete=models.PROTECT, verbose_name=_('Comentário'))
     imagem = models.ImageField(verbose_name=_(
-        'Imagem'), upload_to='comentarios')
+        'Imagem'), upload_to='comentarios', storage=armazenamento_imagens)
+    miniatura = models.ImageField(
+        verbose_name=_('Miniatura'), upload_to=caminho_variante, storage=armazenamento_imagens, blank=True,
+        editable=False)
+    reduzida = models.ImageField(
+        verbose_name=_('Imagem reduzida'), upload_to=caminho_variante, storage=armazenamento_imagens, blank=True,
+        editable=False)
+    processamento_falhou = models.BooleanField(
+        verbose_name=_('Falha ao gerar as variantes'), default=False, editable=False)
+
+
+class ReferenciaArquivo(models.Model):
+    """Quantos campos de imagem apontam para cada arquivo do armazenamento por conteúdo."""
+    nome = models.CharField(max_length=255, unique=True, verbose_name=_('nome'))
+    referencias = models.PositiveIntegerField(default=0, verbose_name=_('referências'))
+
+    objects = ReferenciaArquivoManager()
+
+
+class DensidadeOcorrencias(models.Model):
+    """Quantidade de ocorrências ativas de cada Tipo em cada célula da grade espacial.
+
+    Mantida a cada criação, desativação e mudança de lugar ou de tipo de uma ocorrência; o comando
+    ``reconstruir_densidade`` a recalcula do zero.
+    """
+    celula = models.IntegerField(verbose_name=_('célula'))
+    tipo = models.ForeignKey(Tipo, on_delete=models.CASCADE, verbose_name=_('Tipo'))
+    quantidade = models.IntegerField(verbose_name=_('quantidade'), default=0)
+
+    objects = DensidadeOcorrenciasManager()
+
+    class Meta:
+        unique_together = [('celula', 'tipo')]
+
+
+CAMPOS_IMAGEM = ['imagem', 'miniatura', 'reduzida']
+CAMPOS_DENSIDADE = {'esta_ativa', 'celula', 'tipo_id'}
+_DESCONHECIDA = object()
+
+
+def _arquivos(instance):
+    adiados = instance.get_deferred_fields()
+    return {getattr(instance, campo).name for campo in CAMPOS_IMAGEM
+            if campo not in adiados and getattr(instance, campo).name}
+
+
+def _celula_densidade(instance):
+    # A (célula, tipo) em que a ocorrência é contada, None se ela não conta, ou desconhecida se não foi carregada.
+    if CAMPOS_DENSIDADE & instance.get_deferred_fields():
+        return _DESCONHECIDA
+    return (instance.celula, instance.tipo_id) if instance.esta_ativa else None
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
+
+
+def _invalidar_tokens(keys):
+    # Como nos tipos: já e de novo no commit, para que outra requisição não guarde o usuário antigo.
+    keys = list(keys)
+    invalidar_tokens(keys)
+    transaction.on_commit(lambda: invalidar_tokens(keys))
+
+
+@receiver(post_delete, sender=Token)
+def invalidar_token_removido(sender, instance=None, **kwargs):
+    _invalidar_tokens([instance.key])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidar_tokens_do_user(sender, instance=None, created=False, **kwargs):
+    # Cobre a desativação do usuário e qualquer outra alteração nos dados guardados com o token.
+    if not created:
+        _invalidar_tokens(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
+
+
+@receiver(post_save, sender=Usuario)
+@receiver(post_delete, sender=Usuario)
+def invalidar_tokens_do_usuario(sender, instance=None, **kwargs):
+    _invalidar_tokens(Token.objects.filter(user_id=instance.user_id).values_list('key', flat=True))
+
+
+@receiver(post_save, sender=Tipo)
+@receiver(post_delete, sender=Tipo)
+def invalidar_cache_tipos(sender, **kwargs):
+    # Invalida já para este processo e de novo no commit, para que outro worker não recarregue dados antigos.
+    invalidar_tipos()
+    transaction.on_commit(invalidar_tipos)
+
+
+@receiver(post_save, sender=ImagemOcorrencia)
+@receiver(post_delete, sender=ImagemOcorrencia)
+def atualizar_ocorrencia_da_imagem(sender, instance=None, **kwargs):
+    # As imagens fazem parte da representação da ocorrência, então invalidam o seu ETag.
+    Ocorrencia.objects.filter(id=instance.ocorrencia_id).update(atualizado_em=timezone.now())
+
+
+@receiver(post_save, sender=ImagemOcorrencia)
+@receiver(post_save, sender=ImagemComentario)
+def processar_imagem(sender, instance=None, created=False, **kwargs):
+    if created:
+        transaction.on_commit(lambda: agendar_processamento(instance))
+
+
+@receiver(post_init, sender=ImagemOcorrencia)
+@receiver(post_init, sender=ImagemComentario)
+def lembrar_arquivos(sender, instance=None, **kwargs):
+    instance._arquivos_salvos = _arquivos(instance) if instance.pk else set()
+
+
+@receiver(post_save, sender=ImagemOcorrencia)
+@receiver(post_save, sender=ImagemComentario)
+def contar_referencias(sender, instance=None, **kwargs):
+    arquivos = _arquivos(instance)
+    ReferenciaArquivo.objects.adicionar(arquivos - instance._arquivos_salvos)
+    ReferenciaArquivo.objects.remover(instance._arquivos_salvos - arquivos, armazenamento_imagens)
+    instance._arquivos_salvos = arquivos
+
+
+@receiver(post_delete, sender=ImagemOcorrencia)
+@receiver(post_delete, sender=ImagemComentario)
+def descontar_referencias(sender, instance=None, **kwargs):
+    ReferenciaArquivo.objects.remover(instance._arquivos_salvos, armazenamento_imagens)
+
+
+@receiver(post_init, sender=Ocorrencia)
+def lembrar_celula(sender, instance=None, **kwargs):
+    instance._celula_salva = _celula_densidade(instance) if instance.pk else None
+
+
+@receiver(post_save, sender=Ocorrencia)
+def atualizar_densidade(sender, instance=None, using=None, update_fields=None, **kwargs):
+    if update_fields is not None and not {'esta_ativa', 'celula', 'tipo'} & set(update_fields):
+        return
+    anterior, atual = instance._celula_salva, _celula_densidade(instance)
+    if _DESCONHECIDA not in (anterior, atual) and anterior != atual:
+        variacoes = {}
+        if anterior:
+            variacoes[anterior] = -1
+        if atual:
+            variacoes[atual] = variacoes.get(atual, 0) + 1
+        DensidadeOcorrencias.objects.db_manager(using).somar(variacoes)
+    instance._celula_salva = atual
+
+
+@receiver(post_delete, sender=Ocorrencia)
+def descontar_densidade(sender, instance=None, using=None, **kwargs):
+    if instance._celula_salva not in (None, _DESCONHECIDA):
+        DensidadeOcorrencias.objects.db_manager(using).somar({instance._celula_salva: -1})
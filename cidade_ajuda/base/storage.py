@@ -0,0 +1,45 @@
+import hashlib
+import os
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ArmazenamentoPorConteudo(FileSystemStorage):
+    """Grava cada arquivo como ``blobs/<hh>/<sha256><extensão>``, então conteúdos iguais dividem o arquivo.
+
+    O ``upload_to`` do campo é ignorado: a mesma imagem, enviada para uma ocorrência e para um comentário, é um
+    único arquivo com uma única contagem de referências. Um arquivo que já existe não é gravado de novo; quem apaga os
+    arquivos sem referências é o ``ReferenciaArquivoManager``. Salvar fora de uma transação que também conte a
+    referência (como o ``save`` das imagens) deixa o arquivo exposto a essa remoção.
+    """
+
+    DIRETORIO = 'blobs'
+
+    def nome_por_conteudo(self, name, content):
+        sha256 = getattr(content, 'sha256', None)
+        if sha256 is None:
+            hash_conteudo = hashlib.sha256()
+            for chunk in content.chunks():
+                hash_conteudo.update(chunk)
+            sha256 = hash_conteudo.hexdigest()
+
+        extensao = os.path.splitext(name)[1].lower()
+        return '/'.join([self.DIRETORIO, sha256[:2], sha256 + extensao])
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = self.nome_por_conteudo(name, content)
+        # A reserva serializa o reaproveitamento com a remoção do arquivo pelo ``ReferenciaArquivoManager``.
+        apps.get_model('base', 'ReferenciaArquivo').objects.reservar(name)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+armazenamento_imagens = ArmazenamentoPorConteudo()
@@ -1,8 +1,20 @@
+from collections import Counter
 from datetime import date, timedelta
+from io import StringIO
+from unittest import skipUnless
 
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
 
-from cidade_ajuda.base.models import Usuario, Tipo, Ocorrencia
+from cidade_ajuda.base.benchmark import gerar_ocorrencias, gerar_usuarios
+from cidade_ajuda.base.cache import obter_tipo
+from cidade_ajuda.base.geo import area_do_raio, calcular_celula, distancias, faixas_celulas, zoom_na_area, COLUNAS, \
+    Regiao
+from cidade_ajuda.base.models import Usuario, Tipo, Ocorrencia, SequenciaAlteracoes, Interacao, Comentario, \
+    DensidadeOcorrencias
+from cidade_ajuda.rest.testing import MidiaTemporariaMixin
 
 
 class UsuarioTest(TestCase):
@@ -65,7 +77,7 @@ class TipoTest(TestCase):
             tipo.__str__(), 'Alagamento - 6:00:00')
 
 
-class OcorrenciaTest(TestCase):
+class OcorrenciaTest(MidiaTemporariaMixin, TestCase):
     def setUp(self):
         self.usuario = Usuario.objects.create(
             primeiro_nome='Lucas', sobrenome='Nunes', apelido='nickname', data_nascimento=date(1995, 10, 1),
@@ -176,3 +188,360 @@ class OcorrenciaTest(TestCase):
                 transitavel_a_pe=transitavel_a_pe, descricao=descricao, latitude=latitude)
             self.assertEqual('Ocorrencia precisa ter uma longitude',
                              str(error.exception))
+
+    def test_criar_ocorrencia_calcula_celula(self):
+        ocorrencia = Ocorrencia.objects.create(
+            usuario=self.usuario, tipo=self.tipo, descricao='descrição de teste', latitude=-22.0087,
+            longitude=-47.8909)
+        self.assertEqual(ocorrencia.celula, calcular_celula(-22.0087, -47.8909))
+
+        ocorrencia.latitude = 10
+        ocorrencia.save(update_fields=['latitude'])
+        ocorrencia.refresh_from_db()
+        self.assertEqual(ocorrencia.celula, calcular_celula(10, -47.8909))
+
+    def test_ocorrencias_na_area(self):
+        dentro = Ocorrencia.objects.create(
+            usuario=self.usuario, tipo=self.tipo, descricao='dentro', latitude=-22.0, longitude=-47.9)
+        Ocorrencia.objects.create(
+            usuario=self.usuario, tipo=self.tipo, descricao='fora', latitude=-22.0, longitude=-47.7)
+
+        ocorrencias = Ocorrencia.objects.na_area(-22.1, -48.0, -21.9, -47.8)
+        self.assertEqual(list(ocorrencias), [dentro])
+
+    def test_ocorrencias_na_area_cruzando_antimeridiano(self):
+        leste = Ocorrencia.objects.create(
+            usuario=self.usuario, tipo=self.tipo, descricao='leste', latitude=-17.7, longitude=179.9)
+        oeste = Ocorrencia.objects.create(
+            usuario=self.usuario, tipo=self.tipo, descricao='oeste', latitude=-17.7, longitude=-179.9)
+        Ocorrencia.objects.create(
+            usuario=self.usuario, tipo=self.tipo, descricao='fora', latitude=-17.7, longitude=10)
+
+        ocorrencias = Ocorrencia.objects.na_area(-18, 179, -17, -179).order_by('id')
+        self.assertEqual(list(ocorrencias), [leste, oeste])
+
+    def test_criar_ocorrencias_em_lote(self):
+        ocorrencias = [{'tipo': self.tipo.id, 'descricao': 'primeira', 'latitude': -22, 'longitude': -47},
+                       {'tipo': 0, 'descricao': 'tipo inexistente', 'latitude': -22, 'longitude': -47},
+                       {'tipo': self.tipo, 'descricao': 'segunda', 'latitude': -22, 'longitude': -47},
+                       {'tipo': self.tipo.id, 'descricao': 'sem latitude', 'longitude': -47}]
+
+        criadas, erros = Ocorrencia.objects.bulk_create_validated(self.usuario, ocorrencias, tamanho_lote=1)
+
+        self.assertEqual(len(criadas), 2)
+        self.assertEqual(erros, {1: 'Ocorrencia precisa ter um Tipo', 3: 'Ocorrencia precisa ter uma latitude'})
+        self.assertEqual(list(Ocorrencia.objects.all().values_list('descricao', 'celula')),
+                         [('primeira', calcular_celula(-22, -47)), ('segunda', calcular_celula(-22, -47))])
+
+    def test_alteradas_desde_posicao_da_sequencia(self):
+        ocorrencias = [Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição',
+                                                 latitude=-22, longitude=-47) for _ in range(3)]
+        inicio = SequenciaAlteracoes.objects.atual()
+        Ocorrencia.objects.filter(id__in=[ocorrencias[0].id, ocorrencias[2].id]).desativar()
+
+        alteradas = list(Ocorrencia.objects.alteradas_desde(inicio))
+        self.assertEqual([ocorrencia.id for ocorrencia in alteradas], [ocorrencias[0].id, ocorrencias[2].id])
+        self.assertEqual(alteradas[0].sequencia, alteradas[1].sequencia)
+
+        restantes = Ocorrencia.objects.alteradas_desde(alteradas[0].sequencia, alteradas[0].id)
+        self.assertEqual(list(restantes), [alteradas[1]])
+
+    @override_settings(ALTERACOES_JANELA=0)
+    def test_update_sem_linhas_nao_avanca_a_sequencia(self):
+        ocorrencia = Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição',
+                                               latitude=-22, longitude=-47)
+        inicio = SequenciaAlteracoes.objects.atual()
+
+        self.assertEqual(Ocorrencia.objects.filter(id=ocorrencia.id + 1).update(descricao='nenhuma'), 0)
+        self.assertEqual(SequenciaAlteracoes.objects.atual(), inicio)
+
+        Ocorrencia.objects.filter(id=ocorrencia.id).update(descricao='alterada')
+        ocorrencia.refresh_from_db()
+        self.assertGreater(ocorrencia.sequencia, inicio)
+        self.assertEqual(SequenciaAlteracoes.objects.confirmada(), ocorrencia.sequencia)
+
+    @skipUnless(connection.vendor == 'postgresql', 'só o PostgreSQL usa a sequence')
+    @override_settings(ALTERACOES_JANELA=60)
+    def test_sequencia_confirmada_espera_a_janela(self):
+        antiga, recente = [Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição',
+                                                     latitude=-22, longitude=-47) for _ in range(2)]
+        Ocorrencia.objects.filter(id=antiga.id).update(atualizado_em=timezone.now() - timedelta(minutes=2))
+        antiga.refresh_from_db()
+
+        # A recente pode ainda ter uma transação com valor menor em andamento, então fica de fora.
+        self.assertGreater(recente.sequencia, 0)
+        self.assertEqual(SequenciaAlteracoes.objects.confirmada(), antiga.sequencia)
+
+    def test_expirar_ocorrencias(self):
+        ocorrencias = [Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição',
+                                                 latitude=-22, longitude=-47) for _ in range(3)]
+        Ocorrencia.objects.filter(id__in=[ocorrencias[0].id, ocorrencias[1].id]).update(
+            prazo_termino=timezone.now() - timedelta(minutes=1))
+
+        lotes = list(Ocorrencia.objects.expirar(tamanho_lote=1))
+
+        self.assertEqual([quantidade for quantidade, _ in lotes], [1, 1])
+        self.assertEqual(list(Ocorrencia.objects.all().values_list('esta_ativa', flat=True)), [False, False, True])
+        for ocorrencia in Ocorrencia.objects.filter(esta_ativa=False):
+            self.assertEqual(ocorrencia.data_hora_encerramento, ocorrencia.prazo_termino)
+
+    def test_proximas(self):
+        for latitude in (-22.001, -22.003, -22.002, -22.1):
+            Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao=str(latitude),
+                                      latitude=latitude, longitude=-47)
+
+        proximas = Ocorrencia.objects.all().proximas(-22, -47, 1000, 2, tamanho_lote=1)
+
+        self.assertEqual([Ocorrencia.objects.get(id=ocorrencia_id).descricao for ocorrencia_id, _ in proximas],
+                         ['-22.001', '-22.002'])
+        self.assertAlmostEqual(proximas[0][1], 111.2, places=1)
+        self.assertEqual(Ocorrencia.objects.all().proximas(-22, -47, 100, 2), [])
+
+    def test_proximas_para_no_primeiro_anel_com_k_ocorrencias(self):
+        for latitude in (-22.0001, -22.0002, -22.3):
+            Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao=str(latitude),
+                                      latitude=latitude, longitude=-47)
+
+        with self.assertNumQueries(1):
+            proximas = Ocorrencia.objects.all().proximas(-22, -47, 50000, 2)
+        self.assertEqual(len(proximas), 2)
+
+        # Longe das outras, só o último anel alcança as três.
+        with self.assertNumQueries(len(Ocorrencia.objects.all().FRACOES_RAIO)):
+            proximas = Ocorrencia.objects.all().proximas(-22.3, -47, 50000, 3)
+        self.assertEqual(len(proximas), 3)
+
+    def test_resumo_ocorrencias(self):
+        outro_tipo = Tipo.objects.create(titulo='Buraco', sugestao_descricao='descrição', duracao=timedelta(days=1))
+        ocorrencias = [Ocorrencia.objects.create(usuario=self.usuario, tipo=tipo, descricao='descrição',
+                                                 latitude=-22, longitude=-47)
+                       for tipo in (self.tipo, self.tipo, self.tipo, outro_tipo)]
+        Ocorrencia.objects.filter(id=ocorrencias[0].id).update(quantidade_inexistente=3)
+        Ocorrencia.objects.filter(id=ocorrencias[0].id).desativar(
+            encerramento=ocorrencias[0].data_hora_criacao + timedelta(minutes=30))
+        Ocorrencia.objects.filter(id=ocorrencias[1].id).update(prazo_termino=timezone.now() - timedelta(minutes=1))
+        ids = [ocorrencia.id for ocorrencia in ocorrencias]
+
+        with self.assertNumQueries(2):
+            resumo = Ocorrencia.objects.all().resumo([ids[:3], ids[3:]])
+
+        self.assertEqual(resumo['quantidade'], 4)
+        self.assertEqual(resumo['ativas'], 2)
+        self.assertEqual(resumo['expiradas'], 2)
+        self.assertEqual(resumo['quantidade_existente'], 4)
+        self.assertEqual(resumo['quantidade_inexistente'], 3)
+        self.assertEqual(resumo['tempo_medio_encerramento'], 1800)
+        self.assertEqual([(tipo['tipo'], tipo['quantidade'], tipo['ativas']) for tipo in resumo['por_tipo']],
+                         [(self.tipo.id, 3, 1), (outro_tipo.id, 1, 1)])
+        self.assertIsNone(resumo['por_tipo'][1]['tempo_medio_encerramento'])
+
+    def test_comando_expirar_ocorrencias(self):
+        ocorrencia = Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição',
+                                               latitude=-22, longitude=-47)
+        Ocorrencia.objects.filter(id=ocorrencia.id).update(prazo_termino=timezone.now() - timedelta(minutes=1))
+
+        saida = StringIO()
+        call_command('expirar_ocorrencias', stdout=saida)
+
+        self.assertIn('Total: 1 ocorrências desativadas', saida.getvalue())
+        ocorrencia.refresh_from_db()
+        self.assertFalse(ocorrencia.esta_ativa)
+
+    def test_comando_gerar_dados(self):
+        call_command('gerar_dados', usuarios=5, ocorrencias=50, interacoes=40, comentarios=10, imagens=0,
+                     stdout=StringIO())
+
+        ocorrencias = Ocorrencia.objects.exclude(usuario=self.usuario)
+        self.assertEqual(ocorrencias.count(), 50)
+        self.assertEqual(Interacao.objects.count(), 40)
+        self.assertEqual(Comentario.objects.count(), 10)
+        for ocorrencia in ocorrencias:
+            for resposta, campo in Interacao.objects.CONTADORES.items():
+                inicial = Ocorrencia._meta.get_field(campo).default
+                self.assertEqual(getattr(ocorrencia, campo),
+                                 inicial + ocorrencia.interacao_set.filter(resposta=resposta).count())
+
+    def test_gerar_usuarios_depois_de_remocoes(self):
+        primeiros = gerar_usuarios(2)
+        primeiros[0].user.delete()
+
+        segundos = gerar_usuarios(2)
+
+        self.assertEqual(len(segundos), 2)
+        self.assertFalse({usuario.user.username for usuario in primeiros} &
+                         {usuario.user.username for usuario in segundos})
+
+    def test_gerar_ocorrencias_avanca_a_sequencia_por_lote(self):
+        inicio = SequenciaAlteracoes.objects.atual()
+
+        gerar_ocorrencias(5, [self.usuario], [self.tipo], tamanho_lote=2, semente=0)
+
+        sequencias = Ocorrencia.objects.filter(descricao='Ocorrência sintética').values_list(
+            'sequencia', 'sequencia_criacao')
+        self.assertEqual(sorted(sequencia for sequencia, _ in sequencias),
+                         [inicio + 1, inicio + 1, inicio + 2, inicio + 2, inicio + 3])
+        self.assertTrue(all(sequencia == criacao for sequencia, criacao in sequencias))
+
+
+class DensidadeTest(TestCase):
+    def setUp(self):
+        self.usuarios = [Usuario.objects.create(
+            primeiro_nome='Lucas', sobrenome='Nunes', apelido='nickname{}'.format(i), data_nascimento=date(1995, 10, 1),
+            email='test@mail.com', password='password') for i in range(3)]
+        self.tipos = [Tipo.objects.create(titulo=titulo, sugestao_descricao='descrição', duracao=timedelta(hours=6))
+                      for titulo in ['Alagamento', 'Buraco']]
+
+    def criar(self, tipo, latitude, longitude):
+        return Ocorrencia.objects.create(usuario=self.usuarios[0], tipo=tipo, descricao='descrição',
+                                         latitude=latitude, longitude=longitude)
+
+    def assertDensidadeCorreta(self):
+        densidade = {(celula, tipo_id): quantidade for celula, tipo_id, quantidade in
+                     DensidadeOcorrencias.objects.filter(quantidade__gt=0).values_list('celula', 'tipo', 'quantidade')}
+        ativas = Counter(Ocorrencia.objects.filter(esta_ativa=True).values_list('celula', 'tipo'))
+        self.assertEqual(densidade, dict(ativas))
+
+    def test_densidade_acompanha_as_ocorrencias(self):
+        encerrada = self.criar(self.tipos[0], -22.5, -47.5)
+        expirada = self.criar(self.tipos[1], -22.5, -47.5)
+        movida = self.criar(self.tipos[0], -10, -40)
+        removida = self.criar(self.tipos[1], -10, -40)
+        Ocorrencia.objects.bulk_create_validated(self.usuarios[0], [
+            {'tipo': self.tipos[0].id, 'descricao': 'lote', 'latitude': -22.5, 'longitude': -47.5}] * 3)
+        self.assertDensidadeCorreta()
+
+        movida.latitude = -11
+        movida.save()
+        removida.delete()
+        Ocorrencia.objects.filter(id=expirada.id).update(prazo_termino=timezone.now() - timedelta(minutes=1))
+        list(Ocorrencia.objects.expirar())
+        encerrada.esta_ativa = False
+        encerrada.save()
+        self.assertDensidadeCorreta()
+
+    def test_respostas_nao_encerram_a_ocorrencia(self):
+        ocorrencia = self.criar(self.tipos[0], -22.5, -47.5)
+        for usuario in self.usuarios[1:]:
+            Interacao.objects.create(usuario=usuario, ocorrencia=ocorrencia, resposta='IN')
+
+        ocorrencia.refresh_from_db()
+        self.assertTrue(ocorrencia.esta_ativa)
+        self.assertDensidadeCorreta()
+
+    def test_comando_reconstruir_densidade(self):
+        self.criar(self.tipos[0], -22.5, -47.5)
+        self.criar(self.tipos[1], -10, -40)
+        DensidadeOcorrencias.objects.update(quantidade=99)
+
+        saida = StringIO()
+        call_command('reconstruir_densidade', stdout=saida)
+
+        self.assertIn('2 células', saida.getvalue())
+        self.assertDensidadeCorreta()
+
+    def test_densidade_na_area_grande_respeita_as_longitudes(self):
+        dentro = self.criar(self.tipos[0], -22.5, -47.5)
+        self.criar(self.tipos[0], -22.5, 10)
+
+        celulas = DensidadeOcorrencias.objects.na_area(-40, -60, 0, -30).values_list('celula', flat=True)
+
+        self.assertEqual(list(celulas), [dentro.celula])
+
+
+class TipoCacheTest(TestCase):
+    def test_cache_de_tipos_invalidado_ao_remover(self):
+        tipo = Tipo.objects.create(titulo='Buraco', sugestao_descricao='Tamanho', duracao=timedelta(days=1))
+        self.assertEqual(obter_tipo(tipo.id).titulo, 'Buraco')
+
+        with self.assertNumQueries(0):
+            obter_tipo(tipo.id)
+
+        tipo_id = tipo.id
+        tipo.delete()
+        self.assertIsNone(obter_tipo(tipo_id))
+
+
+class GradeTest(TestCase):
+    def test_faixas_celulas_unem_colunas_vizinhas(self):
+        self.assertEqual(faixas_celulas(0.01, 0.01, 0.02, 0.14),
+                         [(calcular_celula(0.01, 0.01), calcular_celula(0.01, 0.14))])
+
+    def test_faixas_celulas_cruzando_antimeridiano(self):
+        faixas = faixas_celulas(0.01, 179.99, 0.02, -179.99)
+        self.assertEqual(len(faixas), 2)
+        self.assertIn(calcular_celula(0.01, 179.99), range(faixas[1][0], faixas[1][1] + 1))
+        self.assertIn(calcular_celula(0.01, -179.99), range(faixas[0][0], faixas[0][1] + 1))
+
+    def test_faixas_celulas_de_area_grande(self):
+        faixas = faixas_celulas(-30, -60, 0, -30)
+        self.assertEqual(faixas, [(calcular_celula(-30, -180), calcular_celula(0, -180) + COLUNAS - 1)])
+
+    def test_zoom_na_area(self):
+        self.assertEqual(zoom_na_area(8, -23, -49, -21, -47), 8)
+        self.assertEqual(zoom_na_area(22, -90, -180, 90, 180), 3)
+        self.assertEqual(zoom_na_area(22, 0, 179.9, 0.1, -179.9), zoom_na_area(22, 0, 0, 0.1, 0.2))
+
+    def test_distancias(self):
+        # Um grau de meridiano tem cerca de 111,2 km.
+        resultado = distancias(-22, -47, [-22, -21, -22], [-47, -47, -46])
+        self.assertEqual(resultado[0], 0)
+        self.assertAlmostEqual(resultado[1], 111195, delta=1)
+        self.assertAlmostEqual(resultado[2], 111195 * 0.927, delta=100)
+
+    def test_area_do_raio(self):
+        sul, oeste, norte, leste = area_do_raio(-22, -47, 1000)
+        self.assertAlmostEqual(norte - sul, 2 * 1000 / 111195, places=5)
+        self.assertGreater(leste - oeste, norte - sul)
+        self.assertAlmostEqual(distancias(-22, -47, [-22], [leste])[0], 1000, delta=1)
+
+        sul, oeste, norte, leste = area_do_raio(0, 179.999, 1000)
+        self.assertGreater(oeste, leste)
+        self.assertEqual(area_do_raio(89.999, 0, 1000)[1::2], (-180, 180))
+
+    def test_faixas_celulas_de_area_invalida(self):
+        self.assertEqual(faixas_celulas(10, 0, -10, 1), [])
+
+
+class RegiaoTest(TestCase):
+    QUADRADO_COM_BURACO = {
+        'type': 'Polygon',
+        'coordinates': [[[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]],
+                        [[4, 4], [6, 4], [6, 6], [4, 6], [4, 4]]],
+    }
+
+    def test_poligono_com_buraco(self):
+        regiao = Regiao(self.QUADRADO_COM_BURACO)
+
+        dentro = regiao.contem([1, 9, 5, 5, 11], [1, 9, 5, 3, 5])
+        self.assertEqual(dentro.tolist(), [True, True, False, True, False])
+
+    def test_multipoligono(self):
+        regiao = Regiao({
+            'type': 'MultiPolygon',
+            'coordinates': [self.QUADRADO_COM_BURACO['coordinates'],
+                            [[[20, 20], [30, 20], [25, 30], [20, 20]]]],
+        })
+
+        dentro = regiao.contem([1, 25, 15, 5], [1, 22, 15, 5])
+        self.assertEqual(dentro.tolist(), [True, True, False, False])
+        self.assertEqual((regiao.sul, regiao.oeste, regiao.norte, regiao.leste), (0, 0, 30, 30))
+
+    def test_geometria_invalida(self):
+        with self.assertRaises(ValueError):
+            Regiao({'type': 'Point', 'coordinates': [0, 0]})
+        with self.assertRaises(ValueError):
+            Regiao({'type': 'Polygon', 'coordinates': [[]]})
+
+    def test_ids_na_regiao(self):
+        usuario = Usuario.objects.create(
+            primeiro_nome='Lucas', sobrenome='Nunes', apelido='nickname', data_nascimento=date(1995, 10, 1),
+            email='test@mail.com', password='password')
+        tipo = Tipo.objects.create(titulo='Alagamento', sugestao_descricao='descrição', duracao=timedelta(hours=6))
+
+        pontos = [(1, 1), (5, 5), (9, 2), (12, 5), (3, 8)]
+        ocorrencias = [Ocorrencia.objects.create(usuario=usuario, tipo=tipo, descricao='descrição', latitude=latitude,
+                                                 longitude=longitude) for longitude, latitude in pontos]
+
+        lotes = list(Ocorrencia.objects.ids_na_regiao(Regiao(self.QUADRADO_COM_BURACO), tamanho_lote=2))
+        ids = [id for lote in lotes for id in lote]
+        self.assertEqual(ids, [ocorrencias[0].id, ocorrencias[2].id, ocorrencias[4].id])
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from cidade_ajuda.base.cache import chave_token
+from cidade_ajuda.base.models import Usuario
+
+# O cache só guarda ids e flags: nem o token nem o hash da senha do usuário saem do banco.
+CAMPOS_CACHE = {
+    'user_id': 'user_id',
+    'is_active': 'user__is_active',
+    'is_staff': 'user__is_staff',
+    'is_superuser': 'user__is_superuser',
+    'usuario_id': 'user__usuario__id',
+}
+
+
+def _parcial(modelo, **valores):
+    """Instância só com os campos dados; os outros são carregados ao serem acessados e ``save()`` não os grava."""
+    campos = [campo.attname for campo in modelo._meta.concrete_fields if campo.attname in valores]
+    return modelo.from_db(router.db_for_read(modelo), campos, [valores[campo] for campo in campos])
+
+
+class TokenAutenticacaoCacheada(TokenAuthentication):
+    """TokenAuthentication que guarda no cache, por ``TOKEN_CACHE_TTL`` segundos, o que identifica o dono do token.
+
+    ``request.user`` e ``request.user.usuario`` são montados a partir do cache, só com o id (e as flags do User),
+    então as views podem usá-los como chaves estrangeiras sem consultar o banco; para quem não tem um ``Usuario``,
+    acessá-lo levanta ``Usuario.DoesNotExist``. Os signals de ``base.models`` apagam a entrada quando o token é
+    removido ou o usuário é alterado.
+    """
+
+    def authenticate_credentials(self, key):
+        chave = chave_token(key)
+        dados = cache.get(chave)
+        if dados is None:
+            dados = Token.objects.filter(key=key).values(*CAMPOS_CACHE.values()).first()
+            if dados is None:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            dados = {campo: dados[consulta] for campo, consulta in CAMPOS_CACHE.items()}
+            cache.set(chave, dados, settings.TOKEN_CACHE_TTL)
+
+        if not dados['is_active']:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        user = _parcial(User, id=dados['user_id'], is_active=dados['is_active'], is_staff=dados['is_staff'],
+                        is_superuser=dados['is_superuser'])
+        usuario = None
+        if dados['usuario_id'] is not None:
+            usuario = _parcial(Usuario, id=dados['usuario_id'], user_id=user.id)
+            Usuario.user.field.set_cached_value(usuario, user)
+        User.usuario.related.set_cached_value(user, usuario)
+        return user, _parcial(Token, key=key, user_id=user.id)
@@ -0,0 +1,85 @@
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Linhas lidas do banco por vez nas exportações; a memória usada é proporcional a isso, não ao resultado.
+TAMANHO_LOTE_EXPORTACAO = 1000
+
+
+class _Eco:
+    """Arquivo falso para o ``csv.writer``: devolve a linha em vez de guardá-la."""
+
+    def write(self, valor):
+        return valor
+
+
+def _ndjson(objetos):
+    return ''.join(json.dumps(objeto, cls=JSONEncoder, ensure_ascii=False) + '\n' for objeto in objetos)
+
+
+def _valor_csv(valor):
+    if isinstance(valor, (list, tuple)):
+        return ' '.join(str(item) for item in valor)
+    return valor
+
+
+def _linhas_csv(escritor, colunas, objetos):
+    return ''.join(escritor.writerow([_valor_csv(objeto.get(coluna)) for coluna in colunas]) for objeto in objetos)
+
+
+def _como_lista(data):
+    if data is None:
+        return []
+    return data if isinstance(data, list) else [data]
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Um objeto JSON por linha. As listagens são transmitidas por ``resposta_exportacao``; o ``render`` atende o
+    resto, como as respostas de erro."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return _ndjson(_como_lista(data)).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        objetos = _como_lista(data)
+        if not objetos:
+            return b''
+        colunas = list(objetos[0])
+        escritor = csv.writer(_Eco())
+        return (escritor.writerow(colunas) + _linhas_csv(escritor, colunas, objetos)).encode(self.charset)
+
+
+RENDERERS_EXPORTACAO = [NDJSONRenderer, CSVRenderer]
+FORMATOS_EXPORTACAO = {renderer.format: renderer for renderer in RENDERERS_EXPORTACAO}
+
+
+def resposta_exportacao(lotes, colunas, formato, nome):
+    """``StreamingHttpResponse`` que serializa, sob demanda, os lotes de dicionários gerados por ``lotes``."""
+    renderer = FORMATOS_EXPORTACAO[formato]
+
+    def gerar():
+        if formato == 'csv':
+            escritor = csv.writer(_Eco())
+            yield escritor.writerow(colunas).encode(renderer.charset)
+            for lote in lotes:
+                yield _linhas_csv(escritor, colunas, lote).encode(renderer.charset)
+        else:
+            for lote in lotes:
+                yield _ndjson(lote).encode(renderer.charset)
+
+    response = StreamingHttpResponse(gerar(), content_type='{}; charset={}'.format(renderer.media_type,
+                                                                                    renderer.charset))
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(nome, formato)
+    return response
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIClient
+
+from cidade_ajuda.base.benchmark import CENTROS, criar_usuario_e_tipo, gerar_ocorrencias, medir
+
+URL = '/api/ocorrencias/'
+
+
+class Command(BaseCommand):
+    help = 'Compara o tempo de CPU de uma consulta repetida a /api/ocorrencias/ em uma área, com e sem ' \
+           'If-None-Match. Nada é gravado no banco.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quantidade', type=int, default=100000)
+        parser.add_argument('--repeticoes', type=int, default=20)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        cliente = APIClient()
+
+        latitude, longitude = CENTROS[0]
+        area = {'southWest[]': [latitude - 0.1, longitude - 0.1], 'northEast[]': [latitude + 0.1, longitude + 0.1]}
+
+        with transaction.atomic():
+            usuario, tipo = criar_usuario_e_tipo()
+            gerar_ocorrencias(options['quantidade'], [usuario], [tipo], semente=0)
+
+            resposta = cliente.get(URL, area)
+            if resposta.status_code != 200:
+                raise CommandError('{} respondeu com erro'.format(URL))
+            etag = resposta['ETag']
+
+            sem_etag = medir(lambda: cliente.get(URL, area), options['repeticoes'], time.process_time)
+            com_etag = medir(lambda: cliente.get(URL, area, HTTP_IF_NONE_MATCH=etag), options['repeticoes'],
+                             time.process_time)
+
+            self.stdout.write('{:<16} {:8.2f} ms de CPU'.format('200', sem_etag * 1000))
+            self.stdout.write('{:<16} {:8.2f} ms de CPU'.format('304', com_etag * 1000))
+
+            transaction.set_rollback(True)
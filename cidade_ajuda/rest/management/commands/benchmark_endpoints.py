@@ -0,0 +1,142 @@
+import json
+import random
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings, setup_test_environment
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from cidade_ajuda.base.benchmark import CENTROS, percentil
+from cidade_ajuda.base.models import Ocorrencia, Tipo, Usuario
+from cidade_ajuda.rest.nominatim import limpar_cache_memoria
+from cidade_ajuda.rest.testing import ServidorNominatimLocal
+
+# Lado, em graus, da área consultada: aproximadamente uma tela de mapa no nível de bairro.
+LADO_AREA = 0.1
+PLACE_ID = 1
+
+
+def _commit_atual():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Mede latência (p50/p95/p99), consultas por requisição e vazão dos principais endpoints, pelo cliente ' \
+           'de testes do Django, sobre os dados do banco (veja gerar_dados). O resultado sai em JSON; o que os ' \
+           'endpoints gravam é desfeito no final.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requisicoes', type=int, default=200, help='Requisições medidas por endpoint.')
+        parser.add_argument('--aquecimento', type=int, default=10, help='Requisições descartadas por endpoint.')
+        parser.add_argument('--semente', type=int, default=0)
+        parser.add_argument('--saida', help='Arquivo para o JSON; sem ele, o JSON vai para a saída padrão.')
+
+    def cenarios(self, aleatorio, ids, tipos):
+        def area():
+            latitude, longitude = aleatorio.choice(CENTROS)
+            latitude += aleatorio.uniform(-0.1, 0.1)
+            longitude += aleatorio.uniform(-0.1, 0.1)
+            return {'southWest[]': [latitude - LADO_AREA / 2, longitude - LADO_AREA / 2],
+                    'northEast[]': [latitude + LADO_AREA / 2, longitude + LADO_AREA / 2]}
+
+        def ocorrencia():
+            latitude, longitude = aleatorio.choice(CENTROS)
+            return {'tipo': aleatorio.choice(tipos), 'transitavel_veiculo': True, 'transitavel_a_pe': False,
+                    'descricao': 'Ocorrência do benchmark', 'latitude': aleatorio.gauss(latitude, 0.05),
+                    'longitude': aleatorio.gauss(longitude, 0.05)}
+
+        return {
+            'lista_area': lambda cliente: cliente.get('/api/ocorrencias/', area()),
+            'detalhe': lambda cliente: cliente.get('/api/ocorrencias/{}/'.format(aleatorio.choice(ids))),
+            'criacao': lambda cliente: cliente.post('/api/ocorrencias/', ocorrencia(), format='json'),
+            'comentario': lambda cliente: cliente.post('/api/comentarios/', {
+                'texto': 'Comentário do benchmark', 'ocorrencia': aleatorio.choice(ids)}, format='json'),
+            'relatorio': lambda cliente: cliente.get('/api/relatorio/{}'.format(PLACE_ID)),
+        }
+
+    def medir(self, cliente, requisitar, requisicoes, aquecimento):
+        consultas = []
+
+        def contar(execute, sql, params, many, context):
+            consultas[-1] += 1
+            return execute(sql, params, many, context)
+
+        for _ in range(aquecimento):
+            requisitar(cliente)
+
+        tempos, erros = [], 0
+        with connection.execute_wrapper(contar):
+            inicio = time.perf_counter()
+            for _ in range(requisicoes):
+                consultas.append(0)
+                comeco = time.perf_counter()
+                resposta = requisitar(cliente)
+                tempos.append(time.perf_counter() - comeco)
+                erros += resposta.status_code >= 400
+            total = time.perf_counter() - inicio
+
+        return {
+            'requisicoes': requisicoes,
+            'erros': erros,
+            'p50_ms': round(percentil(tempos, 0.50) * 1000, 3),
+            'p95_ms': round(percentil(tempos, 0.95) * 1000, 3),
+            'p99_ms': round(percentil(tempos, 0.99) * 1000, 3),
+            'consultas_por_requisicao': round(sum(consultas) / requisicoes, 2),
+            'requisicoes_por_segundo': round(requisicoes / total, 1),
+        }
+
+    def handle(self, *args, **options):
+        if options['requisicoes'] < 1:
+            raise CommandError('--requisicoes precisa ser positivo')
+
+        ids = list(Ocorrencia.objects.order_by('?').values_list('id', flat=True)[:10000])
+        tipos = list(Tipo.objects.values_list('id', flat=True))
+        token = Token.objects.filter(user__usuario__isnull=False).first()
+        if not ids or not token:
+            raise CommandError('O banco não tem ocorrências e usuários; gere dados com o comando gerar_dados.')
+
+        setup_test_environment()
+        cliente = APIClient()
+        cliente.credentials(HTTP_AUTHORIZATION='Token {}'.format(token.key))
+        aleatorio = random.Random(options['semente'])
+
+        latitude, longitude = CENTROS[0]
+        regiao = {'type': 'Polygon', 'coordinates': [[
+            [longitude - 0.2, latitude - 0.2], [longitude + 0.2, latitude - 0.2], [longitude + 0.2, latitude + 0.2],
+            [longitude - 0.2, latitude + 0.2], [longitude - 0.2, latitude - 0.2]]]}
+
+        resultado = {
+            'commit': _commit_atual(),
+            'data': timezone.now().isoformat(),
+            'banco': connection.vendor,
+            'ocorrencias': Ocorrencia.objects.count(),
+            'usuarios': Usuario.objects.count(),
+            'endpoints': {},
+        }
+
+        with ServidorNominatimLocal({PLACE_ID: regiao}) as servidor, tempfile.TemporaryDirectory() as cache_dir, \
+                override_settings(NOMINATIM_URL=servidor.url, NOMINATIM_CACHE_DIR=cache_dir):
+            limpar_cache_memoria()
+            with transaction.atomic():
+                for nome, requisitar in self.cenarios(aleatorio, ids, tipos).items():
+                    resultado['endpoints'][nome] = self.medir(cliente, requisitar, options['requisicoes'],
+                                                              options['aquecimento'])
+                transaction.set_rollback(True)
+            limpar_cache_memoria()
+
+        saida = json.dumps(resultado, indent=2, ensure_ascii=False)
+        if options['saida']:
+            with open(options['saida'], 'w') as arquivo:
+                arquivo.write(saida + '\n')
+        else:
+            self.stdout.write(saida)
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import setup_test_environment
+from rest_framework.pagination import Cursor
+from rest_framework.settings import api_settings
+from rest_framework.test import APIClient
+
+from cidade_ajuda.base.benchmark import criar_usuario_e_tipo, gerar_ocorrencias, medir
+from cidade_ajuda.base.models import Ocorrencia
+from cidade_ajuda.rest.pagination import CursorIdPagination
+
+URL = '/api/ocorrencias/'
+
+
+class Command(BaseCommand):
+    help = 'Compara a latência da primeira e de uma página distante de /api/ocorrencias/ com paginação por ' \
+           'número e por cursor. Nada é gravado no banco.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pagina', type=int, default=10000)
+        parser.add_argument('--repeticoes', type=int, default=5)
+
+    def handle(self, *args, **options):
+        pagina, tamanho_pagina = options['pagina'], api_settings.PAGE_SIZE
+        if pagina < 2:
+            raise CommandError('--pagina precisa ser maior que 1')
+
+        setup_test_environment()
+        cliente = APIClient()
+
+        with transaction.atomic():
+            usuario, tipo = criar_usuario_e_tipo()
+            gerar_ocorrencias(pagina * tamanho_pagina, [usuario], [tipo], semente=0)
+
+            anterior = Ocorrencia.objects.order_by('id').values_list('id', flat=True)[(pagina - 1) * tamanho_pagina - 1]
+            paginacao = CursorIdPagination()
+            paginacao.base_url = 'http://testserver' + URL
+
+            urls = [
+                ('número, página 1', URL + '?page=1'),
+                ('número, página {}'.format(pagina), URL + '?page={}'.format(pagina)),
+                ('cursor, página 1', URL + '?cursor='),
+                ('cursor, página {}'.format(pagina), paginacao.encode_cursor(Cursor(0, False, anterior))),
+            ]
+            for nome, url in urls:
+                if cliente.get(url).status_code != 200:
+                    raise CommandError('{} respondeu com erro'.format(url))
+                tempo = medir(lambda: cliente.get(url), options['repeticoes'])
+                self.stdout.write('{:<24} {:8.2f} ms'.format(nome, tempo * 1000))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import setup_test_environment
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from cidade_ajuda.base.benchmark import criar_usuario_e_tipo, gerar_ocorrencias, medir
+from cidade_ajuda.base.models import ImagemOcorrencia, Ocorrencia
+from cidade_ajuda.rest.serializers import OcorrenciaListaRapidaSerializer, OcorrenciaSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compara o OcorrenciaSerializer com o OcorrenciaListaRapidaSerializer em respostas de tamanhos ' \
+           'diferentes, da consulta ao JSON. Nada é gravado no banco.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quantidades', type=int, nargs='+', default=[1000, 10000])
+        parser.add_argument('--repeticoes', type=int, default=5)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        request = Request(APIRequestFactory().get('/api/ocorrencias/'))
+        contexto = {'request': request}
+        renderer = JSONRenderer()
+
+        with transaction.atomic():
+            usuario, tipo = criar_usuario_e_tipo()
+            gerar_ocorrencias(max(options['quantidades']), [usuario], [tipo], semente=0)
+            ImagemOcorrencia.objects.bulk_create(
+                ImagemOcorrencia(ocorrencia_id=ocorrencia_id, imagem='ocorrencias/benchmark.jpg')
+                for ocorrencia_id in Ocorrencia.objects.order_by('id').values_list('id', flat=True)[::10])
+
+            for quantidade in options['quantidades']:
+                ocorrencias = Ocorrencia.objects.all()[:quantidade]
+
+                def completo():
+                    return renderer.render(OcorrenciaSerializer(
+                        ocorrencias.prefetch_related('imagens'), many=True, context=contexto).data)
+
+                def rapido():
+                    return renderer.render(OcorrenciaListaRapidaSerializer(
+                        list(ocorrencias.values(*OcorrenciaListaRapidaSerializer.CAMPOS)), context=contexto).data)
+
+                if completo() != rapido():
+                    raise CommandError('As saídas dos serializers são diferentes')
+
+                tempo_completo = medir(completo, options['repeticoes'])
+                tempo_rapido = medir(rapido, options['repeticoes'])
+                self.stdout.write('{:>6} ocorrências: completo {:8.2f} ms, rápido {:8.2f} ms ({:.1f}x)'.format(
+                    quantidade, tempo_completo * 1000, tempo_rapido * 1000, tempo_completo / tempo_rapido))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,276 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+# Limites, em segundos, dos buckets do histograma de duração das requisições.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HISTOGRAMA = 'cidade_ajuda_requisicao_segundos'
+CONTADORES = OrderedDict([
+    ('cidade_ajuda_requisicoes_total', 'Requisições atendidas.'),
+    ('cidade_ajuda_banco_consultas_total', 'Consultas SQL feitas pelas requisições.'),
+    ('cidade_ajuda_banco_segundos_total', 'Tempo gasto nas consultas SQL.'),
+    ('cidade_ajuda_render_segundos_total', 'Tempo gasto renderizando as respostas.'),
+    ('cidade_ajuda_http_externo_segundos_total', 'Tempo gasto em chamadas HTTP a outros serviços.'),
+])
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_local = threading.local()
+_trava = threading.Lock()
+_pid = None
+_arquivo = None
+_gravado_em = 0
+_series = {}
+
+
+class Medicao:
+    """Tempos de uma requisição; também é o execute wrapper que mede as consultas SQL dela."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.banco = 0.0
+        self.http = 0.0
+        self.inicio_view = self.fim_view = None
+        self.externo_antes_view = self.externo_view = 0.0
+        self.fim = None
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas += 1
+            self.banco += time.perf_counter() - inicio
+
+    def marcar_inicio_view(self):
+        self.inicio_view = time.perf_counter()
+        self.externo_antes_view = self.banco + self.http
+
+    def marcar_fim_view(self):
+        self.fim_view = time.perf_counter()
+        self.externo_view = self.banco + self.http - self.externo_antes_view
+
+    @property
+    def total(self):
+        return self.fim - self.inicio
+
+    @property
+    def view(self):
+        """Tempo da view sem as consultas e chamadas HTTP feitas dentro dela."""
+        if self.inicio_view is None:
+            return None
+        if self.fim_view is None:
+            return self.fim - self.inicio_view - (self.banco + self.http - self.externo_antes_view)
+        return self.fim_view - self.inicio_view - self.externo_view
+
+    @property
+    def render(self):
+        return self.fim - self.fim_view if self.fim_view is not None else 0.0
+
+    def server_timing(self):
+        partes = ['db;dur={:.1f};desc="{} consultas"'.format(self.banco * 1000, self.consultas)]
+        if self.view is not None:
+            partes.append('view;dur={:.1f}'.format(self.view * 1000))
+        if self.fim_view is not None:
+            partes.append('render;dur={:.1f}'.format(self.render * 1000))
+        if self.http:
+            partes.append('http;dur={:.1f}'.format(self.http * 1000))
+        partes.append('total;dur={:.1f}'.format(self.total * 1000))
+        return ', '.join(partes)
+
+
+def medicao_atual():
+    return getattr(_local, 'medicao', None)
+
+
+@contextmanager
+def medir_http():
+    """Soma a duração do bloco ao tempo de HTTP externo da requisição em andamento."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicao = medicao_atual()
+        if medicao is not None:
+            medicao.http += time.perf_counter() - inicio
+
+
+class MetricasMiddleware:
+    """Mede cada requisição, devolve os tempos no cabeçalho ``Server-Timing`` e os soma às métricas do worker.
+
+    Deve ser o primeiro middleware, para que o tempo total inclua os demais.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        medicao = Medicao()
+        _local.medicao = medicao
+        try:
+            with ExitStack() as pilha:
+                for conexao in connections.all():
+                    pilha.enter_context(conexao.execute_wrapper(medicao))
+                response = self.get_response(request)
+        finally:
+            _local.medicao = None
+
+        medicao.fim = time.perf_counter()
+        response['Server-Timing'] = medicao.server_timing()
+        match = request.resolver_match
+        registrar(medicao, match.view_name if match is not None else 'nao_encontrada', request.method,
+                  response.status_code)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        medicao = medicao_atual()
+        if medicao is not None:
+            medicao.marcar_inicio_view()
+
+    def process_template_response(self, request, response):
+        # Chamado entre a view e a renderização das respostas do DRF.
+        medicao = medicao_atual()
+        if medicao is not None:
+            medicao.marcar_fim_view()
+        return response
+
+
+def _somar(nome, rotulos, valor):
+    serie = _series.setdefault(nome, {})
+    serie[rotulos] = serie.get(rotulos, 0) + valor
+
+
+def _preparar_processo():
+    # Depois de um fork o filho começa com séries vazias e um arquivo próprio.
+    global _pid, _arquivo, _series, _gravado_em
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _arquivo = '{}-{}.json'.format(_pid, uuid.uuid4().hex)
+        _series = {}
+        _gravado_em = time.monotonic()
+
+
+def limpar():
+    global _series
+    with _trava:
+        _series = {}
+
+
+def registrar(medicao, rota, metodo, status):
+    with _trava:
+        _preparar_processo()
+        _somar('cidade_ajuda_requisicoes_total', (rota, metodo, str(status)), 1)
+        _somar('cidade_ajuda_banco_consultas_total', (rota,), medicao.consultas)
+        _somar('cidade_ajuda_banco_segundos_total', (rota,), medicao.banco)
+        _somar('cidade_ajuda_render_segundos_total', (rota,), medicao.render)
+        _somar('cidade_ajuda_http_externo_segundos_total', (rota,), medicao.http)
+
+        # Contagem de cada bucket (o último é o +Inf) seguida da soma das durações.
+        histograma = _series.setdefault(HISTOGRAMA, {}).setdefault((rota, metodo), [0] * (len(BUCKETS) + 2))
+        histograma[bisect_left(BUCKETS, medicao.total)] += 1
+        histograma[-1] += medicao.total
+    gravar()
+
+
+def gravar(forcar=False):
+    """Grava as séries do worker no seu arquivo em ``METRICAS_DIR``, no máximo uma vez por intervalo."""
+    global _gravado_em
+    with _trava:
+        _preparar_processo()
+        if not forcar and time.monotonic() - _gravado_em < settings.METRICAS_INTERVALO:
+            return
+        _gravado_em = time.monotonic()
+        dados = {nome: [[list(rotulos), valor] for rotulos, valor in serie.items()] for nome, serie in _series.items()}
+        arquivo = os.path.join(settings.METRICAS_DIR, _arquivo)
+
+    try:
+        os.makedirs(os.path.dirname(arquivo), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(arquivo), suffix='.tmp', delete=False) as temp:
+            json.dump(dados, temp)
+        os.replace(temp.name, arquivo)
+    except OSError:
+        pass
+
+
+atexit.register(gravar, True)
+
+
+def coletar():
+    """Soma as séries gravadas por todos os workers, descartando arquivos parados há mais que a retenção."""
+    gravar(forcar=True)
+    series = {}
+    limite = time.time() - settings.METRICAS_RETENCAO
+    for caminho in glob.glob(os.path.join(settings.METRICAS_DIR, '*.json')):
+        try:
+            if os.path.getmtime(caminho) < limite:
+                os.remove(caminho)
+                continue
+            with open(caminho) as arquivo:
+                dados = json.load(arquivo)
+        except (OSError, ValueError):
+            continue
+
+        for nome, valores in dados.items():
+            serie = series.setdefault(nome, {})
+            for rotulos, valor in valores:
+                rotulos = tuple(rotulos)
+                if nome == HISTOGRAMA:
+                    atual = serie.setdefault(rotulos, [0] * len(valor))
+                    serie[rotulos] = [a + b for a, b in zip(atual, valor)]
+                else:
+                    serie[rotulos] = serie.get(rotulos, 0) + valor
+    return series
+
+
+def _rotulos(nomes, valores):
+    escapados = (str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for valor in valores)
+    return ','.join('{}="{}"'.format(nome, valor) for nome, valor in zip(nomes, escapados))
+
+
+def formatar(series):
+    """Texto no formato de exposição do Prometheus."""
+    linhas = []
+    for nome, ajuda in CONTADORES.items():
+        nomes_rotulos = ('rota', 'metodo', 'status') if nome == 'cidade_ajuda_requisicoes_total' else ('rota',)
+        linhas += ['# HELP {} {}'.format(nome, ajuda), '# TYPE {} counter'.format(nome)]
+        for rotulos, valor in sorted(series.get(nome, {}).items()):
+            linhas.append('{}{{{}}} {}'.format(nome, _rotulos(nomes_rotulos, rotulos), valor))
+
+    linhas += ['# HELP {} Duração das requisições.'.format(HISTOGRAMA), '# TYPE {} histogram'.format(HISTOGRAMA)]
+    for rotulos, valores in sorted(series.get(HISTOGRAMA, {}).items()):
+        base = _rotulos(('rota', 'metodo'), rotulos)
+        acumulado = 0
+        for limite, quantidade in zip(BUCKETS + ('+Inf',), valores):
+            acumulado += quantidade
+            linhas.append('{}_bucket{{{},le="{}"}} {}'.format(HISTOGRAMA, base, limite, acumulado))
+        linhas.append('{}_sum{{{}}} {}'.format(HISTOGRAMA, base, valores[-1]))
+        linhas.append('{}_count{{{}}} {}'.format(HISTOGRAMA, base, acumulado))
+    return '\n'.join(linhas) + '\n'
+
+
+def _autorizado(request):
+    if settings.METRICAS_TOKEN:
+        autorizacao = request.META.get('HTTP_AUTHORIZATION', '')
+        if constant_time_compare(autorizacao, 'Bearer {}'.format(settings.METRICAS_TOKEN)):
+            return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICAS_IPS
+
+
+def metricas(request):
+    """Métricas no formato do Prometheus, para quem manda o ``METRICAS_TOKEN`` ou vem de um dos ``METRICAS_IPS``."""
+    if not _autorizado(request):
+        return HttpResponseForbidden()
+    return HttpResponse(formatar(coletar()), content_type=CONTENT_TYPE)
@@ -0,0 +1,283 @@
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from email.utils import parsedate_to_datetime
+
+import requests
+from django.conf import settings
+from rest_framework import exceptions
+
+from cidade_ajuda.base.geo import Regiao
+from cidade_ajuda.rest.metricas import medir_http
+
+# Um ``Retry-After`` maior que isso, em segundos, não deixa o circuito aberto por mais tempo.
+RETRY_AFTER_MAXIMO = 60 * 60
+
+_trava = threading.Lock()
+_sessao = None
+_executor = None
+_regioes = OrderedDict()
+# Buscas em andamento por place_id; pedidos simultâneos do mesmo lugar esperam a mesma busca.
+_buscas = {}
+# Requisições esperando o Nominatim neste processo; limitado por ``NOMINATIM_ESPERAS``.
+_esperando = 0
+# Quando o cache em disco foi limpo pela última vez, pelo relógio ``time.monotonic``.
+_limpo_em = None
+
+
+class ServicoIndisponivel(exceptions.APIException):
+    status_code = 503
+    default_detail = 'Serviço de localização indisponível'
+    default_code = 'service_unavailable'
+
+
+class Circuito:
+    """Disjuntor das chamadas ao Nominatim.
+
+    Depois de ``NOMINATIM_CIRCUITO_FALHAS`` falhas seguidas ele abre e as buscas falham na hora, sem chamar o serviço,
+    por ``NOMINATIM_CIRCUITO_ESPERA`` segundos. Passado esse tempo uma única busca de teste é liberada: se ela der
+    certo o circuito fecha, se falhar ele abre de novo. Uma falha com ``espera``, como o ``Retry-After`` de um 429,
+    abre o circuito na hora e por pelo menos esse tempo.
+    """
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self.fechar()
+
+    def fechar(self):
+        with self._trava:
+            self.falhas = 0
+            self.aberto_em = None
+            self.espera = 0
+            self.testando = False
+
+    def permitir(self):
+        with self._trava:
+            if self.aberto_em is None:
+                return True
+            espera = max(settings.NOMINATIM_CIRCUITO_ESPERA, self.espera)
+            if self.testando or time.monotonic() - self.aberto_em < espera:
+                return False
+            self.testando = True
+            return True
+
+    def sucesso(self):
+        self.fechar()
+
+    def falha(self, espera=None):
+        with self._trava:
+            self.falhas += 1
+            self.testando = False
+            self.espera = espera or 0
+            if espera is not None or self.aberto_em is not None or self.falhas >= settings.NOMINATIM_CIRCUITO_FALHAS:
+                self.aberto_em = time.monotonic()
+
+
+circuito = Circuito()
+
+
+def _obter_sessao():
+    global _sessao
+    with _trava:
+        if _sessao is None:
+            adaptador = requests.adapters.HTTPAdapter(pool_maxsize=settings.NOMINATIM_CONEXOES)
+            _sessao = requests.Session()
+            _sessao.mount('http://', adaptador)
+            _sessao.mount('https://', adaptador)
+            _sessao.headers['User-Agent'] = 'CidadeAjuda'
+        return _sessao
+
+
+def _caminho(place_id):
+    return os.path.join(settings.NOMINATIM_CACHE_DIR, '{}.json'.format(place_id))
+
+
+def _ler_disco(place_id):
+    try:
+        caminho = _caminho(place_id)
+        expira_em = os.path.getmtime(caminho) + settings.NOMINATIM_CACHE_TTL
+        if expira_em <= time.time():
+            return None, None
+        with open(caminho) as arquivo:
+            return json.load(arquivo), expira_em
+    except (OSError, ValueError):
+        return None, None
+
+
+def _gravar_disco(place_id, geometria):
+    try:
+        os.makedirs(settings.NOMINATIM_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=settings.NOMINATIM_CACHE_DIR, suffix='.tmp', delete=False) as arquivo:
+            json.dump(geometria, arquivo)
+        os.replace(arquivo.name, _caminho(place_id))
+    except OSError:
+        pass
+    _limpar_disco()
+
+
+def _limpar_disco():
+    """Apaga os arquivos expirados do cache em disco e, acima de ``NOMINATIM_CACHE_ARQUIVOS``, os mais antigos.
+
+    Roda no máximo uma vez a cada ``NOMINATIM_CACHE_LIMPEZA`` segundos, nas threads do pool.
+    """
+    global _limpo_em
+    with _trava:
+        agora = time.monotonic()
+        if _limpo_em is not None and agora - _limpo_em < settings.NOMINATIM_CACHE_LIMPEZA:
+            return
+        _limpo_em = agora
+
+    limite = time.time() - settings.NOMINATIM_CACHE_TTL
+    arquivos = []
+    try:
+        with os.scandir(settings.NOMINATIM_CACHE_DIR) as entradas:
+            for entrada in entradas:
+                try:
+                    arquivos.append((entrada.stat().st_mtime, entrada.path))
+                except OSError:
+                    pass
+    except OSError:
+        return
+
+    # Do mais novo para o mais antigo; os temporários esquecidos por gravações interrompidas também expiram.
+    arquivos.sort(reverse=True)
+    for indice, (modificado_em, caminho) in enumerate(arquivos):
+        if modificado_em <= limite or indice >= settings.NOMINATIM_CACHE_ARQUIVOS:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+
+def _obter_executor():
+    global _executor
+    with _trava:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.NOMINATIM_CONEXOES, thread_name_prefix='nominatim')
+        return _executor
+
+
+def _segundos_retry_after(resposta):
+    """Espera pedida pelo ``Retry-After``, em segundos ou como data HTTP, até ``RETRY_AFTER_MAXIMO``.
+
+    0 se ele não vier ou for inválido.
+    """
+    valor = resposta.headers.get('Retry-After', '')
+    try:
+        segundos = float(valor)
+    except ValueError:
+        try:
+            segundos = parsedate_to_datetime(valor).timestamp() - time.time()
+        except (TypeError, ValueError, OverflowError):
+            return 0
+    if not math.isfinite(segundos):
+        return 0
+    return min(max(segundos, 0), RETRY_AFTER_MAXIMO)
+
+
+def _buscar(place_id):
+    try:
+        resposta = _obter_sessao().get(settings.NOMINATIM_URL, timeout=settings.NOMINATIM_TIMEOUT, params={
+            'place_id': place_id, 'format': 'json', 'polygon_geojson': 1})
+    except requests.RequestException:
+        circuito.falha()
+        raise ServicoIndisponivel()
+
+    if resposta.status_code == 429:
+        circuito.falha(_segundos_retry_after(resposta))
+        raise ServicoIndisponivel()
+    if resposta.status_code >= 500:
+        circuito.falha()
+        raise ServicoIndisponivel()
+    circuito.sucesso()
+
+    try:
+        geometria = resposta.json()['geometry']
+    except (ValueError, KeyError, TypeError):
+        raise exceptions.ParseError('Invalid place id')
+    # Gravada aqui para que uma resposta que chega depois do prazo ainda sirva aos próximos pedidos.
+    _gravar_disco(place_id, geometria)
+    return geometria
+
+
+def _terminar_busca(place_id, busca):
+    with _trava:
+        if _buscas.get(place_id) is busca:
+            del _buscas[place_id]
+
+
+def _buscar_com_prazo(place_id):
+    """Busca a geometria no pool do Nominatim, esperando no máximo ``NOMINATIM_PRAZO`` segundos.
+
+    A thread da requisição só espera; a chamada HTTP roda no pool, que limita as chamadas simultâneas a
+    ``NOMINATIM_CONEXOES``. No máximo ``NOMINATIM_ESPERAS`` requisições esperam ao mesmo tempo, menos que as threads
+    do worker; além disso, ou com o pool cheio ou o circuito aberto, a busca falha na hora e as threads restantes
+    continuam livres para as demais rotas.
+    """
+    global _esperando
+    with _trava:
+        if _esperando >= settings.NOMINATIM_ESPERAS:
+            raise ServicoIndisponivel()
+        _esperando += 1
+    try:
+        return _esperar_busca(place_id)
+    finally:
+        with _trava:
+            _esperando -= 1
+
+
+def _esperar_busca(place_id):
+    executor = _obter_executor()
+    with _trava:
+        busca = _buscas.get(place_id)
+        nova = busca is None
+        if nova:
+            if len(_buscas) >= settings.NOMINATIM_CONEXOES or not circuito.permitir():
+                raise ServicoIndisponivel()
+            busca = _buscas[place_id] = executor.submit(_buscar, place_id)
+    if nova:
+        # Fora da trava: se a busca já terminou, o callback roda nesta thread.
+        busca.add_done_callback(lambda busca: _terminar_busca(place_id, busca))
+
+    try:
+        with medir_http():
+            return busca.result(timeout=settings.NOMINATIM_PRAZO)
+    except TimeoutError:
+        raise ServicoIndisponivel()
+
+
+def limpar_cache_memoria():
+    with _trava:
+        _regioes.clear()
+
+
+def obter_regiao(place_id):
+    """Região do lugar do Nominatim, consultando antes o LRU em memória e o cache em disco."""
+    with _trava:
+        entrada = _regioes.get(place_id)
+        if entrada is not None and entrada[0] > time.time():
+            _regioes.move_to_end(place_id)
+            return entrada[1]
+
+    geometria, expira_em = _ler_disco(place_id)
+    if geometria is None:
+        geometria = _buscar_com_prazo(place_id)
+        expira_em = time.time() + settings.NOMINATIM_CACHE_TTL
+
+    try:
+        regiao = Regiao(geometria)
+    except (AttributeError, TypeError, ValueError):
+        raise exceptions.ParseError('Invalid place id')
+
+    with _trava:
+        _regioes[place_id] = (expira_em, regiao)
+        _regioes.move_to_end(place_id)
+        while len(_regioes) > settings.NOMINATIM_CACHE_REGIOES:
+            _regioes.popitem(last=False)
+
+    return regiao
@@ -0,0 +1,38 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CursorIdPagination(CursorPagination):
+    ordering = 'id'
+
+
+class CursorComentariosPagination(CursorPagination):
+    """Comentários de uma ocorrência em ordem de envio, lidos pelo índice ``(ocorrencia, data_hora)``."""
+    ordering = ('data_hora', 'id')
+
+
+class PaginacaoOpcionalPorCursor(PageNumberPagination):
+    """Paginação por número de página, ou por cursor quando a requisição traz ``?cursor=``.
+
+    A paginação por cursor não faz ``COUNT(*)`` nem ``OFFSET``, então o custo de uma página não depende da sua
+    posição. Um ``?cursor=`` vazio pede a primeira página, e os links ``next``/``previous`` mantêm o modo.
+    """
+    cursor_pagination_class = CursorIdPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginacao_cursor = None
+        if self.cursor_pagination_class.cursor_query_param in request.query_params:
+            self.paginacao_cursor = self.cursor_pagination_class()
+            pagina = self.paginacao_cursor.paginate_queryset(queryset, request, view)
+            self.display_page_controls = self.paginacao_cursor.display_page_controls
+            return pagina
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.paginacao_cursor:
+            return self.paginacao_cursor.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.paginacao_cursor:
+            return self.paginacao_cursor.to_html()
+        return super().to_html()
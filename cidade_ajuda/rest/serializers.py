@@ -1,7 +1,12 @@
+from itertools import islice
+
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 
-from cidade_ajuda.base.models import Tipo, Ocorrencia, Usuario, ImagemOcorrencia, Comentario, ImagemComentario
+from cidade_ajuda.base.cache import obter_tipo
+from cidade_ajuda.base.models import Tipo, Ocorrencia, Usuario, ImagemOcorrencia, Comentario, ImagemComentario, \
+    Interacao
 
 
 class TipoSerializer(serializers.ModelSerializer):
@@ -12,7 +17,32 @@ class TipoSerializer(serializers.ModelSerializer):
         read_only = ['id']
 
 
-class ImagemOcorrenciaSerializer(serializers.ModelSerializer):
+class TipoCacheadoField(serializers.PrimaryKeyRelatedField):
+    """Resolve o tipo pelo cache de tipos em vez de consultar o banco a cada requisição."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            tipo = obter_tipo(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if tipo is None:
+            self.fail('does_not_exist', pk_value=data)
+        return tipo
+
+
+class ImagemSerializer(serializers.ModelSerializer):
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # O original só perde os metadados (como a localização da foto) quando as variantes são geradas. Enquanto
+        # isso, ``processamento_falhou`` diz se ele espera o pool ou uma nova tentativa de ``processar_imagens``.
+        if not instance.miniatura:
+            data['imagem'] = None
+        return data
+
+
+class ImagemOcorrenciaSerializer(ImagemSerializer):
     class Meta:
         model = ImagemOcorrencia
         ordering = ['-id']
@@ -30,6 +60,7 @@ class OcorrenciaSerializer(serializers.ModelSerializer):
     data_hora_criacao = serializers.DateTimeField(read_only=True)
     descricao = serializers.CharField(required=True)
     usuario = serializers.PrimaryKeyRelatedField(read_only=True)
+    tipo = TipoCacheadoField(queryset=Tipo.objects.all())
     imagens = serializers.HyperlinkedRelatedField(many=True, read_only=True,
                                                   view_name='imagemocorrencia-detail')
 
@@ -47,6 +78,60 @@ class OcorrenciaSerializer(serializers.ModelSerializer):
         return message_obj
 
 
+class OcorrenciaListaRapidaSerializer(serializers.BaseSerializer):
+    """Serializa, somente para leitura, uma lista de linhas de ``.values(*CAMPOS)`` de ocorrências.
+
+    A saída é a mesma do ``OcorrenciaSerializer``, mas sem instanciar modelos nem passar pelos campos do DRF: as
+    imagens vêm de uma única consulta e as suas URLs são montadas a partir de uma URL de exemplo.
+    """
+    CAMPOS = [campo for campo in OcorrenciaSerializer.Meta.fields if campo != 'imagens']
+    CAMPOS_DATA_HORA = ['prazo_termino', 'data_hora_criacao']
+    CAMPOS_NUMERICOS = ['latitude', 'longitude']
+    PK_EXEMPLO = 2147483647
+    TAMANHO_LOTE = 500
+
+    def lotes(self, linhas):
+        """Gera as ocorrências serializadas em listas de até ``TAMANHO_LOTE``, consumindo ``linhas`` sob demanda."""
+        data_hora = serializers.DateTimeField()
+        url_exemplo = reverse('imagemocorrencia-detail', kwargs={'pk': self.PK_EXEMPLO},
+                              request=self.context['request'])
+        prefixo, sufixo = url_exemplo.rsplit(str(self.PK_EXEMPLO), 1)
+
+        linhas = iter(linhas)
+        while True:
+            lote = list(islice(linhas, self.TAMANHO_LOTE))
+            if not lote:
+                return
+
+            imagens = {}
+            for ocorrencia_id, imagem_id in ImagemOcorrencia.objects.filter(
+                    ocorrencia_id__in=[linha['id'] for linha in lote]).order_by('id').values_list('ocorrencia', 'id'):
+                imagens.setdefault(ocorrencia_id, []).append('{}{}{}'.format(prefixo, imagem_id, sufixo))
+
+            resultado = []
+            for linha in lote:
+                ocorrencia = {campo: linha[campo] for campo in self.CAMPOS}
+                for campo in self.CAMPOS_DATA_HORA:
+                    ocorrencia[campo] = data_hora.to_representation(ocorrencia[campo])
+                for campo in self.CAMPOS_NUMERICOS:
+                    ocorrencia[campo] = float(ocorrencia[campo])
+                ocorrencia['imagens'] = imagens.get(linha['id'], [])
+                resultado.append(ocorrencia)
+            yield resultado
+
+    def to_representation(self, linhas):
+        return [ocorrencia for lote in self.lotes(linhas) for ocorrencia in lote]
+
+
+class OcorrenciaLoteSerializer(serializers.Serializer):
+    tipo = serializers.IntegerField()
+    transitavel_veiculo = serializers.BooleanField()
+    transitavel_a_pe = serializers.BooleanField()
+    descricao = serializers.CharField(required=True)
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -101,8 +186,28 @@ class ComentarioSerializer(serializers.ModelSerializer):
         fields = ['id', 'texto', 'data_hora', 'usuario', 'ocorrencia']
 
 
-class ImagemComentarioSerializer(serializers.ModelSerializer):
+class ComentarioComImagensSerializer(ComentarioSerializer):
+    """Comentário com as URLs das suas imagens; espera ``imagemcomentario_set`` pré-carregado."""
+    imagens = serializers.HyperlinkedRelatedField(many=True, read_only=True, source='imagemcomentario_set',
+                                                  view_name='imagemcomentario-detail')
+
+    class Meta(ComentarioSerializer.Meta):
+        fields = ComentarioSerializer.Meta.fields + ['imagens']
+
+
+class ImagemComentarioSerializer(ImagemSerializer):
     class Meta:
         model = ImagemComentario
         ordering = ['-id']
         fields = '__all__'
+
+
+class InteracaoSerializer(serializers.ModelSerializer):
+    data_hora = serializers.DateTimeField(read_only=True)
+    usuario = serializers.PrimaryKeyRelatedField(read_only=True)
+    ocorrencia = serializers.PrimaryKeyRelatedField(queryset=Ocorrencia.objects.all())
+
+    class Meta:
+        model = Interacao
+        ordering = ['-id']
+        fields = ['id', 'resposta', 'data_hora', 'usuario', 'ocorrencia']
@@ -0,0 +1,146 @@
+import json
+import shutil
+import tempfile
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+
+class MidiaTemporariaMixin:
+    """Grava os uploads dos testes da classe num ``MEDIA_ROOT`` temporário, apagado no fim."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._midia = tempfile.mkdtemp()
+        cls._configuracoes_midia = override_settings(MEDIA_ROOT=cls._midia)
+        cls._configuracoes_midia.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._configuracoes_midia.disable()
+        shutil.rmtree(cls._midia, ignore_errors=True)
+
+
+def com_varias_conexoes(teste):
+    """Pula o teste quando o banco de testes não aceita várias conexões, como o SQLite em memória.
+
+    O ``test_db_allows_multiple_connections`` do Django vale ``False`` para qualquer SQLite, mesmo em arquivo.
+    """
+    @wraps(teste)
+    def executar(self, *args, **kwargs):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('o banco de testes não aceita várias conexões')
+        return teste(self, *args, **kwargs)
+    return executar
+
+
+class _ServidorHTTP(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ServidorNominatimLocal:
+    """Substituto local do Nominatim para testes e benchmarks.
+
+    Recebe um dicionário ``place_id -> geometria GeoJSON`` e deve ser usado como gerenciador de contexto;
+    ``url`` é o valor a ser usado em ``settings.NOMINATIM_URL``. Com ``retry_after``, responde a tudo com 429 e
+    esse ``Retry-After``.
+    """
+
+    def __init__(self, lugares, atraso=0, retry_after=None):
+        self.lugares = lugares
+        self.atraso = atraso
+        self.retry_after = retry_after
+        self.requisicoes = 0
+        self._servidor = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/details.php'.format(self._servidor.server_port)
+
+    def _responder(self, handler):
+        self.requisicoes += 1
+        if self.atraso:
+            time.sleep(self.atraso)
+
+        try:
+            place_id = int(parse_qs(urlparse(handler.path).query)['place_id'][0])
+        except (KeyError, ValueError):
+            place_id = None
+
+        cabecalhos = {}
+        if self.retry_after is not None:
+            status, dados = 429, {'error': {'code': 429, 'message': 'Too Many Requests'}}
+            cabecalhos['Retry-After'] = str(self.retry_after)
+        elif place_id in self.lugares:
+            status, dados = 200, {'place_id': place_id, 'geometry': self.lugares[place_id]}
+        else:
+            status, dados = 404, {'error': {'code': 404, 'message': 'No place with that place_id found.'}}
+
+        corpo = json.dumps(dados).encode()
+        try:
+            handler.send_response(status)
+            handler.send_header('Content-Type', 'application/json')
+            handler.send_header('Content-Length', str(len(corpo)))
+            for nome, valor in cabecalhos.items():
+                handler.send_header(nome, valor)
+            handler.end_headers()
+            handler.wfile.write(corpo)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        servidor_local = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                servidor_local._responder(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._servidor = _ServidorHTTP(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+class OrcamentoConsultasMixin:
+    """Asserções sobre a quantidade de consultas SQL feitas por um endpoint, para uso em ``TestCase``."""
+
+    def contar_consultas(self, requisitar):
+        with CaptureQueriesContext(connection) as contexto:
+            resposta = requisitar()
+        return resposta, contexto.captured_queries
+
+    def assertOrcamentoConsultas(self, maximo, requisitar, aumentar=None):
+        """Falha se ``requisitar()`` fizer mais de ``maximo`` consultas.
+
+        Com ``aumentar``, que deve acrescentar linhas à resposta, também falha se a quantidade de consultas mudar
+        depois dele, o que indica consultas por linha (N+1). Cada medição é precedida de uma requisição que aquece
+        os caches, então o que se mede é o custo em regime.
+        """
+        requisitar()
+        resposta, consultas = self.contar_consultas(requisitar)
+        self.assertLess(resposta.status_code, 400, resposta.content)
+        self.assertLessEqual(len(consultas), maximo, '\n'.join(consulta['sql'] for consulta in consultas))
+
+        if aumentar is not None:
+            aumentar()
+            requisitar()
+            resposta, consultas_depois = self.contar_consultas(requisitar)
+            self.assertLess(resposta.status_code, 400, resposta.content)
+            self.assertEqual(len(consultas_depois), len(consultas), 'Consultas crescem com o tamanho da resposta:\n' +
+                             '\n'.join(consulta['sql'] for consulta in consultas_depois))
+        return resposta
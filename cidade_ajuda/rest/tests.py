@@ -1,12 +1,44 @@
+import csv
 import json
+import os
 import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
-
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.urls import get_resolver, reverse
+from django.test import Client, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 from PIL import Image
 from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase, APIClient
 
-from cidade_ajuda.base.models import Usuario, Tipo, Ocorrencia, Comentario
+from cidade_ajuda.base.benchmark import gerar_ocorrencias
+from cidade_ajuda.base.cache import chave_token
+from cidade_ajuda.base.geo import limites_tile
+from cidade_ajuda.base.imagens import gerar_variantes
+from cidade_ajuda.base.storage import armazenamento_imagens
+from cidade_ajuda.base.models import Usuario, Tipo, Ocorrencia, Comentario, Interacao, ImagemOcorrencia, \
+    ImagemComentario, ReferenciaArquivo, DensidadeOcorrencias
+from cidade_ajuda.rest.exportacao import TAMANHO_LOTE_EXPORTACAO
+from cidade_ajuda.rest.metricas import limpar as limpar_metricas
+from cidade_ajuda.rest import nominatim
+from cidade_ajuda.rest.nominatim import circuito, limpar_cache_memoria, obter_regiao
+from cidade_ajuda.rest.serializers import OcorrenciaSerializer
+from cidade_ajuda.rest.testing import MidiaTemporariaMixin, OrcamentoConsultasMixin, ServidorNominatimLocal, \
+    com_varias_conexoes
+from cidade_ajuda.rest.urls import router
+from cidade_ajuda.rest.tiles import codificar_tile, decodificar_tile
 
 
 class UsuarioTest(APITestCase):
@@ -122,6 +154,30 @@ class UsuarioTest(APITestCase):
         self.assertEqual(request.status_code, status.HTTP_403_FORBIDDEN)
 
 
+class TipoTest(APITestCase):
+    def setUp(self):
+        self.tipo = Tipo.objects.create(titulo='Alagamento', sugestao_descricao='Tamanho, correnteza',
+                                        duracao=timedelta(hours=6))
+
+    def test_listar_tipos_sem_consultas(self):
+        self.client.get('/api/tipos/')
+
+        with self.assertNumQueries(0):
+            request = self.client.get('/api/tipos/')
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([tipo['titulo'] for tipo in request.data['results']], ['Alagamento'])
+
+    def test_listar_tipos_apos_alteracao(self):
+        self.client.get('/api/tipos/')
+        self.tipo.titulo = 'Enchente'
+        self.tipo.save()
+
+        request = self.client.get('/api/tipos/')
+
+        self.assertEqual([tipo['titulo'] for tipo in request.data['results']], ['Enchente'])
+
+
 class OcorrenciaTest(APITestCase):
     def setUp(self):
         self.client = APIClient()
@@ -233,6 +289,275 @@ class OcorrenciaTest(APITestCase):
 
         self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_listar_ocorrencias_na_area(self):
+        Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='dentro', latitude=-17.7,
+                                  longitude=179.9)
+        Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='fora', latitude=-17.7,
+                                  longitude=10)
+
+        request = self.client.get('/api/ocorrencias/', {'southWest[]': [-18, 179], 'northEast[]': [-17, -179]})
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([ocorrencia['descricao'] for ocorrencia in request.data['results']], ['dentro'])
+
+    def test_listar_ocorrencias_em_area_nao_finita(self):
+        for area in ({'southWest[]': ['nan', -48], 'northEast[]': [-21, -46]},
+                     {'southWest[]': [-23, '-inf'], 'northEast[]': [-21, 'inf']}):
+            request = self.client.get('/api/ocorrencias/', area)
+            self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+            request = self.client.get('/api/ocorrencias/clusters/', area)
+            self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_listar_ocorrencias_em_area_fora_do_globo(self):
+        for area in ({'southWest[]': [-91, -48], 'northEast[]': [-21, -46]},
+                     {'southWest[]': [-23, -48], 'northEast[]': [-21, 200]}):
+            request = self.client.get('/api/ocorrencias/', area)
+            self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_listar_somente_ocorrencias_ativas(self):
+        ativa = Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='ativa', latitude=-22,
+                                          longitude=-47)
+        inativa = Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='inativa', latitude=-22,
+                                            longitude=-47)
+        Ocorrencia.objects.filter(id=inativa.id).update(esta_ativa=False)
+
+        request = self.client.get('/api/ocorrencias/')
+        self.assertEqual([ocorrencia['id'] for ocorrencia in request.data['results']], [ativa.id])
+
+        request = self.client.get('/api/ocorrencias/', {'incluir_inativas': 1})
+        self.assertEqual([ocorrencia['id'] for ocorrencia in request.data['results']], [ativa.id, inativa.id])
+
+        request = self.client.get('/api/ocorrencias/{}/'.format(inativa.id))
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+
+    def test_listar_ocorrencias_nao_modificadas(self):
+        ocorrencia = Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição',
+                                               latitude=-22, longitude=-47)
+        area = {'southWest[]': [-23, -48], 'northEast[]': [-21, -46]}
+
+        request = self.client.get('/api/ocorrencias/', area)
+        etag = request['ETag']
+
+        request = self.client.get('/api/ocorrencias/', area, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(request.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Interacao.objects.create(usuario=self.usuario, ocorrencia=ocorrencia, resposta='IN')
+
+        request = self.client.get('/api/ocorrencias/', area, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(request.data['results'][0]['quantidade_inexistente'], 1)
+
+    def test_listar_ocorrencias_apos_remocao_nao_usa_if_modified_since(self):
+        ocorrencias = [Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição',
+                                                 latitude=-22, longitude=-47) for _ in range(2)]
+        area = {'southWest[]': [-23, -48], 'northEast[]': [-21, -46]}
+        request = self.client.get('/api/ocorrencias/', area)
+        self.assertNotIn('Last-Modified', request)
+        etag = request['ETag']
+
+        # A remoção não aumenta o maior atualizado_em das ocorrências que continuam na lista.
+        Ocorrencia.objects.filter(id=ocorrencias[0].id).desativar()
+
+        request = self.client.get('/api/ocorrencias/', area, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        request = self.client.get('/api/ocorrencias/', area, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual([ocorrencia['id'] for ocorrencia in request.data['results']], [ocorrencias[1].id])
+
+    def test_detalhar_ocorrencia_nao_modificada(self):
+        ocorrencia = Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição',
+                                               latitude=-22, longitude=-47)
+        url = '/api/ocorrencias/{}/'.format(ocorrencia.id)
+        etag = self.client.get(url)['ETag']
+
+        request = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(request.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Ocorrencia.objects.filter(id=ocorrencia.id).desativar()
+
+        request = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertFalse(request.data['esta_ativa'])
+
+    def test_lista_rapida_igual_ao_serializer(self):
+        ocorrencias = [Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição',
+                                                 latitude=-22.5, longitude=-47) for _ in range(3)]
+        for nome in ['a.jpg', 'b.jpg']:
+            ImagemOcorrencia.objects.create(ocorrencia=ocorrencias[1], imagem='ocorrencias/{}'.format(nome))
+
+        request = self.client.get('/api/ocorrencias/')
+
+        completo = OcorrenciaSerializer(Ocorrencia.objects.all(), many=True, context={'request': request.wsgi_request})
+        self.assertEqual(JSONRenderer().render(request.data['results']), JSONRenderer().render(completo.data))
+        self.assertEqual(len(request.data['results'][1]['imagens']), 2)
+
+    def test_exportacao_ndjson_igual_ao_serializer(self):
+        ocorrencias = [Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição',
+                                                 latitude=-22.5, longitude=-47) for _ in range(3)]
+        ImagemOcorrencia.objects.create(ocorrencia=ocorrencias[1], imagem='ocorrencias/a.jpg')
+
+        request = self.client.get('/api/ocorrencias/', {'format': 'ndjson'})
+
+        self.assertTrue(request.streaming)
+        self.assertEqual(request['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        linhas = b''.join(request.streaming_content).decode().splitlines()
+        completo = OcorrenciaSerializer(Ocorrencia.objects.order_by('id'), many=True,
+                                        context={'request': request.wsgi_request})
+        self.assertEqual([json.loads(linha) for linha in linhas], json.loads(JSONRenderer().render(completo.data)))
+
+    def test_exportacao_csv(self):
+        ocorrencia = Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='com, vírgula',
+                                               latitude=-22.5, longitude=-47)
+
+        request = self.client.get('/api/ocorrencias/', {'format': 'csv'})
+
+        linhas = list(csv.reader(b''.join(request.streaming_content).decode().splitlines()))
+        self.assertEqual(linhas[0], OcorrenciaSerializer.Meta.fields)
+        self.assertEqual(len(linhas), 2)
+        self.assertEqual(linhas[1][0], str(ocorrencia.id))
+        self.assertIn('com, vírgula', linhas[1])
+
+    def test_exportacao_com_memoria_constante(self):
+        def pico(quantidade):
+            Ocorrencia.objects.all().delete()
+            gerar_ocorrencias(quantidade, [self.usuario], [self.tipo], semente=0)
+            request = self.client.get('/api/ocorrencias/', {'format': 'ndjson'})
+            tracemalloc.start()
+            try:
+                tamanho = sum(len(parte) for parte in request.streaming_content)
+                return tamanho, tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        tamanho_pequeno, pico_pequeno = pico(TAMANHO_LOTE_EXPORTACAO * 2)
+        tamanho_grande, pico_grande = pico(TAMANHO_LOTE_EXPORTACAO * 6)
+
+        # Três vezes mais dados, mas o pico de memória continua o de um lote.
+        self.assertGreater(tamanho_grande, tamanho_pequeno * 2.5)
+        self.assertLess(pico_grande, pico_pequeno * 1.25)
+        self.assertLess(pico_grande, 5 * 1024 * 1024)
+
+    @override_settings(ALTERACOES_JANELA=0)
+    def test_alteracoes_desde_token(self):
+        area = {'southWest[]': [-23, -48], 'northEast[]': [-21, -46]}
+        atualizada = Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='atualizada',
+                                               latitude=-22, longitude=-47)
+        desativada = Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='desativada',
+                                               latitude=-22, longitude=-47)
+        Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='fora', latitude=-10,
+                                  longitude=-47)
+
+        request = self.client.get('/api/ocorrencias/changes/', area)
+        self.assertEqual([ocorrencia['id'] for ocorrencia in request.data['criadas']], [atualizada.id, desativada.id])
+        token = request.data['token']
+
+        request = self.client.get('/api/ocorrencias/changes/', dict(area, since=token))
+        self.assertEqual((request.data['criadas'], request.data['atualizadas'], request.data['desativadas']),
+                         ([], [], []))
+        self.assertEqual(request.data['token'], token)
+
+        Interacao.objects.create(usuario=self.usuario, ocorrencia=atualizada, resposta='EX')
+        Ocorrencia.objects.filter(id=desativada.id).desativar()
+        criada = Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='criada', latitude=-22,
+                                           longitude=-47)
+
+        request = self.client.get('/api/ocorrencias/changes/', dict(area, since=token))
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([ocorrencia['id'] for ocorrencia in request.data['criadas']], [criada.id])
+        self.assertEqual([ocorrencia['quantidade_existente'] for ocorrencia in request.data['atualizadas']], [2])
+        self.assertEqual(request.data['desativadas'], [desativada.id])
+        self.assertTrue(request.data['completo'])
+
+    def test_alteracoes_com_token_invalido(self):
+        request = self.client.get('/api/ocorrencias/changes/', {'since': 'abc'})
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_listar_ocorrencias_por_cursor(self):
+        ocorrencias = [Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição',
+                                                 latitude=-22, longitude=-47) for _ in range(12)]
+
+        request = self.client.get('/api/ocorrencias/', {'cursor': ''})
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', request.data)
+        self.assertEqual([ocorrencia['id'] for ocorrencia in request.data['results']],
+                         [ocorrencia.id for ocorrencia in ocorrencias[:10]])
+
+        request = self.client.get(request.data['next'])
+
+        self.assertEqual([ocorrencia['id'] for ocorrencia in request.data['results']],
+                         [ocorrencia.id for ocorrencia in ocorrencias[10:]])
+        self.assertIsNone(request.data['next'])
+
+    def test_agrupar_ocorrencias_no_mundo_inteiro(self):
+        for latitude, longitude in [(-22.01, -47.89), (-22.1, -47.2), (-22.2, -47.5)]:
+            Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição', latitude=latitude,
+                                      longitude=longitude)
+
+        request = self.client.get('/api/ocorrencias/clusters/',
+                                  {'southWest[]': [-90, -180], 'northEast[]': [90, 180], 'zoom': 22})
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([cluster['quantidade'] for cluster in request.data], [3])
+
+    def test_listar_ocorrencias_por_pagina(self):
+        for _ in range(12):
+            Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, descricao='descrição', latitude=-22,
+                                      longitude=-47)
+
+        request = self.client.get('/api/ocorrencias/', {'page': 2})
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(request.data['count'], 12)
+        self.assertEqual(len(request.data['results']), 2)
+
+    def test_agrupar_ocorrencias(self):
+        buraco = Tipo.objects.create(titulo='Buraco', sugestao_descricao='Tamanho do buraco',
+                                     duracao=timedelta(days=1))
+        for latitude, longitude, tipo in [(-22.01, -47.89, self.tipo), (-22.02, -47.88, self.tipo),
+                                          (-22.01, -47.88, buraco), (-21.5, -47.5, buraco)]:
+            Ocorrencia.objects.create(usuario=self.usuario, tipo=tipo, descricao='descrição', latitude=latitude,
+                                      longitude=longitude)
+
+        request = self.client.get('/api/ocorrencias/clusters/',
+                                  {'southWest[]': [-23, -49], 'northEast[]': [-21, -47], 'zoom': 8})
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([(cluster['quantidade'], cluster['tipos']) for cluster in request.data],
+                         [(3, {self.tipo.id: 2, buraco.id: 1}), (1, {buraco.id: 1})])
+        self.assertAlmostEqual(request.data[0]['latitude'], -22.0133, places=4)
+        self.assertAlmostEqual(request.data[0]['longitude'], -47.8833, places=4)
+
+    def test_agrupar_ocorrencias_sem_zoom(self):
+        request = self.client.get('/api/ocorrencias/clusters/', {'southWest[]': [-23, -49], 'northEast[]': [-21, -47]})
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_criar_ocorrencias_em_lote(self):
+        data = [{'tipo': self.tipo.id, 'transitavel_veiculo': True, 'transitavel_a_pe': False,
+                 'descricao': 'primeira', 'latitude': -10, 'longitude': -50},
+                {'tipo': self.tipo.id, 'transitavel_veiculo': True, 'transitavel_a_pe': False,
+                 'descricao': 'fora do mapa', 'latitude': -100, 'longitude': -50},
+                {'tipo': self.tipo.id + 1, 'transitavel_veiculo': True, 'transitavel_a_pe': False,
+                 'descricao': 'tipo inexistente', 'latitude': -10, 'longitude': -50},
+                {'tipo': self.tipo.id, 'transitavel_veiculo': False, 'transitavel_a_pe': True,
+                 'descricao': 'segunda', 'latitude': -10, 'longitude': -50}]
+
+        request = self.client.post('/api/ocorrencias/lote/', data=data, format='json')
+
+        self.assertEqual(request.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(request.data['criadas'], 2)
+        self.assertEqual([erro['indice'] for erro in request.data['erros']], [1, 2])
+        self.assertIn('latitude', request.data['erros'][0]['erros'])
+        self.assertEqual(request.data['erros'][1]['erros'], {'non_field_errors': ['Ocorrencia precisa ter um Tipo']})
+        self.assertEqual(list(Ocorrencia.objects.all().values_list('descricao', flat=True)), ['primeira', 'segunda'])
+
+    def test_criar_ocorrencias_em_lote_sem_lista(self):
+        request = self.client.post('/api/ocorrencias/lote/', data={'descricao': 'sozinha'}, format='json')
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_criar_ocorrencia_sem_estar_logado(self):
         transitavel_veiculo = True
         transitavel_a_pe = False
@@ -249,7 +574,7 @@ class OcorrenciaTest(APITestCase):
         self.assertEqual(request.status_code, status.HTTP_403_FORBIDDEN)
 
 
-class ImagemOcorrenciaTest(APITestCase):
+class ImagemOcorrenciaTest(MidiaTemporariaMixin, APITestCase):
     def setUp(self):
         self.client = APIClient()
 
@@ -289,6 +614,105 @@ class ImagemOcorrenciaTest(APITestCase):
 
         self.assertEqual(request.status_code, status.HTTP_201_CREATED)
 
+    def test_variantes_da_imagem_da_ocorrencia(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'Fabricante'
+        foto = tempfile.NamedTemporaryFile(suffix='.jpg')
+        Image.new('RGB', (2000, 1000)).save(foto, exif=exif)
+        foto.seek(0)
+
+        data = {'imagem': foto, 'ocorrencia': self.ocorrencia.pk}
+        request = self.client.post('/api/imagens-ocorrencias/', data=data, format='multipart')
+        self.assertEqual(request.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(request.data['miniatura'])
+        self.assertIsNone(request.data['imagem'])
+        enviada = ImagemOcorrencia.objects.get(id=request.data['id']).imagem.name
+
+        imagem = ImagemOcorrencia.objects.get(id=request.data['id'])
+        gerar_variantes(imagem)
+
+        request = self.client.get('/api/imagens-ocorrencias/{}/'.format(imagem.id))
+        self.assertRegex(request.data['imagem'], r'/blobs/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertRegex(request.data['miniatura'], r'/blobs/[0-9a-f]{2}/[0-9a-f]{64}\.webp$')
+        self.assertNotEqual(request.data['miniatura'], request.data['reduzida'])
+        with Image.open(imagem.miniatura.path) as miniatura:
+            self.assertEqual((miniatura.format, miniatura.size), ('WEBP', (256, 128)))
+            self.assertNotIn(0x010F, miniatura.getexif())
+        with Image.open(imagem.reduzida.path) as reduzida:
+            self.assertEqual(reduzida.size, (1280, 640))
+        with Image.open(imagem.imagem.path) as original:
+            self.assertEqual((original.format, original.size), ('JPEG', (2000, 1000)))
+            self.assertNotIn(0x010F, original.getexif())
+        # O arquivo enviado, com os metadados, não é mais referenciado e é apagado no commit.
+        self.assertFalse(ReferenciaArquivo.objects.filter(nome=enviada).exists())
+
+    def test_original_maior_que_o_limite_do_webp(self):
+        foto = tempfile.NamedTemporaryFile(suffix='.png')
+        Image.new('RGB', (17000, 17)).save(foto)
+        foto.seek(0)
+        data = {'imagem': foto, 'ocorrencia': self.ocorrencia.pk}
+        request = self.client.post('/api/imagens-ocorrencias/', data=data, format='multipart')
+
+        imagem = ImagemOcorrencia.objects.get(id=request.data['id'])
+        gerar_variantes(imagem)
+
+        with Image.open(imagem.imagem.path) as original:
+            self.assertEqual((original.format, original.size), ('PNG', (4096, 4)))
+
+    def test_falha_ao_gerar_as_variantes(self):
+        data = {'imagem': self.image, 'ocorrencia': self.ocorrencia.pk}
+        request = self.client.post('/api/imagens-ocorrencias/', data=data, format='multipart')
+        self.assertFalse(request.data['processamento_falhou'])
+        imagem = ImagemOcorrencia.objects.get(id=request.data['id'])
+        with open(imagem.imagem.path, 'wb') as arquivo:
+            arquivo.write(b'corrompida')
+
+        call_command('processar_imagens', stdout=StringIO(), stderr=StringIO())
+
+        request = self.client.get('/api/imagens-ocorrencias/{}/'.format(imagem.id))
+        self.assertTrue(request.data['processamento_falhou'])
+        self.assertIsNone(request.data['imagem'])
+
+        self.image.seek(0)
+        with open(imagem.imagem.path, 'wb') as arquivo:
+            arquivo.write(self.image.read())
+        call_command('processar_imagens', stdout=StringIO(), stderr=StringIO())
+
+        request = self.client.get('/api/imagens-ocorrencias/{}/'.format(imagem.id))
+        self.assertFalse(request.data['processamento_falhou'])
+        self.assertIsNotNone(request.data['imagem'])
+
+    def test_imagens_iguais_dividem_o_arquivo(self):
+        for ocorrencia in [self.ocorrencia, self.ocorrencia]:
+            self.image.seek(0)
+            data = {'imagem': self.image, 'ocorrencia': ocorrencia.pk}
+            self.client.post('/api/imagens-ocorrencias/', data=data, format='multipart')
+
+        primeira, segunda = ImagemOcorrencia.objects.order_by('id')
+        self.assertEqual(primeira.imagem.name, segunda.imagem.name)
+        self.assertEqual(ReferenciaArquivo.objects.get(nome=primeira.imagem.name).referencias, 2)
+
+        primeira.delete()
+        self.assertEqual(ReferenciaArquivo.objects.get(nome=segunda.imagem.name).referencias, 1)
+
+        segunda.delete()
+        self.assertFalse(ReferenciaArquivo.objects.exists())
+
+    @override_settings(TAMANHO_MAXIMO_UPLOAD=100)
+    def test_enviar_imagem_maior_que_o_limite(self):
+        data = {'imagem': self.image, 'ocorrencia': self.ocorrencia.pk}
+
+        request = self.client.post('/api/imagens-ocorrencias/', data=data, format='multipart')
+
+        self.assertEqual(request.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(ImagemOcorrencia.objects.exists())
+
+    @override_settings(TAMANHO_MAXIMO_UPLOAD=100)
+    def test_upload_maior_que_o_limite_fora_do_drf(self):
+        request = Client().post(reverse('admin:login'), data={'imagem': self.image})
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_enviar_imagem_da_ocorrencia_sem_estar_logado(self):
         data = {'imagem': self.image, 'ocorrencia': self.ocorrencia.pk}
 
@@ -374,7 +798,7 @@ class ComentarioTest(APITestCase):
         self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
 
 
-class ImagemComentarioTest(APITestCase):
+class ImagemComentarioTest(MidiaTemporariaMixin, APITestCase):
     def setUp(self):
         self.client = APIClient()
 
@@ -413,6 +837,17 @@ class ImagemComentarioTest(APITestCase):
 
         self.assertEqual(request.status_code, status.HTTP_201_CREATED)
 
+    def test_imagem_da_ocorrencia_e_do_comentario_dividem_o_arquivo(self):
+        self.client.post('/api/imagens-ocorrencias/', data={'imagem': self.image, 'ocorrencia': self.ocorrencia.pk},
+                         format='multipart')
+        self.image.seek(0)
+        self.client.post('/api/imagens-comentarios/', data={'imagem': self.image, 'comentario': self.comentario.pk},
+                         format='multipart')
+
+        nome = ImagemOcorrencia.objects.get().imagem.name
+        self.assertEqual(ImagemComentario.objects.get().imagem.name, nome)
+        self.assertEqual(list(ReferenciaArquivo.objects.values_list('nome', 'referencias')), [(nome, 2)])
+
     def test_enviar_imagem_do_comentario_sem_estar_logado(self):
         data = {'imagem': self.image, 'comentario': self.comentario.pk}
 
@@ -440,3 +875,742 @@ class ImagemComentarioTest(APITestCase):
         request = self.client.post('/api/imagens-comentarios/', data=data, format='multipart')
 
         self.assertEqual(request.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class RelatorioTest(APITestCase):
+    QUADRADO = {'type': 'Polygon', 'coordinates': [[[-48, -23], [-47, -23], [-47, -22], [-48, -22], [-48, -23]]]}
+
+    def setUp(self):
+        usuario = Usuario.objects.create(
+            primeiro_nome='Lucas', sobrenome='Nunes', apelido='lucas', data_nascimento=date(1993, 6, 15),
+            email='lucas@mail.com', password='password')
+
+        tipo = Tipo.objects.create(
+            titulo='Alagamento',
+            sugestao_descricao='Você pode falar sobre o tamanho dele, se há correnteza, se há risco de morte, se há '
+                               'risco de contágio de doenças, entre outras informações.',
+            duracao=timedelta(hours=6))
+
+        self.dentro = Ocorrencia.objects.create(usuario=usuario, tipo=tipo, descricao='dentro', latitude=-22.5,
+                                                longitude=-47.5)
+        Ocorrencia.objects.create(usuario=usuario, tipo=tipo, descricao='fora', latitude=-22.5, longitude=-46.5)
+
+        self.cache_dir = tempfile.TemporaryDirectory()
+        limpar_cache_memoria()
+        circuito.fechar()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+        limpar_cache_memoria()
+        circuito.fechar()
+
+    def relatorio(self, servidor, place_id=1, **configuracoes):
+        with self.settings(NOMINATIM_URL=servidor.url, NOMINATIM_CACHE_DIR=self.cache_dir.name, **configuracoes):
+            return self.client.get('/api/relatorio/{}'.format(place_id))
+
+    def test_relatorio(self):
+        with ServidorNominatimLocal({1: self.QUADRADO}) as servidor:
+            request = self.relatorio(servidor)
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([ocorrencia['id'] for ocorrencia in request.data], [self.dentro.id])
+
+    def test_relatorio_ndjson(self):
+        with ServidorNominatimLocal({1: self.QUADRADO}) as servidor, \
+                self.settings(NOMINATIM_URL=servidor.url, NOMINATIM_CACHE_DIR=self.cache_dir.name):
+            request = self.client.get('/api/relatorio/1', {'format': 'ndjson'})
+            linhas = b''.join(request.streaming_content).decode().splitlines()
+
+        self.assertEqual(request['Content-Disposition'], 'attachment; filename="relatorio-1.ndjson"')
+        self.assertEqual([json.loads(linha)['id'] for linha in linhas], [self.dentro.id])
+
+    def test_relatorio_resumo(self):
+        Ocorrencia.objects.filter(id=self.dentro.id).desativar(
+            encerramento=self.dentro.data_hora_criacao + timedelta(hours=1))
+
+        with ServidorNominatimLocal({1: self.QUADRADO}) as servidor, \
+                self.settings(NOMINATIM_URL=servidor.url, NOMINATIM_CACHE_DIR=self.cache_dir.name):
+            request = self.client.get('/api/relatorio/1', {'resumo': 1})
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(request.data['quantidade'], 1)
+        self.assertEqual(request.data['expiradas'], 1)
+        self.assertEqual(request.data['tempo_medio_encerramento'], 3600)
+        self.assertEqual([tipo['tipo'] for tipo in request.data['por_tipo']], [self.dentro.tipo_id])
+
+    def test_relatorio_usa_cache(self):
+        with ServidorNominatimLocal({1: self.QUADRADO}) as servidor:
+            self.relatorio(servidor)
+            self.relatorio(servidor)
+            limpar_cache_memoria()
+            request = self.relatorio(servidor)
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(servidor.requisicoes, 1)
+
+    def test_relatorio_com_cache_expirado(self):
+        with ServidorNominatimLocal({1: self.QUADRADO}) as servidor:
+            self.relatorio(servidor, NOMINATIM_CACHE_TTL=0)
+            self.relatorio(servidor, NOMINATIM_CACHE_TTL=0)
+
+        self.assertEqual(servidor.requisicoes, 2)
+
+    def test_relatorio_de_lugar_inexistente(self):
+        with ServidorNominatimLocal({1: self.QUADRADO}) as servidor:
+            request = self.relatorio(servidor, place_id=2)
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_relatorio_de_lugar_sem_poligono(self):
+        with ServidorNominatimLocal({1: {'type': 'Point', 'coordinates': [-47.5, -22.5]}}) as servidor:
+            request = self.relatorio(servidor)
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_relatorio_com_servico_lento(self):
+        with ServidorNominatimLocal({1: self.QUADRADO}, atraso=1) as servidor:
+            request = self.relatorio(servidor, NOMINATIM_TIMEOUT=(1, 0.1))
+
+        self.assertEqual(request.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_relatorio_respeita_prazo(self):
+        with ServidorNominatimLocal({1: self.QUADRADO}, atraso=1) as servidor:
+            inicio = time.monotonic()
+            request = self.relatorio(servidor, NOMINATIM_TIMEOUT=(5, 5), NOMINATIM_PRAZO=0.1)
+
+        self.assertEqual(request.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertLess(time.monotonic() - inicio, 0.9)
+
+    def test_circuito_aberto_falha_sem_chamar_o_servico(self):
+        with ServidorNominatimLocal({1: self.QUADRADO}, atraso=0.3) as servidor:
+            configuracoes = {'NOMINATIM_TIMEOUT': (1, 0.05), 'NOMINATIM_CIRCUITO_FALHAS': 2}
+            for _ in range(3):
+                request = self.relatorio(servidor, **configuracoes)
+                self.assertEqual(request.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(servidor.requisicoes, 2)
+
+            # Passada a espera, uma busca de teste que dá certo fecha o circuito.
+            request = self.relatorio(servidor, NOMINATIM_CIRCUITO_ESPERA=0)
+            self.assertEqual(request.status_code, status.HTTP_200_OK)
+            self.assertEqual(servidor.requisicoes, 3)
+
+    def test_limite_de_taxa_abre_o_circuito_pelo_retry_after(self):
+        with ServidorNominatimLocal({1: self.QUADRADO}, retry_after=60) as servidor:
+            request = self.relatorio(servidor)
+            self.assertEqual(request.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+            # Mesmo sem ``NOMINATIM_CIRCUITO_ESPERA``, o circuito espera o que o serviço pediu.
+            servidor.retry_after = None
+            request = self.relatorio(servidor, NOMINATIM_CIRCUITO_ESPERA=0)
+            self.assertEqual(request.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(servidor.requisicoes, 1)
+
+    def test_cache_em_disco_apaga_expirados_e_excedentes(self):
+        agora = time.time()
+        for place_id, idade in [(10, 3), (11, 2), (12, 1), (13, 100)]:
+            caminho = os.path.join(self.cache_dir.name, '{}.json'.format(place_id))
+            with open(caminho, 'w') as arquivo:
+                json.dump(self.QUADRADO, arquivo)
+            os.utime(caminho, (agora - idade, agora - idade))
+
+        with ServidorNominatimLocal({1: self.QUADRADO}) as servidor:
+            request = self.relatorio(servidor, NOMINATIM_CACHE_TTL=50, NOMINATIM_CACHE_LIMPEZA=0,
+                                     NOMINATIM_CACHE_ARQUIVOS=3)
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(os.listdir(self.cache_dir.name)), ['1.json', '11.json', '12.json'])
+
+    def test_relatorios_presos_nao_ocupam_todas_as_threads(self):
+        with ServidorNominatimLocal({1: self.QUADRADO, 2: self.QUADRADO}, atraso=1) as servidor, \
+                self.settings(NOMINATIM_URL=servidor.url, NOMINATIM_CACHE_DIR=self.cache_dir.name,
+                              NOMINATIM_ESPERAS=2), \
+                ThreadPoolExecutor(max_workers=2) as executor:
+            presos = [executor.submit(obter_regiao, place_id) for place_id in (1, 1)]
+            while nominatim._esperando < 2:
+                time.sleep(0.01)
+
+            inicio = time.monotonic()
+            relatorio = self.client.get('/api/relatorio/2')
+            tipos = self.client.get('/api/tipos/')
+            self.assertLess(time.monotonic() - inicio, 0.5)
+            self.assertTrue(all(not preso.done() for preso in presos))
+
+        self.assertEqual(relatorio.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(tipos.status_code, status.HTTP_200_OK)
+        self.assertEqual(servidor.requisicoes, 1)
+
+    def test_buscas_simultaneas_do_mesmo_lugar(self):
+        with ServidorNominatimLocal({1: self.QUADRADO}, atraso=0.3) as servidor, \
+                self.settings(NOMINATIM_URL=servidor.url, NOMINATIM_CACHE_DIR=self.cache_dir.name), \
+                ThreadPoolExecutor(max_workers=4) as executor:
+            regioes = list(executor.map(obter_regiao, [1] * 4))
+
+        self.assertEqual(servidor.requisicoes, 1)
+        self.assertTrue(all(regiao is not None for regiao in regioes))
+
+
+class TileTest(APITestCase):
+    def setUp(self):
+        usuario = Usuario.objects.create(
+            primeiro_nome='Lucas', sobrenome='Nunes', apelido='lucas', data_nascimento=date(1993, 6, 15),
+            email='lucas@mail.com', password='password')
+
+        self.tipo = Tipo.objects.create(
+            titulo='Alagamento',
+            sugestao_descricao='Você pode falar sobre o tamanho dele, se há correnteza, se há risco de morte, se há '
+                               'risco de contágio de doenças, entre outras informações.',
+            duracao=timedelta(hours=6))
+
+        self.ocorrencias = [
+            Ocorrencia.objects.create(usuario=usuario, tipo=self.tipo, descricao='descrição', latitude=-22.0087,
+                                      longitude=-47.8909),
+            Ocorrencia.objects.create(usuario=usuario, tipo=self.tipo, descricao='descrição', latitude=-22.0170,
+                                      longitude=-47.8860),
+        ]
+        Ocorrencia.objects.filter(id=self.ocorrencias[1].id).update(esta_ativa=False)
+        Ocorrencia.objects.create(usuario=usuario, tipo=self.tipo, descricao='descrição', latitude=-23.5505,
+                                  longitude=-46.6333)
+
+    def test_tile(self):
+        request = self.client.get('/api/tiles/10/375/576')
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(request['Content-Type'], 'application/vnd.cidadeajuda.tile')
+
+        cabecalho, ocorrencias = decodificar_tile(request.content)
+        self.assertEqual(cabecalho, {'z': 10, 'x': 375, 'y': 576, 'truncado': False})
+        self.assertEqual([(ocorrencia['id'], ocorrencia['tipo'], ocorrencia['esta_ativa']) for ocorrencia in ocorrencias],
+                         [(self.ocorrencias[0].id, self.tipo.id, True), (self.ocorrencias[1].id, self.tipo.id, False)])
+        self.assertAlmostEqual(ocorrencias[0]['latitude'], -22.0087, places=4)
+        self.assertAlmostEqual(ocorrencias[0]['longitude'], -47.8909, places=4)
+
+    def test_tile_nao_modificado(self):
+        etag = self.client.get('/api/tiles/10/375/576')['ETag']
+
+        request = self.client.get('/api/tiles/10/375/576', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(request.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(request['ETag'], etag)
+
+    def test_tile_vazio(self):
+        request = self.client.get('/api/tiles/10/0/0')
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual(decodificar_tile(request.content), ({'z': 10, 'x': 0, 'y': 0, 'truncado': False}, []))
+
+    def test_tile_invalido(self):
+        request = self.client.get('/api/tiles/2/4/0')
+
+        self.assertEqual(request.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tile_abaixo_do_zoom_minimo(self):
+        request = self.client.get('/api/tiles/0/0/0')
+
+        self.assertEqual(request.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tile_truncado(self):
+        conteudo = codificar_tile(10, 375, 576, Ocorrencia.objects.na_area(*limites_tile(10, 375, 576)), limite=1)
+
+        cabecalho, ocorrencias = decodificar_tile(conteudo)
+        self.assertTrue(cabecalho['truncado'])
+        self.assertEqual([ocorrencia['id'] for ocorrencia in ocorrencias], [self.ocorrencias[0].id])
+
+
+class HeatmapTest(APITestCase):
+    def setUp(self):
+        usuario = Usuario.objects.create(
+            primeiro_nome='Lucas', sobrenome='Nunes', apelido='lucas', data_nascimento=date(1993, 6, 15),
+            email='lucas@mail.com', password='password')
+        self.alagamento = Tipo.objects.create(titulo='Alagamento', sugestao_descricao='descrição',
+                                              duracao=timedelta(hours=6))
+        self.buraco = Tipo.objects.create(titulo='Buraco', sugestao_descricao='descrição', duracao=timedelta(days=1))
+
+        for tipo, latitude, longitude in [(self.alagamento, -22.51, -47.51), (self.alagamento, -22.52, -47.52),
+                                          (self.buraco, -22.9, -47.1), (self.buraco, -10, -40)]:
+            Ocorrencia.objects.create(usuario=usuario, tipo=tipo, descricao='descrição', latitude=latitude,
+                                      longitude=longitude)
+        Ocorrencia.objects.filter(latitude=-22.52).desativar()
+
+        self.area = {'southWest[]': [-23, -48], 'northEast[]': [-22, -47]}
+
+    def test_heatmap(self):
+        request = self.client.get('/api/heatmap', dict(self.area, zoom=12))
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([(grupo['quantidade'], grupo['tipos']) for grupo in request.data],
+                         [(1, {self.alagamento.id: 1}), (1, {self.buraco.id: 1})])
+        self.assertAlmostEqual(request.data[0]['latitude'], -22.525)
+
+    def test_heatmap_com_area(self):
+        request = self.client.get('/api/heatmap', {'area': '-23,-48,-22,-47', 'zoom': 12})
+        self.assertEqual(request.data, self.client.get('/api/heatmap', dict(self.area, zoom=12)).data)
+
+        for area in ['-23,-48,-22', '-23,-48,-22,leste', '-23,-48,-22,nan']:
+            request = self.client.get('/api/heatmap', {'area': area, 'zoom': 12})
+            self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_heatmap_do_mundo_inteiro(self):
+        request = self.client.get('/api/heatmap', {'southWest[]': [-90, -180], 'northEast[]': [90, 180], 'zoom': 22})
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([grupo['quantidade'] for grupo in request.data], [2, 1])
+
+    def test_heatmap_agrupado_e_por_tipo(self):
+        request = self.client.get('/api/heatmap', dict(self.area, zoom=2))
+        self.assertEqual([grupo['tipos'] for grupo in request.data], [{self.alagamento.id: 1, self.buraco.id: 1}])
+
+        request = self.client.get('/api/heatmap', dict(self.area, zoom=2, tipo=self.buraco.id))
+        self.assertEqual([grupo['tipos'] for grupo in request.data], [{self.buraco.id: 1}])
+
+    def test_heatmap_sem_area(self):
+        request = self.client.get('/api/heatmap', {'zoom': 2})
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProximasTest(APITestCase):
+    def setUp(self):
+        usuario = Usuario.objects.create(
+            primeiro_nome='Lucas', sobrenome='Nunes', apelido='lucas', data_nascimento=date(1993, 6, 15),
+            email='lucas@mail.com', password='password')
+        tipo = Tipo.objects.create(titulo='Alagamento', sugestao_descricao='descrição', duracao=timedelta(hours=6))
+
+        self.ocorrencias = [Ocorrencia.objects.create(usuario=usuario, tipo=tipo, descricao='descrição',
+                                                      latitude=latitude, longitude=-47.5)
+                            for latitude in (-22.502, -22.501, -22.503, -22.6)]
+        Ocorrencia.objects.filter(id=self.ocorrencias[2].id).desativar()
+
+    def test_proximas(self):
+        request = self.client.get('/api/ocorrencias/proximas/', {'lat': -22.5, 'lon': -47.5, 'raio': 500})
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([ocorrencia['id'] for ocorrencia in request.data],
+                         [self.ocorrencias[1].id, self.ocorrencias[0].id])
+        self.assertAlmostEqual(request.data[0]['distancia'], 111.2, places=1)
+        self.assertEqual(request.data[0]['imagens'], [])
+
+    def test_proximas_limitadas_a_k(self):
+        request = self.client.get('/api/ocorrencias/proximas/', {'lat': -22.5, 'lon': -47.5, 'raio': 20000, 'k': 1})
+
+        self.assertEqual([ocorrencia['id'] for ocorrencia in request.data], [self.ocorrencias[1].id])
+
+    def test_proximas_com_parametros_invalidos(self):
+        for parametros in [{'lat': -22.5}, {'lat': 'a', 'lon': -47.5}, {'lat': 91, 'lon': -47.5},
+                           {'lat': -22.5, 'lon': -47.5, 'raio': 10 ** 6}, {'lat': -22.5, 'lon': -47.5, 'k': 0}]:
+            with self.subTest(parametros=parametros):
+                request = self.client.get('/api/ocorrencias/proximas/', parametros)
+                self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ComentariosDaOcorrenciaTest(APITestCase):
+    def setUp(self):
+        self.usuario = Usuario.objects.create(
+            primeiro_nome='Lucas', sobrenome='Nunes', apelido='lucas', data_nascimento=date(1993, 6, 15),
+            email='lucas@mail.com', password='password')
+        tipo = Tipo.objects.create(titulo='Alagamento', sugestao_descricao='descrição', duracao=timedelta(hours=6))
+        self.ocorrencia, outra = [Ocorrencia.objects.create(usuario=self.usuario, tipo=tipo, descricao='descrição',
+                                                            latitude=-22.5, longitude=-47.5) for _ in range(2)]
+
+        self.comentarios = [Comentario.objects.create(usuario=self.usuario, ocorrencia=self.ocorrencia,
+                                                      texto=str(indice)) for indice in range(12)]
+        Comentario.objects.create(usuario=self.usuario, ocorrencia=outra, texto='outra')
+        self.imagem = ImagemComentario.objects.create(comentario=self.comentarios[0], imagem='comentarios/a.jpg')
+
+    def test_comentarios_da_ocorrencia(self):
+        request = self.client.get('/api/ocorrencias/{}/comentarios/'.format(self.ocorrencia.id))
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        self.assertEqual([comentario['texto'] for comentario in request.data['results']],
+                         [str(indice) for indice in range(10)])
+        self.assertEqual(request.data['results'][0]['imagens'],
+                         ['http://testserver/api/imagens-comentarios/{}/'.format(self.imagem.id)])
+        self.assertEqual(request.data['results'][1]['imagens'], [])
+
+        request = self.client.get(request.data['next'])
+        self.assertEqual([comentario['texto'] for comentario in request.data['results']], ['10', '11'])
+        self.assertIsNone(request.data['next'])
+
+    def test_comentarios_de_ocorrencia_inexistente(self):
+        for pk in [0, 'a']:
+            with self.subTest(pk=pk):
+                request = self.client.get('/api/ocorrencias/{}/comentarios/'.format(pk))
+                self.assertEqual(request.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class InteracaoTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+        self.usuario = Usuario.objects.create(
+            primeiro_nome='Ryan', sobrenome='Oliveira', apelido='ryan', data_nascimento=date(1991, 6, 15),
+            email='ryan@mail.com', password='password')
+
+        self.tipo = Tipo.objects.create(
+            titulo='Alagamento',
+            sugestao_descricao='Você pode falar sobre o tamanho dele, se há correnteza, se há risco de morte, se há '
+                               'risco de contágio de doenças, entre outras informações.',
+            duracao=timedelta(hours=6))
+
+        self.ocorrencia = Ocorrencia.objects.create(usuario=self.usuario, tipo=self.tipo, transitavel_veiculo=True,
+                                                    transitavel_a_pe=True, descricao='descrição de exemplo',
+                                                    latitude=30, longitude=50)
+        self.client.login(username='ryan', password='password')
+
+    def test_criar_interacao(self):
+        request = self.client.post('/api/interacoes/', data={'resposta': 'FI', 'ocorrencia': self.ocorrencia.pk})
+
+        self.assertEqual(request.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(request.data['usuario'], self.usuario.pk)
+
+        self.ocorrencia.refresh_from_db()
+        self.usuario.refresh_from_db()
+        self.assertEqual((self.ocorrencia.quantidade_existente, self.ocorrencia.quantidade_inexistente,
+                          self.ocorrencia.quantidade_caso_encerrado), (1, 0, 1))
+        self.assertEqual(self.usuario.quantidade_respostas, 1)
+
+    def test_criar_interacao_repetida(self):
+        self.client.post('/api/interacoes/', data={'resposta': 'IN', 'ocorrencia': self.ocorrencia.pk})
+
+        request = self.client.post('/api/interacoes/', data={'resposta': 'EX', 'ocorrencia': self.ocorrencia.pk})
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+        self.ocorrencia.refresh_from_db()
+        self.assertEqual((self.ocorrencia.quantidade_existente, self.ocorrencia.quantidade_inexistente), (1, 1))
+        self.assertEqual(Interacao.objects.count(), 1)
+
+    def test_criar_interacao_com_resposta_invalida(self):
+        request = self.client.post('/api/interacoes/', data={'resposta': 'XX', 'ocorrencia': self.ocorrencia.pk})
+
+        self.assertEqual(request.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_criar_interacao_sem_estar_logado(self):
+        request = APIClient().post('/api/interacoes/', data={'resposta': 'EX', 'ocorrencia': self.ocorrencia.pk})
+
+        self.assertIn(request.status_code, [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+
+
+class ReferenciaArquivoConcorrenteTest(MidiaTemporariaMixin, TransactionTestCase):
+    @skipUnlessDBFeature('has_select_for_update')
+    @com_varias_conexoes
+    def test_reaproveitamento_espera_remocao_do_arquivo(self):
+        conteudo = 'conteúdo {}'.format(time.time()).encode()
+        nome = armazenamento_imagens.save('ocorrencias/a.txt', ContentFile(conteudo))
+        # O último uso do arquivo acabou de ser removido; a remoção do arquivo roda depois do commit.
+        ReferenciaArquivo.objects.filter(nome=nome).delete()
+        reservado, contar = threading.Event(), threading.Event()
+
+        def enviar():
+            try:
+                with transaction.atomic():
+                    self.assertEqual(armazenamento_imagens.save('ocorrencias/b.txt', ContentFile(conteudo)), nome)
+                    reservado.set()
+                    contar.wait(5)
+                    ReferenciaArquivo.objects.adicionar([nome])
+            finally:
+                connection.close()
+
+        def apagar():
+            try:
+                ReferenciaArquivo.objects._apagar_arquivo(nome, armazenamento_imagens)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            envio = executor.submit(enviar)
+            reservado.wait(5)
+            remocao = executor.submit(apagar)
+            time.sleep(0.2)
+            self.assertFalse(remocao.done())
+            contar.set()
+            envio.result()
+            remocao.result()
+
+        self.assertTrue(armazenamento_imagens.exists(nome))
+        self.assertEqual(ReferenciaArquivo.objects.get(nome=nome).referencias, 1)
+        armazenamento_imagens.delete(nome)
+
+
+class InteracaoConcorrenteTest(TransactionTestCase):
+    USUARIOS = 200
+
+    def setUp(self):
+        autor = Usuario.objects.create(
+            primeiro_nome='Ryan', sobrenome='Oliveira', apelido='ryan', data_nascimento=date(1991, 6, 15),
+            email='ryan@mail.com', password='password')
+        tipo = Tipo.objects.create(titulo='Alagamento', sugestao_descricao='descrição', duracao=timedelta(hours=6))
+        self.ocorrencia = Ocorrencia.objects.create(usuario=autor, tipo=tipo, descricao='descrição', latitude=30,
+                                                    longitude=50)
+
+        User.objects.bulk_create([User(username='votante{}'.format(i)) for i in range(self.USUARIOS)])
+        Usuario.objects.bulk_create([Usuario(user=user, data_nascimento=date(1990, 1, 1))
+                                     for user in User.objects.filter(username__startswith='votante')])
+        self.usuarios = list(Usuario.objects.select_related('user').filter(user__username__startswith='votante'))
+
+    @com_varias_conexoes
+    def test_votos_concorrentes(self):
+        respostas = ['EX', 'IN', 'FI']
+
+        def votar(indice):
+            usuario = self.usuarios[indice % self.USUARIOS]
+            try:
+                client = APIClient()
+                client.force_authenticate(usuario.user)
+                return client.post('/api/interacoes/', data={
+                    'resposta': respostas[indice % self.USUARIOS % 3], 'ocorrencia': self.ocorrencia.pk}).status_code
+            finally:
+                connection.close()
+
+        # Cada usuário vota duas vezes, em paralelo com todos os outros.
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            codigos = list(executor.map(votar, range(2 * self.USUARIOS)))
+
+        self.assertEqual(codigos.count(status.HTTP_201_CREATED), self.USUARIOS)
+        self.assertEqual(codigos.count(status.HTTP_400_BAD_REQUEST), self.USUARIOS)
+
+        self.ocorrencia.refresh_from_db()
+        votos = [respostas[i % 3] for i in range(self.USUARIOS)]
+        self.assertEqual(self.ocorrencia.quantidade_existente, 1 + votos.count('EX'))
+        self.assertEqual(self.ocorrencia.quantidade_inexistente, votos.count('IN'))
+        self.assertEqual(self.ocorrencia.quantidade_caso_encerrado, votos.count('FI'))
+        self.assertEqual(Interacao.objects.count(), self.USUARIOS)
+        # As respostas só contam votos: a ocorrência continua ativa e na densidade.
+        self.assertTrue(self.ocorrencia.esta_ativa)
+        self.assertEqual(DensidadeOcorrencias.objects.get(celula=self.ocorrencia.celula).quantidade, 1)
+        self.assertEqual(set(Usuario.objects.filter(user__username__startswith='votante')
+                             .values_list('quantidade_respostas', flat=True)), {1})
+
+
+class OrcamentoConsultasTest(OrcamentoConsultasMixin, APITestCase):
+    """Limite de consultas de cada rota de ``rest/urls.py``; nas listagens ele também não cresce com a página."""
+    ORCAMENTOS = {
+        'api-root': 0,
+        'tipo-list': 0,
+        'tipo-detail': 1,
+        'ocorrencia-list': 4,
+        'ocorrencia-detail': 2,
+        'ocorrencia-clusters': 1,
+        'ocorrencia-changes': 3,
+        'ocorrencia-proximas': 3,
+        'ocorrencia-comentarios': 3,
+        'ocorrencia-lote': 7,
+        'usuario-list': 2,
+        'usuario-detail': 1,
+        'usuario-me': 1,
+        'imagemocorrencia-list': 2,
+        'imagemocorrencia-detail': 1,
+        'comentario-list': 2,
+        'comentario-detail': 1,
+        'imagemcomentario-list': 2,
+        'imagemcomentario-detail': 1,
+        'interacao-list': 2,
+        'interacao-detail': 1,
+        'relatorio': 4,
+        'tile': 1,
+        'heatmap': 1,
+    }
+    QUADRADO = {'type': 'Polygon', 'coordinates': [[[-48, -23], [-47, -23], [-47, -22], [-48, -22], [-48, -23]]]}
+
+    def setUp(self):
+        self.usuario = Usuario.objects.create(
+            primeiro_nome='Lucas', sobrenome='Nunes', apelido='lucas', data_nascimento=date(1993, 6, 15),
+            email='lucas@mail.com', password='password')
+        User.objects.filter(id=self.usuario.user_id).update(is_staff=True)
+        self.usuario.user.refresh_from_db()
+        self.client.force_authenticate(self.usuario.user)
+
+        self.tipo = Tipo.objects.create(titulo='Alagamento', sugestao_descricao='Tamanho, correnteza',
+                                        duracao=timedelta(hours=6))
+        self.linhas = 0
+        self.criar_linhas(1)
+
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        limpar_cache_memoria()
+        self.addCleanup(limpar_cache_memoria)
+
+    def criar_linhas(self, quantidade=10):
+        for _ in range(quantidade):
+            self.linhas += 1
+            usuario = Usuario.objects.create(
+                primeiro_nome='Pedro', sobrenome='Lucas', apelido='pedro{}'.format(self.linhas),
+                data_nascimento=date(1975, 1, 27), email='pedro@mail.com', password='password')
+            self.ocorrencia = Ocorrencia.objects.create(usuario=usuario, tipo=self.tipo, descricao='descrição',
+                                                        latitude=-22.5, longitude=-47.5)
+            ImagemOcorrencia.objects.create(ocorrencia=self.ocorrencia, imagem='ocorrencias/a.jpg')
+            self.comentario = Comentario.objects.create(usuario=usuario, ocorrencia=self.ocorrencia, texto='texto')
+            ImagemComentario.objects.create(comentario=self.comentario, imagem='comentarios/a.jpg')
+            Interacao.objects.create(usuario=self.usuario, ocorrencia=self.ocorrencia, resposta='EX')
+        Tipo.objects.create(titulo='Buraco', sugestao_descricao='Tamanho', duracao=timedelta(days=1))
+
+    def rotas(self):
+        area = {'southWest[]': [-23, -48], 'northEast[]': [-22, -47]}
+        lote = [{'tipo': self.tipo.id, 'transitavel_veiculo': True, 'transitavel_a_pe': True,
+                 'descricao': 'lote', 'latitude': -22.5, 'longitude': -47.5}]
+        # O lote cresce por conta própria: com as linhas acumuladas pelas outras rotas ele passaria do limite de
+        # parâmetros de um INSERT no SQLite, e o bulk_create o dividiria em mais consultas.
+        tamanho_lote = [1]
+
+        def aumentar_lote():
+            tamanho_lote[0] += 10
+
+        primeiro = {'imagem': ImagemOcorrencia.objects.first(), 'imagem_comentario': ImagemComentario.objects.first(),
+                    'interacao': Interacao.objects.first(), 'ocorrencia': Ocorrencia.objects.first()}
+
+        def aumentar_comentarios():
+            for _ in range(10):
+                comentario = Comentario.objects.create(usuario=self.usuario, ocorrencia=primeiro['ocorrencia'],
+                                                       texto='texto')
+                ImagemComentario.objects.create(comentario=comentario, imagem='comentarios/a.jpg')
+
+        return {
+            'api-root': (lambda: self.client.get('/api/'), False),
+            'tipo-list': (lambda: self.client.get('/api/tipos/'), True),
+            'tipo-detail': (lambda: self.client.get('/api/tipos/{}/'.format(self.tipo.id)), False),
+            'ocorrencia-list': (lambda: self.client.get('/api/ocorrencias/', area), True),
+            'ocorrencia-detail': (lambda: self.client.get('/api/ocorrencias/{}/'.format(self.ocorrencia.id)), False),
+            'ocorrencia-clusters': (lambda: self.client.get('/api/ocorrencias/clusters/', dict(area, zoom=10)), True),
+            'ocorrencia-changes': (lambda: self.client.get('/api/ocorrencias/changes/', area), True),
+            'ocorrencia-proximas': (lambda: self.client.get('/api/ocorrencias/proximas/', {'lat': -22.5, 'lon': -47.5}),
+                                    True),
+            'ocorrencia-comentarios': (
+                lambda: self.client.get('/api/ocorrencias/{}/comentarios/'.format(primeiro['ocorrencia'].id)),
+                aumentar_comentarios),
+            'ocorrencia-lote': (lambda: self.client.post('/api/ocorrencias/lote/', lote * tamanho_lote[0],
+                                                         format='json'), aumentar_lote),
+            'usuario-list': (lambda: self.client.get('/api/usuarios/'), True),
+            'usuario-detail': (lambda: self.client.get('/api/usuarios/{}/'.format(self.usuario.id)), False),
+            'usuario-me': (lambda: self.client.get('/api/usuarios/me/'), False),
+            'imagemocorrencia-list': (lambda: self.client.get('/api/imagens-ocorrencias/'), True),
+            'imagemocorrencia-detail': (
+                lambda: self.client.get('/api/imagens-ocorrencias/{}/'.format(primeiro['imagem'].id)), False),
+            'comentario-list': (lambda: self.client.get('/api/comentarios/'), True),
+            'comentario-detail': (lambda: self.client.get('/api/comentarios/{}/'.format(self.comentario.id)), False),
+            'imagemcomentario-list': (lambda: self.client.get('/api/imagens-comentarios/'), True),
+            'imagemcomentario-detail': (
+                lambda: self.client.get('/api/imagens-comentarios/{}/'.format(primeiro['imagem_comentario'].id)),
+                False),
+            'interacao-list': (lambda: self.client.get('/api/interacoes/'), True),
+            'interacao-detail': (lambda: self.client.get('/api/interacoes/{}/'.format(primeiro['interacao'].id)),
+                                 False),
+            'relatorio': (lambda: self.client.get('/api/relatorio/1'), True),
+            'tile': (lambda: self.client.get('/api/tiles/10/375/576'), True),
+            'heatmap': (lambda: self.client.get('/api/heatmap', dict(area, zoom=10)), True),
+        }
+
+    def test_todas_as_rotas_tem_orcamento(self):
+        nomes = {getattr(padrao, 'name', None) for padrao in get_resolver('cidade_ajuda.rest.urls').url_patterns}
+        nomes |= {padrao.name for padrao in router.urls}
+        nomes.discard(None)
+        self.assertEqual(nomes, set(self.ORCAMENTOS))
+
+    def test_orcamento_de_consultas_das_rotas(self):
+        with ServidorNominatimLocal({1: self.QUADRADO}) as servidor, \
+                self.settings(NOMINATIM_URL=servidor.url, NOMINATIM_CACHE_DIR=self.cache_dir.name):
+            for nome, (requisitar, aumentar) in self.rotas().items():
+                # ``aumentar`` é True para as listagens, que crescem com as linhas de ``criar_linhas``.
+                if aumentar is True:
+                    aumentar = self.criar_linhas
+                with self.subTest(rota=nome):
+                    self.assertOrcamentoConsultas(self.ORCAMENTOS[nome], requisitar, aumentar or None)
+
+
+class AutenticacaoTokenTest(APITestCase):
+    def setUp(self):
+        self.usuario = Usuario.objects.create(
+            primeiro_nome='Lucas', sobrenome='Nunes', apelido='lucas', data_nascimento=date(1993, 6, 15),
+            email='lucas@mail.com', password='password')
+        self.token = Token.objects.get(user=self.usuario.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(self.token.key))
+        self.tipo = Tipo.objects.create(titulo='Alagamento', sugestao_descricao='Tamanho', duracao=timedelta(hours=6))
+
+    def test_token_em_cache_dispensa_consultas(self):
+        self.client.get('/api/usuarios/me/')
+
+        # Só a consulta do Usuario, que o cache não guarda.
+        with self.assertNumQueries(1):
+            request = self.client.get('/api/usuarios/me/')
+        self.assertEqual(request.json()['apelido'], 'lucas')
+
+        # Sem o cache seriam também a consulta do token e a do Usuario.
+        self.client.get('/api/tipos/')
+        with CaptureQueriesContext(connection) as consultas:
+            request = self.client.post('/api/ocorrencias/', {
+                'tipo': self.tipo.id, 'transitavel_veiculo': True, 'transitavel_a_pe': True, 'descricao': 'teste',
+                'latitude': -22.5, 'longitude': -47.5}, format='json')
+        self.assertEqual(request.status_code, status.HTTP_201_CREATED, request.data)
+        for tabela in [Token._meta.db_table, Usuario._meta.db_table, User._meta.db_table]:
+            self.assertFalse([consulta for consulta in consultas.captured_queries
+                              if connection.ops.quote_name(tabela) in consulta['sql']], tabela)
+        self.assertEqual(Ocorrencia.objects.get().usuario, self.usuario)
+
+    def test_cache_nao_guarda_token_nem_senha(self):
+        self.client.get('/api/usuarios/me/')
+
+        dados = cache.get(chave_token(self.token.key))
+        self.assertEqual(dados, {'user_id': self.usuario.user.id, 'is_active': True, 'is_staff': False,
+                                 'is_superuser': False, 'usuario_id': self.usuario.id})
+
+    def test_token_removido(self):
+        self.client.get('/api/usuarios/me/')
+        self.token.delete()
+
+        request = self.client.get('/api/usuarios/me/')
+
+        self.assertEqual(request.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_usuario_desativado(self):
+        self.client.get('/api/usuarios/me/')
+        user = self.usuario.user
+        user.is_active = False
+        user.save()
+
+        request = self.client.get('/api/usuarios/me/')
+
+        self.assertEqual(request.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class MetricasTest(APITestCase):
+    def setUp(self):
+        self.metricas_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.metricas_dir.cleanup)
+        configuracoes = self.settings(METRICAS_DIR=self.metricas_dir.name, METRICAS_INTERVALO=0)
+        configuracoes.enable()
+        self.addCleanup(configuracoes.disable)
+        limpar_metricas()
+
+        Tipo.objects.create(titulo='Alagamento', sugestao_descricao='Tamanho', duracao=timedelta(hours=6))
+
+    def test_server_timing(self):
+        request = self.client.get('/api/tipos/1/')
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        timing = request['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="1 consultas", view;dur=[\d.]+, render;dur=[\d.]+, '
+                                 r'total;dur=[\d.]+$')
+
+    def test_metricas_somam_os_workers(self):
+        self.client.get('/api/tipos/1/')
+        with open(os.path.join(self.metricas_dir.name, '1-outro.json'), 'w') as arquivo:
+            json.dump({'cidade_ajuda_requisicoes_total': [[['tipo-detail', 'GET', '200'], 2]],
+                       'cidade_ajuda_requisicao_segundos': [[['tipo-detail', 'GET'], [2] + [0] * 11 + [0.004]]]},
+                      arquivo)
+
+        request = self.client.get('/metrics')
+
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
+        texto = request.content.decode()
+        self.assertIn('cidade_ajuda_requisicoes_total{rota="tipo-detail",metodo="GET",status="200"} 3', texto)
+        self.assertIn('cidade_ajuda_banco_consultas_total{rota="tipo-detail"} 1', texto)
+        self.assertIn('cidade_ajuda_requisicao_segundos_bucket{rota="tipo-detail",metodo="GET",le="+Inf"} 3', texto)
+        self.assertIn('cidade_ajuda_requisicao_segundos_count{rota="tipo-detail",metodo="GET"} 3', texto)
+
+    @override_settings(METRICAS_TOKEN='segredo')
+    def test_metricas_exigem_token_fora_dos_ips_permitidos(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7',
+                                         HTTP_AUTHORIZATION='Bearer errado').status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+        request = self.client.get('/metrics', REMOTE_ADDR='203.0.113.7', HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(request.status_code, status.HTTP_200_OK)
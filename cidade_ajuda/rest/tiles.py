@@ -0,0 +1,74 @@
+"""Tiles binários de ocorrências.
+
+Formato (little-endian):
+
+* cabeçalho ``<4sBBBIII``: ``b'CATL'``, versão, flags, z, x, y e a quantidade ``n`` de ocorrências; o bit 0 das
+  flags indica um tile truncado, com só as ``LIMITE_OCORRENCIAS`` de menor id;
+* ``n`` x ``uint16``: longitudes quantizadas linearmente entre o oeste (0) e o leste (65535) do tile;
+* ``n`` x ``uint16``: latitudes quantizadas linearmente entre o sul (0) e o norte (65535) do tile;
+* ``n`` x ``uint32``: ids das ocorrências;
+* ``n`` x ``uint16``: ids dos tipos;
+* ``ceil(n / 8)`` bytes: ``esta_ativa`` de cada ocorrência, um bit por ocorrência, bit menos significativo primeiro.
+"""
+import struct
+
+import numpy as np
+
+from cidade_ajuda.base.geo import limites_tile
+
+MAGICO = b'CATL'
+VERSAO = 2
+CABECALHO = struct.Struct('<4sBBBIII')
+TRUNCADO = 0x01
+LIMITE_OCORRENCIAS = 5000
+CONTENT_TYPE = 'application/vnd.cidadeajuda.tile'
+ESCALA = 65535
+
+
+def _quantizar(valores, inicio, fim):
+    return np.clip(np.rint((valores - inicio) / (fim - inicio) * ESCALA), 0, ESCALA).astype('<u2')
+
+
+def codificar_tile(zoom, x, y, ocorrencias, limite=LIMITE_OCORRENCIAS):
+    sul, oeste, norte, leste = limites_tile(zoom, x, y)
+    linhas = list(ocorrencias.order_by('id').values_list('id', 'latitude', 'longitude', 'tipo', 'esta_ativa')
+                  [:limite + 1])
+    flags = TRUNCADO if len(linhas) > limite else 0
+    linhas = linhas[:limite]
+
+    dados = np.asarray(linhas, dtype=float).reshape(len(linhas), 5)
+    partes = [
+        CABECALHO.pack(MAGICO, VERSAO, flags, zoom, x, y, len(linhas)),
+        _quantizar(dados[:, 2], oeste, leste).tobytes(),
+        _quantizar(dados[:, 1], sul, norte).tobytes(),
+        dados[:, 0].astype('<u4').tobytes(),
+        dados[:, 3].astype('<u2').tobytes(),
+        np.packbits(dados[:, 4].astype(bool), bitorder='little').tobytes(),
+    ]
+    return b''.join(partes)
+
+
+def decodificar_tile(conteudo):
+    """Inverso de ``codificar_tile``; devolve o cabeçalho e uma lista de dicionários."""
+    magico, versao, flags, zoom, x, y, quantidade = CABECALHO.unpack_from(conteudo)
+    if magico != MAGICO or versao != VERSAO:
+        raise ValueError('Tile inválido')
+
+    sul, oeste, norte, leste = limites_tile(zoom, x, y)
+    posicao = CABECALHO.size
+
+    def ler(tipo, tamanho):
+        nonlocal posicao
+        valores = np.frombuffer(conteudo, dtype=tipo, count=tamanho, offset=posicao)
+        posicao += valores.nbytes
+        return valores
+
+    longitudes = oeste + ler('<u2', quantidade) / ESCALA * (leste - oeste)
+    latitudes = sul + ler('<u2', quantidade) / ESCALA * (norte - sul)
+    ids = ler('<u4', quantidade)
+    tipos = ler('<u2', quantidade)
+    ativas = np.unpackbits(ler('u1', (quantidade + 7) // 8), count=quantidade, bitorder='little')
+
+    ocorrencias = [{'id': int(ids[i]), 'latitude': float(latitudes[i]), 'longitude': float(longitudes[i]),
+                    'tipo': int(tipos[i]), 'esta_ativa': bool(ativas[i])} for i in range(quantidade)]
+    return {'z': zoom, 'x': x, 'y': y, 'truncado': bool(flags & TRUNCADO)}, ocorrencias
@@ -0,0 +1,52 @@
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from rest_framework import exceptions
+from rest_framework.views import exception_handler
+
+
+class ArquivoMuitoGrande(exceptions.APIException):
+    status_code = 413
+    default_detail = 'Arquivo maior que o permitido'
+    default_code = 'request_entity_too_large'
+
+
+def tratar_excecao(exc, context):
+    """``EXCEPTION_HANDLER`` do DRF: corpo ou arquivo grande demais vira 413 em vez do 400 do Django."""
+    if isinstance(exc, RequestDataTooBig):
+        exc = ArquivoMuitoGrande()
+    return exception_handler(exc, context)
+
+
+class UploadComHash(TemporaryFileUploadHandler):
+    """Grava o upload em disco aos pedaços, calculando o SHA-256 e recusando arquivos acima do limite.
+
+    O hash fica em ``arquivo.sha256`` para que o ``ArmazenamentoPorConteudo`` não precise ler o arquivo de novo.
+    O handler vale para todas as views, então recusa com ``RequestDataTooBig``, que o Django responde com 400; nas
+    views do DRF, ``tratar_excecao`` a transforma em 413.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Recusa pelo Content-Length antes de ler o corpo; a folga cobre os cabeçalhos do multipart.
+        if content_length and content_length > settings.TAMANHO_MAXIMO_UPLOAD + 64 * 1024:
+            raise RequestDataTooBig('Arquivo maior que o permitido')
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hash_conteudo = hashlib.sha256()
+        self.recebido = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.recebido += len(raw_data)
+        if self.recebido > settings.TAMANHO_MAXIMO_UPLOAD:
+            self.file.close()
+            raise RequestDataTooBig('Arquivo maior que o permitido')
+        self.hash_conteudo.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        arquivo = super().file_complete(file_size)
+        arquivo.sha256 = self.hash_conteudo.hexdigest()
+        return arquivo
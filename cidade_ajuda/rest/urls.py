@@ -10,8 +10,11 @@ router.register(r'usuarios', views.UsuarioViewSet)
 router.register(r'imagens-ocorrencias', views.ImagemOcorrenciaViewSet)
 router.register(r'comentarios', views.ComentarioViewSet)
 router.register(r'imagens-comentarios', views.ImagemComentarioViewSet)
+router.register(r'interacoes', views.InteracaoViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
-    path('relatorio/<int:place_id>', views.report),
+    path('relatorio/<int:place_id>', views.report, name='relatorio'),
+    path('tiles/<int:z>/<int:x>/<int:y>', views.tile, name='tile'),
+    path('heatmap', views.heatmap, name='heatmap'),
 ]
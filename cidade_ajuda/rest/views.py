@@ -1,20 +1,94 @@
-import requests
-from django.contrib.gis.geos import Point, Polygon
-from django.http import JsonResponse
+import hashlib
+
+from django.db import IntegrityError
+from django.db.models import Prefetch
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from rest_framework.response import Response
 from rest_framework import exceptions
-from rest_framework import viewsets, permissions
-from rest_framework.decorators import action, api_view
-
-from cidade_ajuda.base.models import Tipo, Ocorrencia, Usuario, ImagemOcorrencia, Comentario, ImagemComentario
+from rest_framework import mixins, status, viewsets, permissions
+from rest_framework.decorators import action, api_view, renderer_classes
+from rest_framework.settings import api_settings
+
+from cidade_ajuda.base.cache import obter_tipos
+from cidade_ajuda.base.geo import limites_tile, zoom_na_area
+from cidade_ajuda.base.models import Tipo, Ocorrencia, Usuario, ImagemOcorrencia, Comentario, ImagemComentario, \
+    SequenciaAlteracoes, \
+    Interacao, DensidadeOcorrencias
+from cidade_ajuda.rest.exportacao import FORMATOS_EXPORTACAO, RENDERERS_EXPORTACAO, TAMANHO_LOTE_EXPORTACAO, \
+    resposta_exportacao
+from cidade_ajuda.rest.nominatim import obter_regiao
+from cidade_ajuda.rest.pagination import CursorComentariosPagination
 from cidade_ajuda.rest.serializers import TipoSerializer, OcorrenciaSerializer, UsuarioSerializer, \
-    ImagemOcorrenciaSerializer, ComentarioSerializer, ImagemComentarioSerializer
+    ImagemOcorrenciaSerializer, ComentarioSerializer, ImagemComentarioSerializer, InteracaoSerializer, \
+    OcorrenciaListaRapidaSerializer, OcorrenciaLoteSerializer, ComentarioComImagensSerializer
+from cidade_ajuda.rest.tiles import CONTENT_TYPE, codificar_tile
+
+TAMANHO_LOTE_RELATORIO = 500
+ZOOM_MAXIMO = 22
+# Abaixo dele um tile cobre área demais para trazer ocorrências soltas; o mapa usa os clusters.
+ZOOM_MINIMO_TILE = 10
+TAMANHO_MAXIMO_LOTE = 10000
+LIMITE_ALTERACOES = 1000
+CACHE_CONTROL_TILE = 'public, max-age=60'
+# Em metros.
+RAIO_PADRAO = 1000
+RAIO_MAXIMO = 50000
+K_PADRAO = 20
+K_MAXIMO = 100
+
+
+def ler_area(params):
+    """(sul, oeste, norte, leste) de ``area=sul,oeste,norte,leste`` ou dos parâmetros ``southWest[]`` e
+    ``northEast[]``, ou None se não vierem."""
+    if 'area' in params:
+        erro = 'Invalid area'
+        try:
+            sul, oeste, norte, leste = [float(i) for i in params['area'].split(',')]
+        except ValueError:
+            raise exceptions.ParseError(erro)
+    else:
+        southWest = params.getlist('southWest[]')
+        northEast = params.getlist('northEast[]')
+        if not southWest or not northEast:
+            return None
+        erro = 'Invalid southWest and northEast'
+        try:
+            sul, oeste = [float(i) for i in southWest]
+            norte, leste = [float(i) for i in northEast]
+        except ValueError:
+            raise exceptions.ParseError(erro)
+    # ``float`` aceita 'nan' e 'inf'; as comparações também os recusam.
+    if not (-90 <= sul <= 90 and -90 <= norte <= 90 and -180 <= oeste <= 180 and -180 <= leste <= 180):
+        raise exceptions.ParseError(erro)
+    return sul, oeste, norte, leste
+
+
+def ler_zoom(params):
+    try:
+        zoom = int(params['zoom'])
+    except (KeyError, ValueError):
+        raise exceptions.ParseError('Required zoom')
+    if not 0 <= zoom <= ZOOM_MAXIMO:
+        raise exceptions.ParseError('Invalid zoom')
+    return zoom
 
 
 class TipoViewSet(viewsets.ModelViewSet):
     queryset = Tipo.objects.all()
     serializer_class = TipoSerializer
 
+    def list(self, request, *args, **kwargs):
+        if self.paginator.cursor_pagination_class.cursor_query_param in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        tipos = list(obter_tipos().values())
+        pagina = self.paginate_queryset(tipos)
+        if pagina is not None:
+            return self.get_paginated_response(self.get_serializer(pagina, many=True).data)
+        return Response(self.get_serializer(tipos, many=True).data)
+
 
 class UsuarioViewSet(viewsets.ModelViewSet):
     queryset = Usuario.objects.all()
@@ -34,7 +108,7 @@ class UsuarioViewSet(viewsets.ModelViewSet):
         return [permission() for permission in permission_classes]
 
     def get_queryset(self):
-        return Usuario.objects.order_by('id')
+        return Usuario.objects.select_related('user').order_by('id')
 
     def partial_update(self, request, *args, **kwargs):
         if request.user.id == int(kwargs.get('pk')):
@@ -50,8 +124,8 @@ class UsuarioViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def me(self, request, pk=None):
-        user = self.request.user
-        usuario = Usuario.objects.get(user=user)
+        # O ``request.user`` da autenticação por token só traz os ids.
+        usuario = Usuario.objects.select_related('user').get(id=self.request.user.usuario.id)
         serializer = UsuarioSerializer(usuario, many=False)
         return JsonResponse(serializer.data)
 
@@ -64,22 +138,196 @@ class OcorrenciaViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         try:
-            usuario = Usuario.objects.get(user=self.request.user)
+            usuario = self.request.user.usuario
             serializer.save(usuario=usuario)
         except Usuario.DoesNotExist:
             raise exceptions.PermissionDenied(
                 detail='Precisa ser do tipo usuário')
 
+    @action(detail=False, methods=['post'])
+    def lote(self, request):
+        if not isinstance(request.data, list):
+            raise exceptions.ParseError('Expected a list of ocorrências')
+        if len(request.data) > TAMANHO_MAXIMO_LOTE:
+            raise exceptions.ParseError('At most {} ocorrências per request'.format(TAMANHO_MAXIMO_LOTE))
+
+        try:
+            usuario = self.request.user.usuario
+        except Usuario.DoesNotExist:
+            raise exceptions.PermissionDenied(
+                detail='Precisa ser do tipo usuário')
+
+        serializer = OcorrenciaLoteSerializer()
+        indices, validas, erros = [], [], {}
+        for indice, dados in enumerate(request.data):
+            try:
+                validas.append(serializer.run_validation(dados))
+                indices.append(indice)
+            except exceptions.ValidationError as erro:
+                erros[indice] = erro.detail
+
+        criadas, erros_lote = Ocorrencia.objects.bulk_create_validated(usuario, validas)
+        for posicao, erro in erros_lote.items():
+            erros[indices[posicao]] = {'non_field_errors': [erro]}
+
+        return Response({'criadas': len(criadas),
+                         'erros': [{'indice': indice, 'erros': erros[indice]} for indice in sorted(erros)]},
+                        status=status.HTTP_201_CREATED if criadas else status.HTTP_400_BAD_REQUEST)
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.action == 'list':
+            renderers += [renderer() for renderer in RENDERERS_EXPORTACAO]
+        return renderers
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.resposta_condicional(queryset.assinatura(), lambda: self.listar(queryset))
+
+    def listar(self, queryset):
+        if self.format_kwarg:
+            # Com sufixo de formato as URLs das imagens mudam; esse caso raro fica com o serializer completo.
+            return super().list(self.request)
+
+        linhas = queryset.values(*OcorrenciaListaRapidaSerializer.CAMPOS)
+        if self.request.accepted_renderer.format in FORMATOS_EXPORTACAO:
+            # Exportação: todas as ocorrências, sem paginação, lidas por um cursor e transmitidas aos lotes.
+            serializer = OcorrenciaListaRapidaSerializer(context=self.get_serializer_context())
+            return resposta_exportacao(serializer.lotes(linhas.order_by('id').iterator(TAMANHO_LOTE_EXPORTACAO)),
+                                       OcorrenciaSerializer.Meta.fields, self.request.accepted_renderer.format,
+                                       'ocorrencias')
+        pagina = self.paginate_queryset(linhas)
+        if pagina is not None:
+            serializer = OcorrenciaListaRapidaSerializer(pagina, context=self.get_serializer_context())
+            return self.get_paginated_response(serializer.data)
+        return Response(OcorrenciaListaRapidaSerializer(list(linhas), context=self.get_serializer_context()).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        ocorrencia = self.get_object()
+        assinatura = {'id': ocorrencia.id, 'atualizado_em': ocorrencia.atualizado_em}
+        return self.resposta_condicional(assinatura, lambda: Response(self.get_serializer(ocorrencia).data))
+
+    def resposta_condicional(self, assinatura, gerar_resposta):
+        """Responde 304 pela assinatura das ocorrências, antes de serializá-las, quando o cliente já tem a versão.
+
+        Só o ETag é usado. Um ``Last-Modified`` tirado de ``Max(atualizado_em)`` não muda quando uma ocorrência sai
+        do filtro (desativada, apagada ou movida) e tem resolução de segundos, então um ``If-Modified-Since`` levaria
+        a 304 com a lista já alterada.
+        """
+        chave = '{} {} {}'.format(self.request.build_absolute_uri(), self.request.accepted_renderer.format,
+                                  sorted(assinatura.items()))
+        etag = quote_etag(hashlib.sha1(chave.encode()).hexdigest())
+
+        response = get_conditional_response(self.request, etag=etag)
+        if response is None:
+            response = gerar_resposta()
+        response['ETag'] = etag
+        return response
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """Ocorrências criadas, atualizadas e desativadas na área desde o token ``since``.
+
+        O token é ``sequencia`` ou, quando a resposta não é completa, ``sequencia.id`` da última ocorrência devolvida.
+        """
+        try:
+            posicao = [int(parte) for parte in request.query_params.get('since', '0').split('.')]
+            sequencia, ocorrencia_id = posicao if len(posicao) == 2 else (posicao[0], None)
+        except ValueError:
+            raise exceptions.ParseError('Invalid since')
+
+        # Só até onde todas as alterações já estão visíveis; uma confirmada depois, com valor menor, se perderia.
+        atual = SequenciaAlteracoes.objects.confirmada()
+        alteradas = list(self.get_queryset().alteradas_desde(sequencia, ocorrencia_id, ate=atual)
+                         [:LIMITE_ALTERACOES + 1])
+        completo = len(alteradas) <= LIMITE_ALTERACOES
+        alteradas = alteradas[:LIMITE_ALTERACOES]
+
+        def criada(ocorrencia):
+            if ocorrencia_id is None:
+                return ocorrencia.sequencia_criacao > sequencia
+            return (ocorrencia.sequencia_criacao, ocorrencia.id) > (sequencia, ocorrencia_id)
+
+        ativas = [ocorrencia for ocorrencia in alteradas if ocorrencia.esta_ativa]
+        return Response({
+            'criadas': self.get_serializer([o for o in ativas if criada(o)], many=True).data,
+            'atualizadas': self.get_serializer([o for o in ativas if not criada(o)], many=True).data,
+            'desativadas': [ocorrencia.id for ocorrencia in alteradas if not ocorrencia.esta_ativa],
+            'token': str(max(atual, sequencia)) if completo else '{}.{}'.format(alteradas[-1].sequencia,
+                                                                                alteradas[-1].id),
+            'completo': completo,
+        })
+
+    @action(detail=True, methods=['get'])
+    def comentarios(self, request, pk=None):
+        """Comentários da ocorrência, paginados por cursor em ordem de envio, com as URLs das suas imagens."""
+        if not pk.isdigit() or not Ocorrencia.objects.filter(pk=pk).exists():
+            raise exceptions.NotFound()
+
+        comentarios = Comentario.objects.filter(ocorrencia_id=pk).prefetch_related(
+            Prefetch('imagemcomentario_set', queryset=ImagemComentario.objects.order_by('id').only('id', 'comentario')))
+        paginacao = CursorComentariosPagination()
+        pagina = paginacao.paginate_queryset(comentarios, request, view=self)
+        serializer = ComentarioComImagensSerializer(pagina, many=True, context=self.get_serializer_context())
+        return paginacao.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def proximas(self, request):
+        """As ``k`` ocorrências mais próximas do ponto ``lat``/``lon`` a até ``raio`` metros, com a ``distancia``."""
+        try:
+            latitude = float(request.query_params['lat'])
+            longitude = float(request.query_params['lon'])
+        except (KeyError, ValueError):
+            raise exceptions.ParseError('Required lat and lon')
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise exceptions.ParseError('Invalid lat and lon')
+        try:
+            raio = float(request.query_params.get('raio', RAIO_PADRAO))
+            k = int(request.query_params.get('k', K_PADRAO))
+        except ValueError:
+            raise exceptions.ParseError('Invalid raio or k')
+        if not 0 < raio <= RAIO_MAXIMO:
+            raise exceptions.ParseError('raio must be between 0 and {}'.format(RAIO_MAXIMO))
+        if not 1 <= k <= K_MAXIMO:
+            raise exceptions.ParseError('k must be between 1 and {}'.format(K_MAXIMO))
+
+        proximas = self.get_queryset().proximas(latitude, longitude, raio, k)
+        linhas = {linha['id']: linha for linha in Ocorrencia.objects.filter(
+            id__in=[ocorrencia_id for ocorrencia_id, _ in proximas]).values(*OcorrenciaListaRapidaSerializer.CAMPOS)}
+        # Uma ocorrência apagada entre as duas consultas fica de fora.
+        proximas = [(ocorrencia_id, distancia) for ocorrencia_id, distancia in proximas if ocorrencia_id in linhas]
+
+        serializer = OcorrenciaListaRapidaSerializer([linhas[ocorrencia_id] for ocorrencia_id, _ in proximas],
+                                                     context=self.get_serializer_context())
+        data = serializer.data
+        for ocorrencia, (_, distancia) in zip(data, proximas):
+            ocorrencia['distancia'] = round(distancia, 1)
+        return Response(data)
+
+    def get_area(self):
+        return ler_area(self.request.GET)
+
     def get_queryset(self):
-        if self.request.query_params:
-            southWest = self.request.GET.getlist('southWest[]')
-            northEast = self.request.GET.getlist('northEast[]')
-            if southWest and northEast:
-                southWest = [float(i) for i in southWest]
-                northEast = [float(i) for i in northEast]
-                return self.queryset.filter(latitude__gte=southWest[0], longitude__gte=southWest[1], latitude__lte=northEast[0], longitude__lte=northEast[1])
+        queryset = self.queryset
+        if self.action in ['list', 'clusters', 'proximas'] and \
+                self.request.query_params.get('incluir_inativas') != '1':
+            queryset = queryset.filter(esta_ativa=True)
+        if self.action in ['retrieve', 'update', 'partial_update', 'changes']:
+            queryset = queryset.prefetch_related('imagens')
+
+        area = self.get_area()
+        if area:
+            return queryset.na_area(*area)
+        if 'southWest[]' in self.request.query_params or 'northEast[]' in self.request.query_params:
             raise exceptions.ParseError('Required southWest and northEast')
-        return self.queryset
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def clusters(self, request):
+        area = self.get_area()
+        if not area:
+            raise exceptions.ParseError('Required area or southWest and northEast')
+        return Response(self.get_queryset().agrupar(zoom_na_area(ler_zoom(request.query_params), *area)))
 
 
 class ImagemOcorrenciaViewSet(viewsets.ModelViewSet):
@@ -90,10 +338,10 @@ class ImagemOcorrenciaViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         try:
-            ocorrencia = Ocorrencia.objects.get(
+            ocorrencia = Ocorrencia.objects.select_related('usuario').get(
                 id=self.request.data['ocorrencia'])
 
-            if ocorrencia.usuario.user.username != str(self.request.user):
+            if ocorrencia.usuario.user_id != self.request.user.id:
                 raise exceptions.PermissionDenied(
                     'Somente o criador da ocorrência pode enviar imagens')
 
@@ -110,13 +358,32 @@ class ComentarioViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         try:
-            usuario = Usuario.objects.get(user=self.request.user)
+            usuario = self.request.user.usuario
             serializer.save(usuario=usuario)
         except Usuario.DoesNotExist:
             raise exceptions.PermissionDenied(
                 detail='Precisa ser do tipo usuário')
 
 
+class InteracaoViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                       viewsets.GenericViewSet):
+    queryset = Interacao.objects.all().order_by('id')
+    serializer_class = InteracaoSerializer
+
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+
+    def perform_create(self, serializer):
+        try:
+            usuario = self.request.user.usuario
+            serializer.save(usuario=usuario)
+        except Usuario.DoesNotExist:
+            raise exceptions.PermissionDenied(
+                detail='Precisa ser do tipo usuário')
+        except IntegrityError:
+            raise exceptions.ValidationError(
+                {'ocorrencia': ['Usuário já respondeu esta ocorrência']})
+
+
 class ImagemComentarioViewSet(viewsets.ModelViewSet):
     queryset = ImagemComentario.objects.all()
     serializer_class = ImagemComentarioSerializer
@@ -125,10 +392,10 @@ class ImagemComentarioViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         try:
-            comentario = Comentario.objects.get(
+            comentario = Comentario.objects.select_related('usuario').get(
                 id=self.request.data['comentario'])
 
-            if comentario.usuario.user.username != str(self.request.user):
+            if comentario.usuario.user_id != self.request.user.id:
                 raise exceptions.PermissionDenied(
                     'Somente o criador do comentário pode enviar imagens')
 
@@ -137,21 +404,58 @@ class ImagemComentarioViewSet(viewsets.ModelViewSet):
             raise exceptions.PermissionDenied(detail='Comentário não existe')
 
 @api_view(['GET'])
+@renderer_classes(api_settings.DEFAULT_RENDERER_CLASSES + RENDERERS_EXPORTACAO)
 def report(request,place_id):
-    response = requests.get('https://nominatim.openstreetmap.org/details.php?place_id={}&format=json&polygon_geojson=1'.format(place_id))
-    data = response.json()
+    regiao = obter_regiao(place_id)
+
+    if request.query_params.get('resumo') in ('1', 'true'):
+        return Response(Ocorrencia.objects.all().resumo(Ocorrencia.objects.ids_na_regiao(regiao)))
 
-    if not data['geometry']['type'] == 'Polygon':
-        raise exceptions.ParseError('Invalid place id')
-    
-    points = tuple([(i[0],i[1]) for i in data['geometry']['coordinates'][0]])
-    polygon = Polygon(points)
+    if request.accepted_renderer.format in FORMATOS_EXPORTACAO:
+        linhas = Ocorrencia.objects.all().valores_na_regiao(regiao, OcorrenciaListaRapidaSerializer.CAMPOS,
+                                                            TAMANHO_LOTE_EXPORTACAO)
+        serializer = OcorrenciaListaRapidaSerializer(context={'request': request})
+        return resposta_exportacao(serializer.lotes(linhas), OcorrenciaSerializer.Meta.fields,
+                                   request.accepted_renderer.format, 'relatorio-{}'.format(place_id))
 
     ocorrencias = []
-    for ocorrencia in Ocorrencia.objects.all():
-        ponto = Point(ocorrencia.longitude, ocorrencia.latitude)
-        if polygon.contains(ponto):
-            ocorrencias.append(ocorrencia)
+    for ids in Ocorrencia.objects.ids_na_regiao(regiao):
+        for inicio in range(0, len(ids), TAMANHO_LOTE_RELATORIO):
+            ocorrencias.extend(Ocorrencia.objects.all().filter(id__in=ids[inicio:inicio + TAMANHO_LOTE_RELATORIO])
+                               .values(*OcorrenciaListaRapidaSerializer.CAMPOS))
+
+    serializer = OcorrenciaListaRapidaSerializer(ocorrencias, context={'request': request})
+    return Response(serializer.data)
+
 
-    serializer = OcorrenciaSerializer(ocorrencias, many=True)
-    return Response(serializer.data)
\ No newline at end of file
+@api_view(['GET'])
+def heatmap(request):
+    """Ocorrências ativas por Tipo agrupadas pelo zoom, lidas da densidade já contada em vez das ocorrências."""
+    area = ler_area(request.query_params)
+    if not area:
+        raise exceptions.ParseError('Required area or southWest and northEast')
+    zoom = zoom_na_area(ler_zoom(request.query_params), *area)
+
+    densidade = DensidadeOcorrencias.objects.na_area(*area)
+    tipos = request.query_params.getlist('tipo')
+    if tipos:
+        try:
+            densidade = densidade.filter(tipo__in=[int(tipo) for tipo in tipos])
+        except ValueError:
+            raise exceptions.ParseError('Invalid tipo')
+    return Response(densidade.agrupar(zoom))
+
+
+@api_view(['GET'])
+def tile(request, z, x, y):
+    if z > ZOOM_MAXIMO or x >= 2 ** z or y >= 2 ** z:
+        raise exceptions.NotFound('Invalid tile')
+    if z < ZOOM_MINIMO_TILE:
+        raise exceptions.NotFound('Tiles start at zoom {}; use clusters below it'.format(ZOOM_MINIMO_TILE))
+
+    conteudo = codificar_tile(z, x, y, Ocorrencia.objects.na_area(*limites_tile(z, x, y)))
+
+    response = HttpResponse(conteudo, content_type=CONTENT_TYPE)
+    response['ETag'] = quote_etag(hashlib.sha1(conteudo).hexdigest())
+    response['Cache-Control'] = CACHE_CONTROL_TILE
+    return get_conditional_response(request, etag=response['ETag'], response=response)
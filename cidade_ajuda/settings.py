@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from decouple import config, Csv
 from dj_database_url import parse as db_url
@@ -34,6 +35,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'cidade_ajuda.rest.metricas.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,6 +75,9 @@ DATABASES = {
         cast=db_url
     ),
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Em arquivo, e não em memória, o banco de testes aceita as várias conexões dos testes de concorrência.
+    DATABASES['default']['TEST'] = {'NAME': os.path.join(tempfile.gettempdir(), 'cidade_ajuda_test.sqlite3')}
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -120,14 +125,67 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Uploads são gravados em disco aos pedaços, com hash e limite de tamanho
+FILE_UPLOAD_HANDLERS = ['cidade_ajuda.rest.uploads.UploadComHash']
+TAMANHO_MAXIMO_UPLOAD = config('TAMANHO_MAXIMO_UPLOAD', default=10 * 1024 * 1024, cast=int)
+
+# Threads que geram as variantes das imagens enviadas
+IMAGENS_PROCESSADORES = config('IMAGENS_PROCESSADORES', default=2, cast=int)
+
+# Métricas de cada worker, gravadas em arquivos por processo e somadas pelo /metrics
+METRICAS_DIR = config('METRICAS_DIR', default=os.path.join(tempfile.gettempdir(), 'cidade_ajuda', 'metricas'))
+METRICAS_INTERVALO = config('METRICAS_INTERVALO', default=5, cast=float)
+METRICAS_RETENCAO = config('METRICAS_RETENCAO', default=24 * 60 * 60, cast=int)
+# O /metrics só responde a quem manda ``Authorization: Bearer <METRICAS_TOKEN>`` ou vem de um destes endereços.
+METRICAS_TOKEN = config('METRICAS_TOKEN', default='')
+METRICAS_IPS = config('METRICAS_IPS', default='127.0.0.1,::1', cast=Csv())
+
+# Segundos em que toda transação que escreve ocorrências termina; o /changes só entrega alterações mais velhas
+# que isso quando a sequência de alterações é uma sequence do PostgreSQL.
+ALTERACOES_JANELA = config('ALTERACOES_JANELA', default=5, cast=float)
+
 # API
 CORS_ORIGIN_ALLOW_ALL = True
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'cidade_ajuda.rest.pagination.PaginacaoOpcionalPorCursor',
     'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'cidade_ajuda.rest.authentication.TokenAutenticacaoCacheada',
         'rest_framework.authentication.SessionAuthentication',
-    ]
+    ],
+    'EXCEPTION_HANDLER': 'cidade_ajuda.rest.uploads.tratar_excecao',
 }
+
+# Segundos que a resolução token -> usuário fica no cache
+TOKEN_CACHE_TTL = config('TOKEN_CACHE_TTL', default=60, cast=int)
+
+# Cache compartilhado entre os workers do mesmo servidor
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config('CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'cidade_ajuda', 'cache')),
+    }
+}
+
+# Nominatim
+NOMINATIM_URL = config('NOMINATIM_URL', default='https://nominatim.openstreetmap.org/details.php')
+NOMINATIM_TIMEOUT = (config('NOMINATIM_CONNECT_TIMEOUT', default=3.05, cast=float),
+                     config('NOMINATIM_READ_TIMEOUT', default=10, cast=float))
+NOMINATIM_CONEXOES = config('NOMINATIM_CONEXOES', default=10, cast=int)
+# Threads de cada worker do gunicorn (Procfile). Só uma parte delas pode ficar esperando o Nominatim; com uma só
+# thread, ela também espera, senão o relatório nunca funcionaria.
+GUNICORN_THREADS = config('GUNICORN_THREADS', default=8, cast=int)
+NOMINATIM_ESPERAS = max(1, min(config('NOMINATIM_ESPERAS', default=GUNICORN_THREADS // 2, cast=int),
+                               GUNICORN_THREADS - 1))
+# Tempo máximo que uma requisição espera pelo Nominatim, incluindo conexão e leitura.
+NOMINATIM_PRAZO = config('NOMINATIM_PRAZO', default=10, cast=float)
+NOMINATIM_CIRCUITO_FALHAS = config('NOMINATIM_CIRCUITO_FALHAS', default=5, cast=int)
+NOMINATIM_CIRCUITO_ESPERA = config('NOMINATIM_CIRCUITO_ESPERA', default=30, cast=float)
+NOMINATIM_CACHE_DIR = config('NOMINATIM_CACHE_DIR',
+                             default=os.path.join(tempfile.gettempdir(), 'cidade_ajuda', 'nominatim'))
+NOMINATIM_CACHE_TTL = config('NOMINATIM_CACHE_TTL', default=7 * 24 * 60 * 60, cast=int)
+# O cache em disco é limpo a cada NOMINATIM_CACHE_LIMPEZA segundos, mantendo no máximo NOMINATIM_CACHE_ARQUIVOS.
+NOMINATIM_CACHE_LIMPEZA = config('NOMINATIM_CACHE_LIMPEZA', default=60 * 60, cast=int)
+NOMINATIM_CACHE_ARQUIVOS = config('NOMINATIM_CACHE_ARQUIVOS', default=10000, cast=int)
+NOMINATIM_CACHE_REGIOES = config('NOMINATIM_CACHE_REGIOES', default=128, cast=int)
@@ -5,6 +5,8 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.authtoken.views import obtain_auth_token
 
+from cidade_ajuda.rest.metricas import metricas
+
 international_urls = i18n_patterns(
     path('admin/', admin.site.urls),
 )
@@ -13,6 +15,7 @@ rest_url = [
     path('api/', include('cidade_ajuda.rest.urls')),
     path('api-auth/', include('rest_framework.urls')),
     path('api-token-auth/', obtain_auth_token, name='api_token_auth'),
+    path('metrics', metricas, name='metricas'),
 ]
 
 #static_urls = static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) + \